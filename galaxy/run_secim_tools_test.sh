@@ -56,6 +56,13 @@ echo "\n\n"
 
 #------------------------------------------
 
+echo "Running test_magnitude_difference_flags.py"
+# Golden test of the digit counts against the string method
+python test_magnitude_difference_flags.py
+echo "\n\n"
+
+#------------------------------------------
+
 echo "Running CVflag.py"
 # CV Flag
 python CVflag.py \
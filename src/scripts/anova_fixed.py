@@ -40,6 +40,7 @@ from secimtools.dataManager.interface import wideToDesign
 from secimtools.anovaModules.qqPlot import qqPlot
 from secimtools.anovaModules.volcano import volcano
 from secimtools.anovaModules.runANOVA import runANOVA
+from secimtools.anovaModules.runANOVABatched import runANOVABatched
 from secimtools.anovaModules.preProcessing import preProcessing
 from secimtools.anovaModules.generateDinamicCmbs import generateDinamicCmbs
  
@@ -64,6 +65,9 @@ def getOptions():
             required=True, help="Type of factors to run ANOVA")
     tool.add_argument('-in',"--interactions", dest="interactions", action="store_true", 
             required=False, help="Ask for interactions to run ANOVA")
+    tool.add_argument('-b',"--batched", dest="batched", action="store_true",
+            required=False, help="Fit all the features at once sharing the "\
+            "design matrix instead of one model per feature.")
     # Tool output
     output = parser.add_argument_group(description="Output")
     output.add_argument('-o',"--out", dest="oname", action="store", 
@@ -98,6 +102,13 @@ def main(args):
     # Transpose data
     dat.trans  = dat.transpose()
 
+    # Select ANOVA engine
+    if args.batched:
+        logger.info("Using batched ANOVA engine")
+        anovaEngine = runANOVABatched
+    else:
+        anovaEngine = runANOVA
+
     # if interactions
     if args.interactions:
         logger.info("Running ANOVA on interactions")
@@ -131,7 +142,7 @@ def main(args):
 
         # Running anova
         logger.info('Running anova models')
-        results,significant,residDat,fitDat = runANOVA(dat=dat, categorical=["_treatment_"],
+        results,significant,residDat,fitDat = anovaEngine(dat=dat, categorical=["_treatment_"],
                                 levels=[levels], lvlComb=lvlComb, formula=dictFormula, 
                                 numerical=numerical)
     else:
@@ -149,7 +160,7 @@ def main(args):
 
         # running anova
         logger.info('Running anova models')
-        results,significant,residDat,fitDat = runANOVA(dat=dat, categorical=categorical,
+        results,significant,residDat,fitDat = anovaEngine(dat=dat, categorical=categorical,
                                 levels=levels, lvlComb=lvlComb, formula=dictFormula, 
                                 numerical=numerical)
 
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+################################################################################
+# SCRIPT: benchmark_run_order_drift_correction.py
+#
+# DESCRIPTION: Benchmark of the run order drift correction. The batched
+#              correction (one smoother matrix for all the features) is timed
+#              against fitting the smoother feature by feature on simulated
+#              data, and both results are checked to be the same. The LOESS
+#              smoother is also checked against lowess of statsmodels on
+#              sizes where span * n is not an integer.
+#
+#              Run it from the scripts folder, the defaults are 10000 features
+#              and 1000 injections with a QC every 10 injections:
+#                   python benchmark_run_order_drift_correction.py
+#
+################################################################################
+# Import built-in libraries
+from __future__ import division
+import sys
+import time
+import argparse
+
+# Import add-on libraries
+import numpy as np
+from statsmodels.nonparametric.smoothers_lowess import lowess
+
+# Import script to benchmark
+import run_order_drift_correction as rodc
+
+def getOptions():
+    """ Function to pull in arguments """
+    parser = argparse.ArgumentParser(description="Benchmark of the run order "\
+                                    "drift correction.")
+    parser.add_argument("-f","--features", dest="features", action="store",
+                        type=int, default=10000, help="Number of features "\
+                        "[default=10000].")
+    parser.add_argument("-n","--injections", dest="injections", action="store",
+                        type=int, default=1000, help="Number of injections "\
+                        "[default=1000].")
+    parser.add_argument("-q","--qcEvery", dest="qcEvery", action="store",
+                        type=int, default=10, help="A QC is injected every "\
+                        "this many injections [default=10].")
+    parser.add_argument("-r","--reference", dest="reference", action="store",
+                        type=int, default=500, help="Number of features fitted "\
+                        "one by one, the time of the loop is scaled to all the "\
+                        "features [default=500].")
+    parser.add_argument("-m","--missing", dest="missing", action="store",
+                        type=float, default=0.002, help="Proportion of missing "\
+                        "QC values [default=0.002].")
+    return parser.parse_args()
+
+def simulate(features, injections, qcEvery, missing, seed=0):
+    """
+    Simulate a batch with a multiplicative drift over run order.
+
+    :Returns:
+        :rtype: tuple
+        :return: Run order of the QC injections, run order of all the
+                injections, values of the QC injections, values of all the
+                injections and median of the QC injections of every feature.
+    """
+    random = np.random.RandomState(seed)
+    xAll = np.arange(injections, dtype=float)
+    isQC = np.zeros(injections, dtype=bool)
+    isQC[::qcEvery] = True
+
+    drift = 1 + 1e-4 * xAll + 0.05 * np.sin(xAll / 100)
+    values = np.exp(random.randn(features, 1)) * drift + random.rand(features,
+                                                                   injections)
+    qcValues = values[:, isQC]
+    qcValues[random.rand(*qcValues.shape) < missing] = np.nan
+    values[:, isQC] = qcValues
+    medianQC = np.nanmedian(qcValues, axis=1)
+    return xAll[isQC], xAll, qcValues, values, medianQC
+
+def perFeature(xQC, xAll, valuesQC, values, medianQC, method, params, rows):
+    """ Correct the given rows fitting a smoother for every feature """
+    span, smoothing, segments = params
+    corrected = np.full((len(rows), values.shape[1]), np.nan)
+    for i, row in enumerate(rows):
+        keep = ~np.isnan(valuesQC[row])
+        if keep.sum() < 3:
+            continue
+        if method == "loess":
+            smoother = rodc.loessSmoother(xQC[keep], xAll, span=span)
+        else:
+            smoother = rodc.splineSmoother(xQC[keep], xAll, smoothing=smoothing,
+                                           segments=segments)
+        trend = np.dot(smoother, valuesQC[row, keep])
+        corrected[i] = values[row] / trend * medianQC[row]
+    return corrected
+
+def checkLowess(sizes=(30, 47, 100), spans=(0.3, 0.5, 0.75, 0.9), seed=0):
+    """
+    Largest difference between the LOESS smoother and lowess of statsmodels
+    (without robustness iterations) over the given sizes and spans.
+    """
+    random = np.random.RandomState(seed)
+    difference = 0
+    for n in sizes:
+        x = np.sort(random.choice(np.arange(10 * n), n, replace=False)) * 1.0
+        y = np.exp(random.randn(n))
+        for span in spans:
+            trend = np.dot(rodc.loessSmoother(x, x, span=span), y)
+            reference = lowess(y, x, frac=span, it=0, delta=0,
+                               return_sorted=False)
+            difference = max(difference, np.abs(trend - reference).max())
+    return difference
+
+def main(args):
+    xQC, xAll, valuesQC, values, medianQC = simulate(args.features,
+                            args.injections, args.qcEvery, args.missing)
+    params = (0.75, 1.0, 10)
+    rows = np.arange(min(args.reference, args.features))
+    sys.stdout.write("{0} features x {1} injections ({2} QC)\n".format(
+                     args.features, args.injections, len(xQC)))
+
+    sys.stdout.write("loess   max difference with statsmodels lowess "\
+                     "{0:.1e}\n".format(checkLowess()))
+
+    for method in ["loess", "spline"]:
+        start = time.time()
+        corrected = rodc.correctBatch((xQC, xAll, valuesQC, values, medianQC,
+                                      method, params, "multiplicative"))
+        batched = time.time() - start
+
+        start = time.time()
+        reference = perFeature(xQC, xAll, valuesQC, values, medianQC, method,
+                               params, rows)
+        looped = (time.time() - start) * args.features / len(rows)
+
+        difference = np.nanmax(np.abs(corrected[rows] - reference))
+        same = (np.isnan(corrected[rows]) == np.isnan(reference)).all()
+        sys.stdout.write("{0:7s} batched {1:.2f} s, per feature {2:.1f} s "\
+                         "(estimated), speed-up {3:.0f}x, max difference "\
+                         "{4:.1e}, same missing values: {5}\n".format(method,
+                         batched, looped, looped / batched, difference, same))
+
+if __name__ == '__main__':
+    main(getOptions())
@@ -22,12 +22,15 @@ import os
 import logging
 import argparse
 from itertools import combinations
+from multiprocessing import Pool
 from argparse import RawDescriptionHelpFormatter
 
 # Import add-on libraries
 import matplotlib
+import numpy as np
 import pandas as pd
 matplotlib.use('Agg')
+import scipy.stats as stats
 import statsmodels.api as sm
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
@@ -35,7 +38,7 @@ from statsmodels.sandbox.regression.predstd import wls_prediction_std
 
 # Import local data libraries
 from secimtools.dataManager import logger as sl
-from secimtools.dataManager.flags import Flags
+from secimtools.dataManager.flags import Flags, pairIncidence, summarizePairFlags
 from secimtools.dataManager.interface import wideToDesign
 
 # Import local plotting libraries
@@ -66,6 +69,10 @@ def getOptions():
     comparisons are saved to a pdf specified by (--ba). (2) Bar graphs of
     summarized flags are saved by (--flag_summary).
 
+    Regressions for the pairwise comparisons can be run in parallel with
+    (--jobs). BA plots are drawn after all the flags are computed and can be
+    limited to the comparisons with the most outliers with (--top_plots).
+
     """
     parser = argparse.ArgumentParser(description=description, 
             formatter_class=RawDescriptionHelpFormatter)
@@ -108,6 +115,19 @@ def getOptions():
     tool.add_argument('-ffc',"--feature_flag_cutoff", dest="featureCutoff", 
             action='store', default=.05, type=float, required=False, 
             help="Proportion cutoff value when flagging features [default=0.05].")
+    tool.add_argument('-e',"--engine", dest="engine", action='store',
+            default="analytic", choices=["analytic", "statsmodels"], 
+            required=False, help="Engine used for the regressions. 'analytic' "\
+            "uses closed-form statistics, 'statsmodels' fits a statsmodels OLS "\
+            "model and is kept for verification [default=analytic].")
+    tool.add_argument('-j',"--jobs", dest="jobs", action='store', default=1,
+            type=int, required=False, help="Number of processes used to "\
+            "run the regressions of the pairwise combinations [default=1].")
+    tool.add_argument('-tp',"--top_plots", dest="topPlots", action='store',
+            default=None, type=int, required=False, help="Only draw BA plots "\
+            "for the given number of pairwise combinations with the most "\
+            "flagged features. Use 0 to skip BA plots, the PDF of --figure is not "\
+            "created [default=all].")
 
     group4 = parser.add_argument_group(title='Development Settings')
     group4.add_argument("--debug", dest="debug", action='store_true', 
@@ -118,6 +138,10 @@ def getOptions():
         parser.error('sample_flag_cutoff must be a number between 0 and 1')
     if (args.featureCutoff > 1) | (args.featureCutoff < 0):
         parser.error('feature_flag_cutoff must be a number between 0 and 1')
+    if args.jobs < 1:
+        parser.error('jobs must be a number greater than 0')
+    if (args.topPlots is not None) and (args.topPlots < 0):
+        parser.error('top_plots must be a number greater or equal to 0')
 
     # Standardize paths
     args.input       = os.path.abspath(args.input)
@@ -150,80 +174,18 @@ def summarizeFlags(dat, flags, combos):
             were flagged. The second has the proportion of features flagged.
 
     """
-    # Create a data frame that is the same dimensions as wide. Where each cell
-    # will be the sum of flags.
-    flagSum = pd.DataFrame(index=flags.index, columns=dat.wide.columns)
-    flagSum.fillna(0, inplace=True)
-
-    # Create a data frame that is the same dimensions as wide. Where each cell
-    # is the total number of comparisons.
-    flagTotal = pd.DataFrame(index=flags.index, columns=dat.wide.columns)
-    flagTotal.fillna(0, inplace=True)
-
-    # Create a data frame that is the same dimensions as wide. Where each cell
-    # will be the sum of flags.
-    flagSum_p = pd.DataFrame(index=flags.index, columns=dat.wide.columns)
-    flagSum_p.fillna(0, inplace=True)
-
-    # Create a data frame that is the same dimensions as wide. Where each cell
-    # is the total number of comparisons.
-    flagTotal_p = pd.DataFrame(index=flags.index, columns=dat.wide.columns)
-    flagTotal_p.fillna(0, inplace=True)
-
-    # Create a data frame that is the same dimensions as wide. Where each cell
-    # will be the sum of flags.
-    flagSum_c = pd.DataFrame(index=flags.index, columns=dat.wide.columns)
-    flagSum_c.fillna(0, inplace=True)
-
-    # Create a data frame that is the same dimensions as wide. Where each cell
-    # is the total number of comparisons.
-    flagTotal_c = pd.DataFrame(index=flags.index, columns=dat.wide.columns)
-    flagTotal_c.fillna(0, inplace=True)
-
-    # Create a data frame that is the same dimensions as wide. Where each cell
-    # will be the sum of flags.
-    flagSum_d = pd.DataFrame(index=flags.index, columns=dat.wide.columns)
-    flagSum_d.fillna(0, inplace=True)
-
-    # Create a data frame that is the same dimensions as wide. Where each cell
-    # is the total number of comparisons.
-    flagTotal_d = pd.DataFrame(index=flags.index, columns=dat.wide.columns)
-    flagTotal_d.fillna(0, inplace=True)
-
-    for sampleID in dat.sampleIDs:
-        # Get list of flags that contain the current sampleID
-        flagList = ["flag_{0}_{1}".format(c[0], c[1]) for c in combos if sampleID in c]
-        flagList_p = ["flag_pearson_{0}_{1}".format(c[0], c[1]) for c in combos if sampleID in c]
-        flagList_c = ["flag_cooks_{0}_{1}".format(c[0], c[1]) for c in combos if sampleID in c]
-        flagList_d = ["flag_dffits_{0}_{1}".format(c[0], c[1]) for c in combos if sampleID in c]
-
-        # Sum the flags in flags for the current sampleID
-        flagSum.ix[:, sampleID] = flags[flagList].sum(axis=1).values
-        flagSum_p.ix[:, sampleID] = flags[flagList_p].sum(axis=1).values
-        flagSum_c.ix[:, sampleID] = flags[flagList_c].sum(axis=1).values
-        flagSum_d.ix[:, sampleID] = flags[flagList_d].sum(axis=1).values
-
-        # Get the totals of possible flags in flags for the current sampleID
-        flagTotal.ix[:, sampleID] = flags[flagList].count(axis=1).values
-        flagTotal_p.ix[:, sampleID] = flags[flagList_p].count(axis=1).values
-        flagTotal_c.ix[:, sampleID] = flags[flagList_c].count(axis=1).values
-        flagTotal_d.ix[:, sampleID] = flags[flagList_d].count(axis=1).values
-
-    # Calculate the proportion of samples and features using the marginal sums.
-    propSample = flagSum.sum(axis=0) / flagTotal.sum(axis=0)
-    propFeature = flagSum.sum(axis=1) / flagTotal.sum(axis=1)
-
-    # Calculate the proportion of samples and features using the marginal sums.
-    propSample_p = flagSum_p.sum(axis=0) / flagTotal_p.sum(axis=0)
-    propFeature_p = flagSum_p.sum(axis=1) / flagTotal_p.sum(axis=1)
-    
-    # Calculate the proportion of samples and features using the marginal sums.
-    propSample_c = flagSum_c.sum(axis=0) / flagTotal_c.sum(axis=0)
-    propFeature_c = flagSum_c.sum(axis=1) / flagTotal_c.sum(axis=1)
-
-    # Calculate the proportion of samples and features using the marginal sums.
-    propSample_d = flagSum_d.sum(axis=0) / flagTotal_d.sum(axis=0)
-    propFeature_d = flagSum_d.sum(axis=1) / flagTotal_d.sum(axis=1)
+    # Incidence between comparisons and samples, shared by all flag types
+    incidence = pairIncidence(dat.sampleIDs, combos)
+
+    # Calculate the proportion of samples and features for each flag type
+    propSample, propFeature = summarizePairFlags(flags, dat.sampleIDs,
+                            combos, "flag_{0}_{1}", incidence)
+    propSample_p, propFeature_p = summarizePairFlags(flags, dat.sampleIDs,
+                            combos, "flag_pearson_{0}_{1}", incidence)
+    propSample_c, propFeature_c = summarizePairFlags(flags, dat.sampleIDs,
+                            combos, "flag_cooks_{0}_{1}", incidence)
+    propSample_d, propFeature_d = summarizePairFlags(flags, dat.sampleIDs,
+                            combos, "flag_dffits_{0}_{1}", incidence)
 
     return propSample, propFeature, propSample_p, propFeature_p, propSample_c, propFeature_c, propSample_d, propFeature_d
 
@@ -326,8 +288,9 @@ def buildTitle(dat, xName, yName):
 
     return title
 
-def runRegression(x, y):
-    """ Run a linear regression.
+def runRegressionStatsmodels(x, y):
+    """ Run a linear regression using statsmodels. This is the reference
+    implementation for runRegression.
 
     :Arguments:
         :type x: pandas.Series
@@ -373,8 +336,13 @@ def runRegression(x, y):
 
     return lower, upper, fitted, resid, influence
 
-def makeBA(x, y, ax, fh):
-    """ Function to make BA Plot comparing x vs y.
+def runRegression(x, y, engine="analytic"):
+    """ Run a linear regression of y on x (without intercept).
+
+    The default engine computes the fit, the influence statistics (leverage,
+    Cook's D and its F p-value, DFFITS) and the 95% prediction interval in
+    closed form for all the features at once. The 'statsmodels' engine calls
+    runRegressionStatsmodels instead, both give the same results.
 
     :Arguments:
         :type x: pandas.Series
@@ -383,20 +351,98 @@ def makeBA(x, y, ax, fh):
         :type y: pandas.Series
         :param y: Series of second sample, treated as dependent variables.
 
-        :type ax: matplotlib.axis
-        :param ax: Axis which to plot.
+        :type engine: string
+        :param engine: 'analytic' or 'statsmodels'.
 
-        :type fh: figureHandler
-        :param fh: figure to draw BA plots onto.
+    :Returns:
+        :rtype: tuple of pandas.Series and pandas.DataFrame
+        :returns: A tuple of Series and data frames:
+            * lower (np.array): Values for lower confidence interval.
+            * upper (np.array): Values for upper confidence interval.
+            * fitted (pd.Series): Series of fitted values.
+            * resid (pd.DataFrame): DataFrame containing residuals and Pearson
+              normalized residuals to have unit variance.
+            * influence (pd.DataFrame): DataFrame with Cook's D, its p-value
+              and DFFITS flags.
+
+    """
+    if engine == "statsmodels":
+        return runRegressionStatsmodels(x, y)
+
+    # Drop missing values for the regression
+    y = y.apply(float)
+    x = x.apply(float)
+    keep = x.notnull() & y.notnull()
+    index = x.index[keep.values]
+    x = x.values[keep.values]
+    y = y.values[keep.values]
+
+    # Fit y = b*x, one parameter and n - 1 degrees of freedom
+    nobs = len(x)
+    k = 1
+    dfResid = nobs - k
+    sxx = np.dot(x, x)
+    beta = np.dot(x, y) / sxx
+    fitted = beta * x
+    resid = y - fitted
+    ssr = np.dot(resid, resid)
+    scale = ssr / dfResid
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Leverage
+        hii = x ** 2 / sxx
+
+        # Cook's distance and its p-value
+        cooksD = resid ** 2 / (k * scale) * hii / (1 - hii) ** 2
+        cooksPval = stats.f.sf(cooksD, k, dfResid)
+
+        # DFFITS using the leave one out variance
+        sigma2NotObsi = (ssr - resid ** 2 / (1 - hii)) / (dfResid - 1)
+        dffits = resid / np.sqrt(sigma2NotObsi * (1 - hii)) * np.sqrt(hii / (1 - hii))
+        DF = abs(dffits) > 2 * np.sqrt(k * 1. / nobs)
+
+        # Pearson residuals
+        presid = resid / np.sqrt(scale)
+
+    influence = pd.DataFrame({'cooksD': cooksD, 'cooks_pval': cooksPval, 'dffits': DF},
+                 index=index)
+
+    # Get Residuals
+    resid = pd.DataFrame({'resid': resid, 'resid_pearson': presid}, index=index,
+                columns=['resid', 'resid_pearson'])
+
+    # Get 95% prediction interval
+    prstd = np.sqrt(scale + x ** 2 * scale / sxx)
+    tppf = stats.t.isf(0.05 / 2., dfResid)
+    lower = fitted - tppf * prstd
+    upper = fitted + tppf * prstd
+
+    return lower, upper, pd.Series(fitted, index=index), resid, influence
+
+def runBA(x, y, cutoff, engine="analytic"):
+    """ Run the Bland-Altman regression of x vs y and flag outliers.
+
+    :Arguments:
+        :type x: pandas.Series
+        :param x: Series of first sample, treated as independent variable.
+
+        :type y: pandas.Series
+        :param y: Series of second sample, treated as dependent variables.
+
+        :type cutoff: int
+        :param cutoff: Cutoff value for the Pearson normalized residuals.
+
+        :type engine: string
+        :param engine: Regression engine, see runRegression.
 
     :Returns:
-        :rtype: pandas.Series
-        :returns: A Series containing Boolean values with True
-              indicating a value is more extreme than CI and False indicating a
-              value falls inside CI.
+        :rtype: tuple of pandas.Series
+        :returns: mean and difference of x and y, lower and upper confidence
+            interval and fitted values of the regression, and Boolean masks
+            with True indicating a feature is an outlier (any of the criteria),
+            a Pearson residual outlier, a Cook's D outlier and a DFFITS outlier.
 
     """
-    # Make BA plot
     x = x.apply(float)
     y = y.apply(float)
 
@@ -408,12 +454,45 @@ def makeBA(x, y, ax, fh):
     mean.dropna(inplace=True)
 
     # Get Upper and Lower CI from regression
-    lower, upper, fitted, resid, infl = runRegression(mean, diff)
+    lower, upper, fitted, resid, infl = runRegression(mean, diff, engine=engine)
     mask1 = abs(resid['resid_pearson']) > cutoff
     mask2 = infl['cooks_pval'] <= 0.5
     mask3 = infl['dffits']
     mask  = mask1 | mask2 | mask3
-    
+
+    return mean, diff, lower, upper, fitted, mask, mask1, mask2, mask3
+
+def makeBA(x, y, ax, fh, fit, mask):
+    """ Function to make BA Plot comparing x vs y from the regression of the
+    numeric stage (see flagCombo).
+
+    :Arguments:
+        :type x: pandas.Series
+        :param x: Series of first sample, treated as independent variable.
+
+        :type y: pandas.Series
+        :param y: Series of second sample, treated as dependent variables.
+
+        :type ax: matplotlib.axis
+        :param ax: Axis which to plot.
+
+        :type fh: figureHandler
+        :param fh: figure to draw BA plots onto.
+
+        :type fit: tuple of pandas.Series
+        :param fit: Lower and upper confidence interval and fitted values of
+            the BA regression of x vs y.
+
+        :type mask: pandas.Series
+        :param mask: Outlier flags of x vs y, 1 for outliers.
+
+    """
+    # Mean and difference of the features used on the regression
+    diff = (x.apply(float) - y.apply(float)).dropna()
+    mean = ((x.apply(float) + y.apply(float)) / 2).dropna()
+    lower, upper, fitted = fit
+    mask = mask.loc[mean.index].astype(bool)
+
     # Create BA plot
     scatter.scatter2D(ax=ax, x=mean[~mask], y=diff[~mask],colorList='b')
     scatter.scatter2D(ax=ax, x=mean[mask],  y=diff[mask], colorList='r')
@@ -429,9 +508,7 @@ def makeBA(x, y, ax, fh):
         xTitle='Mean\n{0} & {1}'.format(x.name, y.name),
         yTitle='Difference\n{0} - {1}'.format(x.name, y.name),grid=False)
 
-    return mask, mask1, mask2, mask3
-
-def makeScatter(x, y, ax, fh):
+def makeScatter(x, y, ax, fh, engine="analytic"):
     """ Plot a scatter plot of x vs y.
 
     :Arguments:
@@ -447,6 +524,9 @@ def makeScatter(x, y, ax, fh):
         :type fh: figureHandler
         :param fh: figure to draw BA plots onto.
 
+        :type engine: string
+        :param engine: Regression engine, see runRegression.
+
     :Returns:
         :rtype: matplotlib.axis
         :returns: A matplotlib axis with a scatter plot.
@@ -454,7 +534,7 @@ def makeScatter(x, y, ax, fh):
     """
     #logger.info('{0}, {1}'.format(x.name, y.name))
     # Get Upper and Lower CI from regression
-    lower, upper, fitted, resid, infl = runRegression(x, y)
+    lower, upper, fitted, resid, infl = runRegression(x, y, engine=engine)
 
     # Plot scatter
     scatter.scatter2D(x=x,y=y,ax=ax,colorList = list("b"))
@@ -468,8 +548,122 @@ def makeScatter(x, y, ax, fh):
     # Adjust plot
     fh.formatAxis(axnum=0,xTitle=x.name,yTitle=y.name,axTitle='Scatter plot',grid=False)
 
-def iterateCombo(dat, combo, pdf):
-    """ A function to iterate generate all plots and flags.
+def flagCombo(combo, x, y, cutoff, engine="analytic"):
+    """ Numeric stage for a pairwise combination, runs the BA regression and
+    creates the outlier flags. No plots are generated.
+
+    :Arguments:
+        :param tuple combo: A tuple of pairwise combination for current sample.
+
+        :type x: pandas.Series
+        :param x: Series of the first sample of the combination.
+
+        :type y: pandas.Series
+        :param y: Series of the second sample of the combination.
+
+        :type cutoff: int
+        :param cutoff: Cutoff value for the Pearson normalized residuals.
+
+        :type engine: string
+        :param engine: Regression engine, see runRegression.
+
+    :Returns:
+        :rtype flag: pandas.DataFrame
+        :param flag: A Flags DataFrame with outlier flags.
+
+        :rtype fit: tuple of pandas.Series
+        :param fit: Lower and upper confidence interval and fitted values of
+            the regression, used to plot the combination (see makeBA).
+
+    """
+    # Current combination
+    c1 = combo[0]
+    c2 = combo[1]
+
+    # Regression of c1 vs c2
+    results = runBA(x, y, cutoff, engine=engine)
+    fit = results[2:5]
+    outlier, pearson, cooks, dffits = results[-4:]
+
+    # Create flags
+    flag = Flags(index=x.index)
+    flag.addColumn(column='flag_{0}_{1}'.format(c1, c2), mask=outlier)
+    flag.addColumn(column='flag_pearson_{0}_{1}'.format(c1, c2), mask=pearson)
+    flag.addColumn(column='flag_cooks_{0}_{1}'.format(c1, c2), mask=cooks)
+    flag.addColumn(column='flag_dffits_{0}_{1}'.format(c1, c2), mask=dffits)
+
+    return flag.df_flags, fit
+
+def initWorker(wide, cutoff, engine):
+    """ Share the wide data, cutoff and engine with a worker process of the pool.
+
+    :Arguments:
+        :type wide: pandas.DataFrame
+        :param wide: Wide data of the samples to process.
+
+        :type cutoff: int
+        :param cutoff: Cutoff value for the Pearson normalized residuals.
+
+        :type engine: string
+        :param engine: Regression engine, see runRegression.
+
+    """
+    global workerWide, workerCutoff, workerEngine
+    workerWide = wide
+    workerCutoff = cutoff
+    workerEngine = engine
+
+def flagWorker(combo):
+    """ Run flagCombo inside a worker process initialized with initWorker. """
+    return flagCombo(combo, workerWide.loc[:, combo[0]], 
+                    workerWide.loc[:, combo[1]], workerCutoff, workerEngine)
+
+def flagAllCombos(dat, combos, cutoff, jobs=1, engine="analytic"):
+    """ Numeric stage for all the pairwise combinations.
+
+    :Arguments:
+        :type dat: interface.wideToDesign
+        :param dat: A wideToDesign object containing wide and design information.
+
+        :type combos: list
+        :param combos: List of pairwise combinations of samples.
+
+        :type cutoff: int
+        :param cutoff: Cutoff value for the Pearson normalized residuals.
+
+        :type jobs: int
+        :param jobs: Number of processes to use.
+
+        :type engine: string
+        :param engine: Regression engine, see runRegression.
+
+    :Returns:
+        :rtype: tuple of list
+        :returns: A Flags DataFrame and the regression fit (see flagCombo) for
+            every combination, in the same order as combos.
+
+    """
+    if jobs > 1 and len(combos) > 1:
+        pool = Pool(processes=jobs, initializer=initWorker,
+                    initargs=(dat.wide, cutoff, engine))
+        try:
+            results = pool.map(flagWorker, combos, 
+                    chunksize=max(1, len(combos) // (jobs * 4)))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [flagCombo(combo, dat.wide.loc[:, combo[0]], 
+                dat.wide.loc[:, combo[1]], cutoff, engine) for combo in combos]
+
+    flags = [flag for flag, fit in results]
+    fits = [fit for flag, fit in results]
+    return flags, fits
+
+def plotCombo(dat, combo, pdf, flag, fit, engine="analytic"):
+    """ Plotting stage for a pairwise combination. The BA plot is drawn from
+    the results of the numeric stage (see flagCombo), only the regression of
+    the scatter plot is fitted here.
 
     :Arguments:
         :type dat: interface.wideToDesign
@@ -480,14 +674,19 @@ def iterateCombo(dat, combo, pdf):
         :type pdf: matplotlib.backends.backend_pdf.PdfPages
         :param pdf: Handler for multi-page PDF that will contain all plots.
 
+        :type flag: pandas.DataFrame
+        :param flag: Flags DataFrame of the combination.
+
+        :type fit: tuple of pandas.Series
+        :param fit: Regression fit of the combination.
+
+        :type engine: string
+        :param engine: Regression engine, see runRegression.
+
     :Updates:
         :type pdf: matplotlib.backends.backend_pdf.PdfPages
         :param pdf: Handler for multi-page PDF that will contain all plots.
 
-    :Returns:
-        :rtype flag: interface.Flags
-        :param flag: A Flags object with outlier flags.
-
     """
 
     # Current combination
@@ -499,10 +698,11 @@ def iterateCombo(dat, combo, pdf):
     
 
     # Scatter Plot of c1 vs c2
-    makeScatter(dat.wide.loc[:, c1], dat.wide.loc[:, c2], fh.ax[0],fh)
+    makeScatter(dat.wide.loc[:, c1], dat.wide.loc[:, c2], fh.ax[0], fh, engine)
 
     # BA plot of c1 vs c2
-    outlier, pearson, cooks, dffits = makeBA(dat.wide.loc[:, c1], dat.wide.loc[:, c2], fh.ax[1],fh)
+    makeBA(dat.wide.loc[:, c1], dat.wide.loc[:, c2], fh.ax[1], fh, fit,
+            flag['flag_{0}_{1}'.format(c1, c2)])
 
     # Build plot title
     title = buildTitle(dat, c1, c2)
@@ -519,14 +719,38 @@ def iterateCombo(dat, combo, pdf):
     # Output figure to pdf
     fh.addToPdf(dpi=90,pdfPages=pdf)
 
-    # Create flags
-    flag = Flags(index=dat.wide.index)
-    flag.addColumn(column='flag_{0}_{1}'.format(c1, c2), mask=outlier)
-    flag.addColumn(column='flag_pearson_{0}_{1}'.format(c1, c2), mask=pearson)
-    flag.addColumn(column='flag_cooks_{0}_{1}'.format(c1, c2), mask=cooks)
-    flag.addColumn(column='flag_dffits_{0}_{1}'.format(c1, c2), mask=dffits)
+    # Closing figure to release memory
+    plt.close(fh.fig)
+
+def selectPlotCombos(combos, flags, top=None):
+    """ Select the pairwise combinations that will be plotted.
+
+    :Arguments:
+        :type combos: list
+        :param combos: List of pairwise combinations of samples.
+
+        :type flags: list of pandas.DataFrame
+        :param flags: Flags DataFrame for every combination.
+
+        :type top: int
+        :param top: Number of combinations to keep, the ones with the most
+            flagged features are kept. If None all combinations are kept.
+
+    :Returns:
+        :rtype: list
+        :returns: Combinations to plot, in their original order.
+
+    """
+    if top is None:
+        return combos
+
+    # Number of features flagged as outliers on every combination
+    nFlagged = [flag['flag_{0}_{1}'.format(c[0], c[1])].sum() 
+                for c, flag in zip(combos, flags)]
 
-    return flag.df_flags
+    # Keep the most flagged, ties are resolved by the original order
+    ranked = sorted(range(len(combos)), key=lambda i: (-nFlagged[i], i))
+    return [combos[i] for i in sorted(ranked[:top])]
 
 def main(args):
     # Import data
@@ -556,15 +780,27 @@ def main(args):
         # Get all pairwise combinations for all samples
         combos.extend(list(combinations(dat.sampleIDs, 2)))
 
-    # Open a multiple page PDF for plots
-    ppBA = PdfPages(args.baName)
+    # Run regressions over combinations and return a list of flags.
+    logger.info('Generating flags.')
+    flags, fits = flagAllCombos(dat, combos, args.residCutoff, jobs=args.jobs,
+                        engine=args.engine)
 
-    # Loop over combinations and generate plots and return a list of flags.
-    logger.info('Generating flags and plots.')
-    flags = map(lambda combo: iterateCombo(dat, combo, ppBA), combos)
-    
-    # Close PDF with plots
-    ppBA.close()
+    # Loop over the selected combinations and generate plots from their fits.
+    toPlot = set(selectPlotCombos(combos, flags, top=args.topPlots))
+    logger.info('Generating plots for {0} of {1} combinations.'.format(
+                len(toPlot), len(combos)))
+    if toPlot:
+        # Open a multiple page PDF for plots
+        ppBA = PdfPages(args.baName)
+        for combo, flag, fit in zip(combos, flags, fits):
+            if combo in toPlot:
+                plotCombo(dat, combo, ppBA, flag, fit, args.engine)
+
+        # Close PDF with plots
+        ppBA.close()
+
+    # Fits are only needed for the plots
+    del fits
 
     # Merge flags
     logger.info('Merging outlier flags.')
@@ -607,10 +843,6 @@ if __name__ == '__main__':
     # Command line options
     args = getOptions()
 
-    # Expose cutoff as global
-    global cutoff
-    cutoff = args.residCutoff
-
     # Set up logging
     logger = logging.getLogger()
     if args.debug:
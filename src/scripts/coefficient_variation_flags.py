@@ -31,6 +31,7 @@ from matplotlib.backends.backend_pdf import PdfPages
 # Import local data libraries
 from secimtools.dataManager import logger as sl
 from secimtools.dataManager.flags import Flags
+from secimtools.dataManager.rowStats import roundHalfAway, summarizeGroups
 from secimtools.dataManager.interface import wideToDesign
 
 # Import local plotting libraries
@@ -129,37 +130,28 @@ def calculateCV(data, design, cutoff, levels):
     # Get max CV
     """
 
-    #Open CV and CVcutoffs dataframes
-    CV        = pd.DataFrame(index = data.index)
-    CVcutoff  = pd.Series(index    = list(set(design[levels])))
-
-    # Split design file by treatment group
-    for title, group in design.groupby(levels):
-        # Create empty dataset with metabolites names as index and calculate their
-        # standar deviation and mean
-        DATstat=pd.DataFrame(index=data[group.index].index)
-        # ddof =1 is necessary to subtract n-1 in denominatior for standard deviation.
-        DATstat.loc[:,"std"]  = np.std(data[group.index], axis=1, ddof=1)
-        DATstat.loc[:,"mean"] = np.mean(data[group.index],axis=1)
-
-        # Calculate the Coefficient of Variation for that group (if groups)
-        # or al data (if not groups provided).
-        CV.loc[:,"cv_"+title] = abs(DATstat["std"] / DATstat["mean"])
-
-        # Calculate the CVcutoffs for each group (if groups provided)
-        # or all data (if not).
-        if not cutoff:
-            CVcutoff[title] = np.nanpercentile(CV["cv_"+title].values, q=90)
-            CVcutoff[title] = round(CVcutoff[title], 
-                                -int(floor(log(abs(CVcutoff[title]),10)))+2)
-        else:
-            CVcutoff[title] = np.nanpercentile(CV["cv_"+title].values, q=(1-cutoff)*100 )
-            CVcutoff[title] = round(CVcutoff[title], 
-                                -int(floor(log(abs(CVcutoff[title]),10)))+2)
-        
+    # Calculate standard deviation, mean and the Coefficient of Variation of
+    # every metabolite for all the groups at once.
+    # ddof =1 is necessary to subtract n-1 in denominatior for standard deviation.
+    mean, std, cv = summarizeGroups(data[design.index], design[levels].values,
+                                    ddof=1)
+    CV = abs(cv)
+    CV.columns = ["cv_"+title for title in cv.columns]
+
+    # Calculate the CVcutoffs for each group (if groups provided) or all data
+    # (if not) and round them to 3 significant digits.
+    if not cutoff:
+        q = 90
+    else:
+        q = (1-cutoff)*100
+    CVcutoff = np.nanpercentile(CV.values, q=q, axis=0)
+    digits = [-int(floor(log(abs(value),10)))+2 if value > 0 else 0
+              for value in CVcutoff]
+    CVcutoff = pd.Series(roundHalfAway(CVcutoff, digits), index=cv.columns)
+
     # Calculate the maximum coefficient of variation
-    CV.loc[:,'cv'] = CV.apply(np.max, axis=1)
-        
+    CV.loc[:,'cv'] = np.fmax.reduce(CV.values, axis=1)
+
     return (CV, CVcutoff)
 
 def plotCVplots(data, cutoff, palette, pdf):
@@ -245,7 +237,8 @@ def main(args):
     dat.dropMissing()
 
     # Treat everything as float and round it to 3 digits
-    dat.wide = dat.wide.applymap(lambda x: round(x,3))
+    dat.wide = pd.DataFrame(roundHalfAway(dat.wide.values, 3),
+                            index=dat.wide.index, columns=dat.wide.columns)
 
     # Get colors
     palette.getColors(dat.design,levels)
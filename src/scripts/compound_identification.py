@@ -26,6 +26,7 @@ from matplotlib.backends.backend_pdf import PdfPages
 # Import local data ibraries
 from secimtools.dataManager import interface
 from secimtools.dataManager import logger as sl
+from secimtools.dataManager.libraryIndex import libraryIndex
 
 #Getting all the arguments
 def getOptions(myopts=False):
@@ -58,6 +59,16 @@ def getOptions(myopts=False):
     required.add_argument("-lrti", "--librtID", dest="librt", action="store",
                         required=True, default="", help="Name of the column"\
                         " in the library file that contains RT")
+    # Tool input
+    tool = parser.add_argument_group(title='Tool input', 
+                                    description='Optional input to the program')
+    tool.add_argument("-idx", "--libIndex", dest="libIndex", action="store",
+                        required=False, default=False, help="Path to a library"\
+                        " index. If the file exists and was built from the same"\
+                        " library file (path, size and modification time) and "\
+                        "columns the index is loaded from it and the library "\
+                        "file is not read, otherwise the index is built from "\
+                        "the library file and saved there.")
     # Tool output
     output = parser.add_argument_group(title='Output files', 
                                     description='Output paths for the program')
@@ -70,77 +81,40 @@ def getOptions(myopts=False):
     args.anno    = os.path.abspath(args.anno)
     args.output  = os.path.abspath(args.output)
     args.library = os.path.abspath(args.library)
+    if args.libIndex:
+        args.libIndex = os.path.abspath(args.libIndex)
 
     return(args);
  
-def identiyOnTarget (library,target,MZCut,RTCut):
-    """ 
-    Match 2 Files and returns an array with the results.
-
-    :Arguments:
-        :type library: pd.DataFrame.
-        :param library: Dataframe with the library to annotate
-
-        :type target: pd.DataFrame.
-        :param target: Dataframe with the target of annotation
-
-        :type MZCut: int
-        :param MZCut: window size for mz.
-
-        :type RtCut: int
-        :param RtCut: window size for rt.
-
-    :Returns:
-        :return identified_df: Identified features on target file.
-        :rtype identified_df: pd.DataFrame.
-
-    """
-    # Iterating over each element on the Target file to assess against library
-    identified_feats=list()
-    for target_rowID,target_MZRT in target.data.iterrows():
-
-        # Calculating MZ and RT cuts
-        mzMin = target_MZRT[target.mz] - MZCut
-        mzMax = target_MZRT[target.mz] + MZCut
-        rtMin = target_MZRT[target.rt] - RTCut
-        rtMax = target_MZRT[target.rt] + RTCut
-
-        # For those with not idenfied compound imput a blank
-        target_MZRT.loc["compound"]=np.nan
-        target_MZRT = pd.concat([target_MZRT,pd.Series(index=library.anno)])
-
-        # Iterate over the library file to idenfy compouns/adducts
-        for library_rowID, library_MZRT in library.data.iterrows():
-
-                #Match found between anno1 and anno2
-                if ((mzMin<library_MZRT[library.mz] and library_MZRT[library.mz]<mzMax) and 
-                    (rtMin<library_MZRT[library.rt] and library_MZRT[library.rt]<rtMax)):        
-
-                    # Creating a series with the data that we want
-                    target_MZRT.loc["compound"] = library_rowID
-                    target_MZRT.loc[library.anno]=library_MZRT[library.anno]
-
-        # Adding features aggain to identified feats
-        identified_feats.append(target_MZRT)
-
-    # Concatenating identified features
-    identified_df = pd.concat(identified_feats, axis=1)
-    identified_df = identified_df.T
-    
-    # Return identified_df
-    return identified_df
-
 def main(args):
-    # Loading library and target files
+    # Loading library index and target files, the index is only reused if it
+    # was built from the same library file and columns
+    source = libraryIndex.librarySource(args.library, uniqID=args.libid,
+                                        mz=args.libmz, rt=args.librt)
+    library = None
+    if args.libIndex and os.path.isfile(args.libIndex):
+        library = libraryIndex.load(args.libIndex, source=source)
+        if library is None:
+            logger.warn("Library index {0} does not match the library file or "\
+                        "columns, it will be rebuilt".format(args.libIndex))
+        else:
+            logger.info("Loaded library index from {0}".format(args.libIndex))
+    if library is None:
+        logger.info("Importing library and building index")
+        library = libraryIndex(interface.annoFormat(data=args.library, 
+                    uniqID=args.libid, mz=args.libmz, rt=args.librt, anno=True),
+                    source=source)
+        if args.libIndex:
+            logger.info("Saving library index to {0}".format(args.libIndex))
+            library.save(args.libIndex)
+
     logger.info("Importing data")
-    library = interface.annoFormat(data=args.library, uniqID=args.libid, 
-                                    mz=args.libmz, rt=args.librt, anno=True)
     target  = interface.annoFormat(data=args.anno, uniqID=args.uniqID,
                                     mz=args.mzID, rt=args.rtID)
                                 
-    # Matching target file with library file
+    # Matching target file with library index
     logger.info("Identifying compounds")
-    identified_df = identiyOnTarget(library=library, target=target, MZCut=0.005, RTCut=0.15)
+    identified_df = library.identify(target=target, MZCut=0.005, RTCut=0.15)
 
     # Saving identified compounds to file
     identified_df.to_csv(args.output, sep="\t", index_label=args.uniqID)
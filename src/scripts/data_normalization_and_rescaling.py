@@ -46,12 +46,22 @@ def getOptions():
     tool.add_argument("-m","--method", dest="method", action='store', 
                         required=True, choices=["mean", "sum", "median", "centering", "auto", "range", "pareto", "level", "vast" ], 
                         help="Name of the normalization method that user wants to apply.")
+    tool.add_argument("-cs","--chunksize", dest="chunksize", action='store',
+                        type=int, required=False, default=None, help="Read, "\
+                        "normalize and write the wide file in chunks of this "\
+                        "many features, for datasets that do not fit in memory. "\
+                        "Sample-wise methods read the file once more to get the "\
+                        "scaling factors (a few more times for median) [Optional].")
     # Tool output
     output = parser.add_argument_group(title='Output paths', 
                 description="Paths for the output files")
     output.add_argument("-o","--out",dest="out",action="store",
                         required=True,help="Path for TSV output of the normalized/re-scalled data.")
     args = parser.parse_args()
+
+    # Validate chunksize
+    if args.chunksize is not None and args.chunksize < 1:
+        parser.error("chunksize must be a number greater than 0")
     
     # Stadardize paths
     args.out    = os.path.abspath(args.out)
@@ -60,121 +70,269 @@ def getOptions():
 
     return (args)
 
+SAMPLE_METHODS = ["mean", "sum", "median"]
+
+# Number of bins used to narrow the median of every sample on each pass
+MEDIAN_BINS = 1024
+
+# Maximum number of narrowing passes of the median
+MEDIAN_PASSES = 8
+
+def scaleFeatures(values, method):
+    """
+    Centering or scaling of every feature across samples.
+
+    :Arguments:
+        :type values: numpy.array
+        :param values: Values in wide format (features x samples) without
+                    missing values.
+
+        :type method: str
+        :param method: "centering", "auto", "range", "pareto", "level" or
+                    "vast".
+
+    :Returns:
+        :rtype: numpy.array
+        :return: Normalized values.
+    """
+    # Computing mean for each feature.
+    feature_value_means = values.mean(axis=1)[:, np.newaxis]
+    centered = values - feature_value_means
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Performing centering for each feature.
+        # In this case the value fo each feature will have mean zero across samples.
+        if method == "centering":
+            return centered
+
+        # Computing standard deviation for each feature.
+        feature_value_std = values.std(axis=1, ddof=1)[:, np.newaxis]
+
+        # Performing auto-sclaing.
+        # In this case the value fo each feature will have mean zero and std = 1 across samples.
+        if method == "auto":
+            return centered/feature_value_std
+
+        # Performing Pareto Scaling. The only difference from auto-scaling is that we use sqrt(standar_deviation).
+        # In this case the value fo each feature will have mean zero and std will NOT be 1 across samples.
+        if method == "pareto":
+            return centered/np.sqrt(feature_value_std)
+
+        # Performing range scaling. Each feature is centered and divided by the range of that feature.
+        if method == "range":
+            feature_value_max_min = (values.max(axis=1) - values.min(axis=1))[:, np.newaxis]
+            return centered/feature_value_max_min
+
+        # Performing level scaling. Each feature is centered and divided by the the mean of that feature.
+        if method == "level":
+            return centered/feature_value_means
+
+        # Performing VarianceStabilizing (VAST) scaling. Each feature is centered and divided by the coefficient of variation.
+        if method == "vast":
+            feature_value_cv = feature_value_std/feature_value_means
+            return centered/feature_value_std/feature_value_cv
+
+def iterComplete(dat, dropped=None):
+    """
+    Read the wide data in chunks dropping the features with missing values.
+
+    :Arguments:
+        :type dat: interface.wideToDesign
+        :param dat: wideToDesign object created with a chunksize.
+
+        :type dropped: list
+        :param dropped: If given the number of dropped features of every chunk
+                    is appended to it.
+
+    :Returns:
+        :rtype: generator
+        :return: pandas.DataFrame with the complete features of every chunk.
+    """
+    for chunk in dat.iterChunks():
+        complete = chunk.dropna()
+        if dropped is not None:
+            dropped.append(len(chunk.index) - len(complete.index))
+        yield complete
+
+def streamMedian(dat, count, lower, upper):
+    """
+    Median of every sample across features reading the data in chunks.
+
+    Every pass counts the values of every sample on MEDIAN_BINS bins between
+    lower and upper and narrows the bounds to the bins with the middle
+    values. Once every sample has at most chunksize values between its
+    bounds (or after MEDIAN_PASSES passes) a last pass keeps the distinct
+    values between the bounds to get the exact median.
+
+    :Arguments:
+        :type dat: interface.wideToDesign
+        :param dat: wideToDesign object created with a chunksize.
+
+        :type count: int
+        :param count: Number of complete features.
+
+        :type lower: numpy.array
+        :param lower: Minimum of every sample.
+
+        :type upper: numpy.array
+        :param upper: Maximum of every sample.
+
+    :Returns:
+        :rtype: numpy.array
+        :return: Median of every sample.
+    """
+    nSamples = len(lower)
+    ranks = np.array([(count - 1) // 2, count // 2])
+    columns = np.arange(nSamples)
+
+    # Narrowing passes
+    for npass in range(MEDIAN_PASSES):
+        width = (upper - lower) / MEDIAN_BINS
+        below = np.zeros(nSamples, dtype=int)
+        counts = np.zeros((MEDIAN_BINS, nSamples), dtype=int)
+        for chunk in iterComplete(dat):
+            values = chunk.values.astype(float)
+            inside = (values >= lower) & (values <= upper)
+            below += (values < lower).sum(axis=0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                bins = np.floor((values - lower) / width)
+            bins = np.clip(np.nan_to_num(bins), 0, MEDIAN_BINS - 1).astype(int)
+            flat = (bins * nSamples + columns)[inside]
+            counts += np.bincount(flat, minlength=MEDIAN_BINS * nSamples).\
+                        reshape(MEDIAN_BINS, nSamples)
+
+        # Bins with the middle values, widened by one bin on every side to
+        # keep values on the edges
+        cumulative = below + np.cumsum(counts, axis=0)
+        first = np.maximum(np.argmax(cumulative > ranks[0], axis=0) - 1, 0)
+        last = np.minimum(np.argmax(cumulative > ranks[1], axis=0) + 1,
+                            MEDIAN_BINS - 1)
+        inBounds = cumulative[last, columns] - below
+        inBounds -= np.where(first > 0, cumulative[first - 1, columns] - below, 0)
+        upper = np.where(last < MEDIAN_BINS - 1, lower + (last + 1) * width, upper)
+        lower = lower + first * width
+        if ((inBounds <= dat.chunksize) | (lower == upper)).all():
+            break
+
+    # Last pass, distinct values between the bounds
+    below = np.zeros(nSamples, dtype=int)
+    distinct = [list() for sample in columns]
+    for chunk in iterComplete(dat):
+        values = chunk.values.astype(float)
+        below += (values < lower).sum(axis=0)
+        for sample in columns:
+            column = values[:, sample]
+            column = column[(column >= lower[sample]) & (column <= upper[sample])]
+            distinct[sample].append(np.unique(column, return_counts=True))
+
+    # Select the middle values
+    medians = np.zeros(nSamples)
+    for sample in columns:
+        values = np.concatenate([value for value, n in distinct[sample]])
+        weights = np.concatenate([n for value, n in distinct[sample]])
+        values, position = np.unique(values, return_inverse=True)
+        cumulative = below[sample] + np.cumsum(np.bincount(position,
+                                                weights=weights))
+        medians[sample] = values[np.searchsorted(cumulative, ranks + 1)].mean()
+    return medians
+
+def sampleFactors(dat, method):
+    """
+    Scaling factor of every sample across features reading the data in
+    chunks. Features with missing values are not used.
+
+    :Arguments:
+        :type dat: interface.wideToDesign
+        :param dat: wideToDesign object created with a chunksize.
+
+        :type method: str
+        :param method: "mean", "sum" or "median".
+
+    :Returns:
+        :rtype: numpy.array
+        :return: Scaling factor of every sample.
+    """
+    nSamples = len(dat.wide.columns)
+    total = np.zeros(nSamples)
+    lower = np.full(nSamples, np.inf)
+    upper = np.full(nSamples, -np.inf)
+    count = 0
+    for chunk in iterComplete(dat):
+        values = chunk.values.astype(float)
+        count += len(values)
+        total += values.sum(axis=0)
+        if len(values):
+            lower = np.minimum(lower, values.min(axis=0))
+            upper = np.maximum(upper, values.max(axis=0))
+
+    if method == "sum":
+        return total
+    if method == "mean":
+        return total / count
+    if count == 0:
+        return np.full(nSamples, np.nan)
+    return streamMedian(dat, count, lower, upper)
+
 def main(args):
 
     # Importing data trough
     logger.info("Loading data trough the interface")
-    dat = wideToDesign(args.input, args.design, args.uniqID, logger=logger)
-
-    # Cleaning from missing data
-    dat.dropMissing()
-
-    # Transpose data to normalize
-    toNormalize_df =  dat.wide.T
-
-
+    dat = wideToDesign(args.input, args.design, args.uniqID, logger=logger,
+                        chunksize=args.chunksize)
 
     # Telling the user about the selected normalization method.
-
     logger.info("Normalizing data using {0} method.".format(args.method))
 
-
     # mean, median and sum are applied per sample across features!!!!
-    if args.method == "mean" or args.method == "sum" or args.method == "median":      
- 
-       if args.method == "mean":
-          toNormalize_df[args.method] = toNormalize_df.mean(axis=1)
-          logger.info("Mean scaling is used for each sample across features.")
-     
-       if args.method == "sum":
-          toNormalize_df[args.method] = toNormalize_df.sum(axis=1)
-          logger.info("Sum scaling is used for each sample across features.")
-    
-       if args.method == "median":
-          toNormalize_df[args.method] = toNormalize_df.median(axis=1)
-          logger.info("Median scaling is used for each sample across features.")
-       
-       # Dividing by factor
-       toNormalize_df = toNormalize_df.apply(lambda x: x/x[args.method], axis=1)
-
-
-       # Dropping extra column
-       toNormalize_df.drop(args.method, axis=1, inplace=True)
-
- 
     # "centering", "auto", "range", "pareto", "level", "vast" are performed per feature across samples!!!!
-    else:      
-
-        # Computing mean for each feature.
-        feature_value_means = toNormalize_df.mean(axis=0)
-
-        if args.method == "centering":
-        
-           # Performing centering for each feature. 
-           # In this case the value fo each feature will have mean zero across samples.
-           logger.info("Centering is used for each feature across samples.")
-           toNormalize_df = toNormalize_df - feature_value_means
-
-
-        if args.method == "auto":
-        
-           # Computing standard deviation for each feature.
-           feature_value_std = toNormalize_df.std(axis=0, ddof=1)
-        
-           # Performing auto-sclaing. 
-           # In this case the value fo each feature will have mean zero and std = 1 across samples.
-           logger.info("Autoscaling is used for each feature across samples.")
-           toNormalize_df = (toNormalize_df - feature_value_means)/feature_value_std
-
-
-        if args.method == "pareto":
-
-           # Computing standard deviation and the square root of it for each feature.
-           feature_value_std = toNormalize_df.std(axis=0, ddof=1)
-           feature_value_std_sqrt = np.sqrt(feature_value_std)
-       
-           # Performing Pareto Scaling. The only difference from auto-scaling is that we use sqrt(standar_deviation).
-           # In this case the value fo each feature will have mean zero and std will NOT be 1 across samples.
-           logger.info("Pareto scaling is used for each feature across samples.")
-           toNormalize_df = (toNormalize_df - feature_value_means)/feature_value_std_sqrt
-
-
-        if args.method == "range":
-
-           # Computing mean, min, max and range for each feature.
-           feature_value_min = toNormalize_df.min(axis=0)
-           feature_value_max = toNormalize_df.max(axis=0)
-           feature_value_max_min = feature_value_max - feature_value_min        
-
-           # Performing range scaling. Each feature is centered and divided by the range of that feature.
-           logger.info("Range scaling is used for each feature across samples.")
-           toNormalize_df = (toNormalize_df - feature_value_means)/feature_value_max_min
-
-
-        if args.method == "level":
-
-           # Performing level scaling. Each feature is centered and divided by the the mean of that feature.
-           logger.info("Level scaling is used for each feature across samples.")
-           toNormalize_df = (toNormalize_df - feature_value_means)/feature_value_means
-
-
-        if args.method == "vast":
-
-           # Computing standard deviation and coefficient of variaiton for each feature.
-           feature_value_std = toNormalize_df.std(axis=0, ddof=1)
-           feature_value_cv = feature_value_std/feature_value_means
-
-           # Performing VarianceStabilizing (VAST) scaling. Each feature is centered and divided by the coefficient of variation.
-           logger.info("VAST scaling is used for each feature across samples.")
-           toNormalize_df = (toNormalize_df - feature_value_means)/feature_value_std
-           toNormalize_df =  toNormalize_df/feature_value_cv
-    
-
-    # Transposing normalized data
-    normalized_df = toNormalize_df.T
-
-    # Saving data
-    normalized_df.to_csv(args.out,sep="\t")
+    logger.info({"mean": "Mean scaling is used for each sample across features.",
+                 "sum": "Sum scaling is used for each sample across features.",
+                 "median": "Median scaling is used for each sample across features.",
+                 "centering": "Centering is used for each feature across samples.",
+                 "auto": "Autoscaling is used for each feature across samples.",
+                 "pareto": "Pareto scaling is used for each feature across samples.",
+                 "range": "Range scaling is used for each feature across samples.",
+                 "level": "Level scaling is used for each feature across samples.",
+                 "vast": "VAST scaling is used for each feature across samples."}
+                [args.method])
+
+    if args.chunksize:
+        # Scaling factors of the samples need a pass over all the data before
+        # the features can be normalized
+        if args.method in SAMPLE_METHODS:
+            factors = sampleFactors(dat, args.method)
+        dropped = list()
+        chunks = iterComplete(dat, dropped)
+    else:
+        # Cleaning from missing data
+        dat.dropMissing()
+        values = dat.wide.values.astype(float)
+        if args.method == "mean":
+            factors = values.mean(axis=0)
+        elif args.method == "sum":
+            factors = values.sum(axis=0)
+        elif args.method == "median":
+            factors = np.median(values, axis=0)
+        chunks = [dat.wide]
+
+    # Saving data, the header is written first and every chunk is appended
+    # after it is normalized
+    with open(args.out, 'w') as OUT:
+        dat.wide.iloc[:0].to_csv(OUT, sep="\t")
+        for chunk in chunks:
+            values = chunk.values.astype(float)
+            if args.method in SAMPLE_METHODS:
+                # Dividing by factor
+                values = values / factors
+            else:
+                values = scaleFeatures(values, args.method)
+            normalized_df = pd.DataFrame(values, index=chunk.index,
+                                        columns=chunk.columns)
+            normalized_df.to_csv(OUT, sep="\t", header=False)
+
+    if args.chunksize and sum(dropped):
+        logger.warn("Missing values were found on wide data [{0}] rows were "\
+                    "dropped.".format(sum(dropped)))
     logger.info("Script Complete!")
 
 if __name__ == '__main__':
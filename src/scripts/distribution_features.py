@@ -25,6 +25,7 @@ from matplotlib.backends.backend_pdf import PdfPages
 
 # Import local data libraries
 from secimtools.dataManager import logger as sl
+from secimtools.dataManager.rowStats import summarizeRows
 from secimtools.dataManager.interface import wideToDesign
 
 # Import local plotting libraries
@@ -56,6 +57,9 @@ def getOptions():
                                         description="Paths and outputs")
     output.add_argument("-f","--figure", dest="figure", action='store',
                         required=True, help="Output figure name [pdf].")
+    output.add_argument("-s","--summary", dest="summary", action='store',
+                        required=False, default=False, help="Output name for "\
+                        "the summary statistics of every feature [tsv]. [Optional]")
     # Plot options
     plot = parser.add_argument_group(title='Plot options')
     plot.add_argument("-pal","--palette",dest="palette",action='store',required=False, 
@@ -69,6 +73,8 @@ def getOptions():
     args.input  = os.path.abspath(args.input)
     args.design = os.path.abspath(args.design)
     args.figure = os.path.abspath(args.figure)
+    if args.summary:
+        args.summary = os.path.abspath(args.summary)
 
     return(args)
 
@@ -101,6 +107,26 @@ def plotDensity (data, name, pdf):
     # Adding figure to pdf object
     figure.addToPdf(pdf)
 
+def summarizeFeatures(wide, design, group):
+    """
+    This function computes the summary statistics of every feature for all
+    the samples and for the samples of every group.
+    """
+    # Getting the samples of every group and all the samples
+    groups = list()
+    if group:
+        groups = [(name, subset.index) for name, subset in design.groupby(group)]
+    groups.append(("samples", wide.columns))
+
+    # Summarizing all the features of each group at once
+    summaries = list()
+    for name, samples in groups:
+        summary = summarizeRows(wide[samples], percentiles=(5, 25, 50, 75, 95))
+        summary.insert(0, "group", name)
+        summaries.append(summary)
+
+    return pd.concat(summaries)
+
 def main(args):
     """
     Function to call all other functions
@@ -112,6 +138,12 @@ def main(args):
     # Cleaning from missing data
     dat.dropMissing()
 
+    # Saving summary statistics for all the features
+    if args.summary:
+        logger.info(u"Summarizing features")
+        summary = summarizeFeatures(dat.wide, dat.design, args.group)
+        summary.to_csv(args.summary, sep="\t")
+
     # Subseting wide to get features for wide files with more that 50 features
     if len(dat.wide.index) > 50:
         wide = dat.wide.sample(n=50,axis=0)
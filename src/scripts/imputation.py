@@ -15,20 +15,12 @@ import os
 import sys
 import logging
 import argparse
+from multiprocessing import Pool
 from argparse import RawDescriptionHelpFormatter
 
 # Import add-on libraries
 import numpy as np
 import pandas as pd
-import pymc
-from pymc import MCMC
-from pymc.distributions import Impute
-from pymc import Poisson, Normal, DiscreteUniform
-import rpy2
-import rpy2.robjects.numpy2ri
-import rpy2.robjects as robjects
-from rpy2.robjects.packages import importr
-from rpy2.robjects.vectors import StrVector
 
 # Import local data libraries
 from secimtools.dataManager import logger as sl
@@ -74,9 +66,12 @@ def getOptions(myOpts = None):
                         "imputation of rows.If this is exceeded, imputation will"\
                         "be done by mean instead of knn. Default: .5")
     tool.add_argument("-dist","--distribution", dest="dist", required=False,
-                        default="poisson", choices =  ["Poisson","Normal"],
+                        default="Poisson", choices =  ["Poisson","Normal"],
                         help="use mean or median to generate mu value for "\
                         "bayesian imputation")
+    tool.add_argument("-sd","--seed", dest="seed", action='store', type=int,
+                        required=False, default=None, help="Seed for the random "\
+                        "draws of bayesian imputation, for reproducible results.")
     # KNN Input
     knn = parser.add_argument_group(title='KNN input')
     knn.add_argument("-k","--knn",dest="knn",action='store', required=False,
@@ -85,6 +80,9 @@ def getOptions(myOpts = None):
                         required=False, default=.8, help="Percent cutoff for" \
                         "imputation of columns. If this is exceeded, imputation"\
                         "will be done by mean instead of knn. Default: .8")
+    knn.add_argument("-j", "--jobs", dest="jobs", action='store', type=int,
+                        required=False, default=1, help="Number of processes "\
+                        "used to impute the groups in parallel. Default: 1.")
     args = parser.parse_args()
 
     # Standardize paths
@@ -106,7 +104,8 @@ def preprocess(noz,non,ex,data):
         :param non: remove negative numbers?
 
         :type ex: string
-        :param ex: custom characters to be removed. Will be parsed to a list of strings
+        :param ex: custom values to be removed separated by commas, values
+            that are not numbers are ignored.
 
         :type data: pandas DataFrame
         :param data: data to be imputed
@@ -115,30 +114,147 @@ def preprocess(noz,non,ex,data):
         :type data: pandas DataFrame
         :param data: data to be imputed
     """
-    
-    # The rest of the values will be converted to float
-    data = data.applymap(float)
-
-    # All string instances on data will be set to nans
-    data = data.applymap(lambda x: np.nan if isinstance(x,str) else x)
-    
-    # If non zero then convert al 0's to nans
+    # The values will be converted to float
+    values = data.values.astype(float)
+
+    # Build the mask of missing values in a single pass
+    missing = np.isnan(values)
+
+    # If non zero then mask al 0's
     if noz:
-        data = data.where(data != 0,np.nan)
+        missing |= values == 0
 
-    # if non negative numbers then convert al negative numbers to nans
+    # if non negative numbers then mask al negative numbers
     if non:
-        data = data.where(data > 0, np.nan)
+        missing |= ~(values > 0)
 
-    # If custum character to be removed
+    # If custum character to be removed. Only numbers can be on the float
+    # values, other values (i.e. 'NA') are already missing after the interface
     if ex:
-        exclude = ex.split(",")
-        data = data.applymap(lambda x:  np.nan if x in exclude else x)
+        exclude = list()
+        for x in ex.split(","):
+            try:
+                exclude.append(float(x))
+            except ValueError:
+                logger.warn(u"Value '{0}' to exclude is not a number and is "\
+                            "ignored, non numeric values are already treated "\
+                            "as missing.".format(x))
+        if exclude:
+            missing |= np.in1d(values, exclude).reshape(values.shape)
+
+    # Convert masked values to nans
+    values[missing] = np.nan
+    data = pd.DataFrame(values, index=data.index, columns=data.columns)
 
     # Returning cleaned data
     return data
 
-def imputeKNN(rc,cc,k,dat):
+def imputeKNNGroup(values, rc, k, block=256):
+    """
+    Imputes a single group by K-Nearest Neighbors algorithm
+
+    Features (rows) with a proportion of missing values greater than the row
+    cutoff are imputed with the sample (column) mean. For every other feature
+    with missing values the k nearest features are searched among the features
+    under the row cutoff, using the mean squared difference over the samples
+    present in both features, and each missing value is replaced by the
+    average of the neighbors present on that sample. If none of the neighbors
+    is present the sample mean is used.
+
+    :Arguments:
+        :type values: numpy.array
+        :param values: features by samples array of the group, missing values
+                        are np.nan
+
+        :type rc: float
+        :param rc: row cutoff value that determines whether or not to default to mean imputation
+
+        :type k: int
+        :param k: Number of nearby neighbors to consider when performing imputation
+
+        :type block: int
+        :param block: Number of features searched for neighbors at a time
+
+    :Returns:
+        :type values: numpy.array
+        :param values: data with missing values imputed
+    """
+    values = np.array(values, dtype=float)
+    missing = np.isnan(values)
+    if not missing.any():
+        return values
+
+    # Zero filled values and sample means
+    present = ~missing
+    filled = np.where(missing, 0, values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        colMeans = filled.sum(axis=0) / present.sum(axis=0)
+
+    # Rows over the row cutoff are imputed with the sample mean
+    heavy = missing.mean(axis=1) > rc
+    values[heavy] = np.where(missing[heavy], colMeans, values[heavy])
+
+    # Features used as neighbors and features to impute
+    candidates = np.where(~heavy)[0]
+    targets = np.where(~heavy & missing.any(axis=1))[0]
+    k = min(k, len(candidates) - 1)
+    if k < 1:
+        values[targets] = np.where(missing[targets], colMeans, values[targets])
+        return values
+
+    # Precomputing the terms of the neighbor search
+    candValues = filled[candidates]
+    candPresent = present[candidates]
+    candMask = candPresent.astype(float)
+    candSquares = candValues ** 2
+    selfPosition = np.searchsorted(candidates, targets)
+
+    for start in range(0, len(targets), block):
+        current = targets[start:start + block]
+        rows = np.arange(len(current))
+        curValues = filled[current]
+        curMask = present[current].astype(float)
+
+        # Mean squared distance over the samples present in both features
+        common = np.dot(curMask, candMask.T)
+        squares = (np.dot(curValues ** 2, candMask.T) +
+                   np.dot(curMask, candSquares.T) -
+                   2 * np.dot(curValues, candValues.T))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distance = squares / common
+        distance[common == 0] = np.inf
+        distance[rows, selfPosition[start:start + block]] = np.inf
+
+        # k nearest neighbors of every feature in the block
+        neighbors = np.argpartition(distance, k - 1, axis=1)[:, :k]
+        found = np.isfinite(distance[rows[:, np.newaxis], neighbors])
+
+        # Average of the neighbors present on each sample
+        weights = candPresent[neighbors] & found[:, :, np.newaxis]
+        total = (candValues[neighbors] * weights).sum(axis=1)
+        count = weights.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            estimate = np.where(count > 0, total / count, colMeans)
+
+        values[current] = np.where(missing[current], estimate, values[current])
+
+    return values
+
+def knnWorker(task):
+    """
+    Unpacks a group for imputeKNNGroup on a worker of the pool.
+
+    :Arguments:
+        :type task: tuple
+        :param task: values, row cutoff and k for a group
+
+    :Returns:
+        :type values: numpy.array
+        :param values: data with missing values imputed
+    """
+    return imputeKNNGroup(*task)
+
+def imputeKNN(rc,cc,k,dat,jobs=1):
     """
     Imputes by K-Nearest Neighbors algorithm
 
@@ -155,162 +271,173 @@ def imputeKNN(rc,cc,k,dat):
         :type dat: interface wideToDesign file
         :param dat: wide and design data bundled together
 
+        :type jobs: int
+        :param jobs: Number of processes used to impute the groups
+
     :Returns:
         :type pdFull: pandas DataFrame
         :param pdFull: data with missing values imputed
     """
-    # Configuring Rpy2
-    logger.info("Configuring R")
-    rpy2.robjects.numpy2ri.activate()
-
-    # Import R packages
-    base = importr('base')
-    utils = importr('utils')
-    robjects.r('library(impute)')
-
     # Creating a list with all the different groups
     # once inputed they will be concatenated back
     fixedFullDataset = list()
 
-    out = sys.stdout #Save the stdout path for later, we're going to need it
-    f = open('/dev/null','w') #were going to use this to redirect stdout temporarily
-    
+    # Groups to be imputed and their position on the full dataset
+    tasks = list()
+    positions = list()
+
     logger.info("Running KNN imputation")
     # Iterating over groups
     for title, group in dat.design.groupby(dat.group):
+        currentGroup = dat.wide[group.index]
+
         # If len of the group then do not inpute
         if len(group.index) == 1: #No nearby neighbors to impute
             logger.info(title + " has no neighbors, will not impute")
-            fixedFullDataset.append(dat.wide[group.index])
+            fixedFullDataset.append(currentGroup)
             continue
 
         # If group len is not enough for k then use len - 1
+        groupK = k
         if len(group.index) <= k: #some nearby, but not enough to use user specified k
             logger.info(title + " group length less than k, will use group length - 1 instead")
-            k = len(group.index) - 1
-            
-        # Convert wide data to a matrix
-        wideData = dat.wide[group.index].as_matrix()
-
-        # Getting number of rows and columns in wide matrix
-        numRows, numCols = wideData.shape
-
-        # Creatting R objects
-        matrixInR = robjects.r['matrix'](wideData, nrow=numRows, ncol=numCols)
-        imputeKNN = robjects.r('impute.knn')
-
-        # Impute on R module
-        sys.stdout = f
-        imputedObject = imputeKNN(data=matrixInR,k=k,rowmax=rc,colmax=cc)
-        sys.stdout = out
-
-        # Taking the inputed object back to python
-        imputedDataAsNumpy = np.array(imputedObject[0])
-
-        # Saving the inputed data as pandas DataFrame
-        imputedDataAsPandas = pd.DataFrame(imputedDataAsNumpy,
-                                            index=dat.wide[group.index].index,
-                                            columns=dat.wide[group.index].columns)
-
-        # Apending the inputed data to the full pandas datset
-        fixedFullDataset.append(imputedDataAsPandas)
+            groupK = len(group.index) - 1
+
+        # Stop if any column is over the column cutoff
+        if (currentGroup.isnull().mean(axis=0) > cc).any():
+            logger.error("A column of group {0} has more than {1}% missing "\
+                        "values!".format(title, round(cc * 100)))
+            raise ValueError
+
+        fixedFullDataset.append(currentGroup)
+        positions.append(len(fixedFullDataset) - 1)
+        tasks.append((currentGroup.values, rc, groupK))
+
+    # Impute groups
+    if jobs > 1 and len(tasks) > 1:
+        pool = Pool(processes=min(jobs, len(tasks)))
+        try:
+            imputed = pool.map(knnWorker, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        imputed = [knnWorker(task) for task in tasks]
 
-        #reset k back to normal if it was modified @125
-        k = int(args.knn) 
+    # Saving the inputed data as pandas DataFrame
+    for position, values in zip(positions, imputed):
+        fixedFullDataset[position] = pd.DataFrame(values,
+                                    index=fixedFullDataset[position].index,
+                                    columns=fixedFullDataset[position].columns)
 
-        # Concatenating list of results to full dataframe again
-        pdFull = pd.concat(fixedFullDataset,axis=1)
+    # Concatenating list of results to full dataframe again
+    pdFull = pd.concat(fixedFullDataset,axis=1)
 
     # Returning pandas dataframe
     return pdFull
 
-def imputeRow(row, rc, strategy, dist=False):
+def imputeBayesianGroup(values, rc, dist, randomState):
     """
-        :Arguments:
-        :type row: pandas.Series
-        :param row: row to be imputed
+    Imputes all the rows of a group by drawing the missing values from the
+    distribution of each row
 
-        :type rc: float
-        :param rc: row cutoff value that determines whether or not to default to
-                     mean imputation
+    The Normal distribution uses the mean and standard deviation of the
+    present values of the row, or 1/3 of the absolute mean if all the
+    values are the same. The Poisson distribution uses the mean.
 
-        :type strategy: str
-        :param strategy: Strategy to be used for imputation.
+    :Arguments:
+        :type values: numpy.array
+        :param values: features by samples array of the group, missing values
+                        are np.nan
+
+        :type rc: float
+        :param rc: row cutoff value, rows with a greater proportion of
+                    missing values are not imputed
 
         :type dist: str
-        :param dist: Type of distribution to be used in Bayesian imbutation.
+        :param dist: Type of distribution to be used, Normal or Poisson.
 
-    :Returns:
-        :type pdFull: pandas.Series
-        :param pdFull: Imputed row.
+        :type randomState: numpy.random.RandomState
+        :param randomState: Random number generator used for the draws.
 
+    :Returns:
+        :type values: numpy.array
+        :param values: data with missing values imputed
     """
-    # If ratio of missing/present values is greater than the row cutoff then
-    # don't impute and save the row as it is
-    if float(row.isnull().sum())/float(len(row)) > rc:
-        return row
-
-    # If ratio is less than the rc then review for impute
-    else:
-        # If there's any missing value impute with either mean, median or bayesian.
-        if row.isnull().any():
-            if strategy == "mean":
-                row.fillna(np.nanmean(row),inplace=True)
-            elif strategy == "median":
-                row.fillna(np.nanmedian(row),inplace=True)
-            elif strategy == "bayesian":
-                row = imputeBayesian(row=row, dist=dist)
-            return row
-        # if the row is complete the return the row as it is
-        else:
-            return row
-
-def imputeBayesian(row, dist):
-    out = sys.stdout #Save the stdout path for later, we're going to need it
-    f = open('/dev/null','w') #were going to use this to redirect stdout 
+    # Zeros are treated as missing values
+    values = np.array(values, dtype=float)
+    masked = np.ma.masked_invalid(np.where(values == 0, np.nan, values))
+    missing = np.ma.getmaskarray(masked)
+
+    # Only impute rows under the row cutoff
+    impute = missing & (missing.mean(axis=1) <= rc)[:, np.newaxis]
+
+    # Parameters of every row
+    mu = np.ma.filled(masked.mean(axis=1), np.nan)
+
+    # Rows without a valid mean (all values missing, or negative for Poisson)
+    # can not be drawn from and are left missing
+    valid = np.isfinite(mu)
+    if dist == "Poisson":
+        valid &= mu >= 0
+    skipped = (impute.any(axis=1) & ~valid).sum()
+    if skipped:
+        logger.warn(u"[{0}] rows have no valid mean for the {1} distribution "\
+                    "and are not imputed.".format(skipped, dist))
+    impute &= valid[:, np.newaxis]
+    rows = np.where(impute)[0]
+
+    # Draw all the missing values at once
+    if dist == "Normal":
+        sd = np.ma.filled(masked.std(axis=1), np.nan)
+        sd = np.where(sd == 0, np.abs(mu) / 3, sd)
+        draws = randomState.normal(mu[rows], sd[rows])
+    elif dist == "Poisson":
+        draws = randomState.poisson(mu[rows])
 
-    # filling nan with 0 so everything works
-    row.fillna(0, inplace=True)
+    values[impute] = draws
+    return values
 
-    # Masked Values
-    maskedValues = np.ma.masked_equal(row.values,value=0)
+def imputeMeanMedian(values, rc, strategy):
+    """
+    Imputes all the rows of a group with their mean or median
 
-    # Choose between distributions, either normal or Poisson.
-    if dist == "Normal":
+    :Arguments:
+        :type values: numpy.array
+        :param values: features by samples array of the group, missing values
+                        are np.nan
 
-        # Calculate tau
-        if np.std(maskedValues) == 0:
-            tau = np.square(1/(np.mean(maskedValues)/3))
-        else:
-            tau = np.square((1/(np.std(maskedValues))))
+        :type rc: float
+        :param rc: row cutoff value, rows with a greater proportion of
+                    missing values are not imputed
 
-        # Uses only mean
-        x = Impute('x', Normal, maskedValues, tau=tau, mu=np.mean(maskedValues))
+        :type strategy: str
+        :param strategy: Strategy to be used for imputation, mean or median.
 
-    # For Poisson
-    elif dist == "Poisson":
-        x = Impute('x', Poisson, maskedValues, mu=np.mean(maskedValues))
+    :Returns:
+        :type values: numpy.array
+        :param values: data with missing values imputed
+    """
+    # Mask missing values
+    masked = np.ma.masked_invalid(values)
+    missing = np.ma.getmaskarray(masked)
 
-    # Fancy test
-    sys.stdout = f # Skipin stdout
-    m = MCMC(x)
-    m.sample(iter=1,burn=0,thin=1)
-    sys.stdout = out # coming back 
+    # Mean or median of every row
+    if strategy == "mean":
+        fill = masked.mean(axis=1)
+    elif strategy == "median":
+        fill = np.ma.median(masked, axis=1)
+    fill = np.ma.filled(fill, np.nan)
 
-    # Getting list of missing values
-    missing = [i for i in range(len(row.values)) if row.values[i] == 0]
+    # Only impute rows under the row cutoff
+    impute = missing & (missing.mean(axis=1) <= rc)[:, np.newaxis]
 
-    # Getting the imputed values from the model
-    for i in range(len(missing)):
-                keyString = "x[" + str(missing[i]) + "]"
-                imputedValue = m.trace(keyString)[:]
-                row.iloc[missing[i]] = imputedValue[0]
+    return np.where(impute, fill[:, np.newaxis], values)
 
-    # Returning to use nans
-    row.replace(0,np.nan, inplace=True)
-    return row
+def iterateGroups(dat,strategy, rc, dist=False, seed=None):
+    # Random number generator for bayesian imputation
+    randomState = np.random.RandomState(seed)
 
-def iterateGroups(dat,strategy, rc, dist=False):
     # Create a list to concatenate all the results
     imputed = list()
 
@@ -320,10 +447,19 @@ def iterateGroups(dat,strategy, rc, dist=False):
         currentGroup = dat.wide[group.index]
 
         # Try to impute only if the amount of columns in the group > 1
-        if len(currentGroup.index) > 1:
+        if len(currentGroup.columns) > 1:
 
             # Doing  mean/median imputation
-            currentGroup.apply(imputeRow,args=(rc,strategy,dist), axis=1)
+            if strategy in ["mean", "median"]:
+                currentGroup = pd.DataFrame(imputeMeanMedian(
+                                currentGroup.values, rc, strategy),
+                                index=currentGroup.index,
+                                columns=currentGroup.columns)
+            elif strategy == "bayesian":
+                currentGroup = pd.DataFrame(imputeBayesianGroup(
+                                currentGroup.values, rc, dist, randomState),
+                                index=currentGroup.index,
+                                columns=currentGroup.columns)
 
         # Appending imputed group to list of groups            
         imputed.append(currentGroup)
@@ -350,14 +486,15 @@ def main(args):
     logger.info("Inpute")
     if args.strategy == "knn":
         pdFull = imputeKNN(rc=float(args.rowCutoff), cc=float(args.colCutoff),
-                            k=int(args.knn), dat=dat)
+                            k=int(args.knn), dat=dat, jobs=args.jobs)
     else:
-        # Iterate over groups and perform either a mean or median imputation.
+        # Iterate over groups and perform either a mean, median or bayesian
+        # imputation.
         pdFull = iterateGroups(dat=dat, strategy=args.strategy, dist=args.dist, 
-                                rc=args.rowCutoff) 
+                                rc=float(args.rowCutoff), seed=args.seed)
         
     # Convert dataframe to float and round results to 4 digits
-    pdFull.applymap(float)
+    pdFull = pdFull.astype(float)
     pdFull = pdFull.round(4)
 
     # Maake sure that the output has the same unique.ID
@@ -35,8 +35,8 @@ from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
 from sklearn import datasets
 from sklearn.model_selection import GridSearchCV, cross_val_score
 from sklearn.preprocessing import StandardScaler
-# Importing Kruscal-Wallis module
-from scipy.stats.mstats import kruskalwallis
+# Importing chi-squared distribution for the Kruscal-Wallis p-values
+from scipy.stats import chi2
 
 
 # Import local plottin libraries
@@ -98,6 +98,98 @@ def getOptions(myopts=None):
     return(args)
 
 
+def rankRows(values):
+    """
+    Ranks the values of every row (feature) at once, giving tied values the
+    average of their ranks. Also returns the tie correction term used by the
+    Kruscal-Wallis statistic.
+
+    :Arguments:
+        :type values: numpy.ndarray
+        :param values: Matrix of features (rows) by samples (columns).
+
+    :Returns:
+        :rtype ranks: numpy.ndarray
+        :return ranks: Matrix with the within-row ranks (starting at 1).
+
+        :rtype ties: numpy.ndarray
+        :return ties: Sum of (t^3 - t) over the tied blocks of every row.
+    """
+    n_rows, n_cols = values.shape
+    rows = np.arange(n_rows)[:, np.newaxis]
+    positions = np.arange(n_cols)
+
+    # Sorting every row once
+    order = np.argsort(values, axis=1, kind="mergesort")
+    sorted_values = values[rows, order]
+
+    # Tied blocks: first and last sorted position of the block of every element
+    new_block = np.ones((n_rows, n_cols), dtype=bool)
+    new_block[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    end_block = np.ones((n_rows, n_cols), dtype=bool)
+    end_block[:, :-1] = new_block[:, 1:]
+    first = np.maximum.accumulate(np.where(new_block, positions, 0), axis=1)
+    last = np.minimum.accumulate(np.where(end_block, positions, n_cols)[:, ::-1], axis=1)[:, ::-1]
+
+    # Average rank of the block goes back to the original positions
+    ranks = np.empty((n_rows, n_cols))
+    ranks[rows, order] = (first + last) / 2.0 + 1
+
+    # Every element of a block of size t adds (t^2 - 1), so a block adds t^3 - t
+    size = (last - first + 1).astype(float)
+    ties = (size ** 2 - 1).sum(axis=1)
+
+    return ranks, ties
+
+
+def kruskalWallisRows(values, groups, levels):
+    """
+    Runs the Kruscal-Wallis test for every feature at once from the per-group
+    rank sums. Gives the same results as scipy.stats.mstats.kruskalwallis on
+    each feature. Features where all the values are identical get NaN.
+
+    :Arguments:
+        :type values: numpy.ndarray
+        :param values: Matrix of features (rows) by samples (columns).
+
+        :type groups: numpy.ndarray
+        :param groups: Group of each of the samples (columns) in values.
+
+        :type levels: list
+        :param levels: Group levels to be compared.
+
+    :Returns:
+        :rtype H_value: numpy.ndarray
+        :return H_value: Tie corrected H statistic of each feature.
+
+        :rtype p_value: numpy.ndarray
+        :return p_value: p-value of each feature.
+    """
+    # Keeping only the samples of the compared levels
+    keep = np.in1d(groups, levels)
+    values = values[:, keep]
+    groups = groups[keep]
+    total = values.shape[1]
+
+    # Ranking each feature only once
+    ranks, ties = rankRows(values)
+
+    # Sum of the squared rank sums over group sizes
+    sum_ranks = np.zeros(values.shape[0])
+    for level in levels:
+        in_level = groups == level
+        sum_ranks += ranks[:, in_level].sum(axis=1) ** 2 / in_level.sum()
+
+    # Statistic with the tie correction
+    H_value = 12.0 / (total * (total + 1)) * sum_ranks - 3 * (total + 1)
+    correction = 1.0 - ties / float(total ** 3 - total)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        H_value = np.where(correction > 0, H_value / correction, np.nan)
+    p_value = chi2.sf(H_value, len(levels) - 1)
+
+    return H_value, p_value
+
+
 def main(args):
 
     # Loading data trought Interface
@@ -121,94 +213,30 @@ def main(args):
 
     # Extracting data from the interface.
     data_frame = dat.transpose()
-    # Extracting number of features.
-    number_of_features = data_frame.shape[1] - 1
-    # Saving treatment group name from the arguments.
-
 
-    
-
-    # Running overall Kruscall-Wallis test for all group levels combined.
-
-    # Creating p_values_all and flag_values_all for 3 significance levels as emply lists of length equal to the number_of_features.
-    # This will be used for all groups.
-    p_value_all = [0] * number_of_features
-    H_value_all = [0] * number_of_features
-    mean_value_all = [0] * number_of_features
-    variance_value_all = [0] * number_of_features
-    flag_value_all_0p01 = [0] * number_of_features
-    flag_value_all_0p05 = [0] * number_of_features
-    flag_value_all_0p10 = [0] * number_of_features
-
-    for j in range(0, number_of_features ):
-
-
-        # Creating duplicate for manipulation.
-        data_frame_manipulate = data_frame
+    # Dropping columns that characterize group. Only feature columns will remain.
+    # We also trnaspose here so it will be easier to operate with.
+    data_frame_features = data_frame.drop( args.group, 1 ).transpose()
 
-        # Dropping columns that characterize group. Only feature columns will remain.
-        # We also trnaspose here so it will be easier to operate with.
-        data_frame_manipulate_transpose  = data_frame_manipulate.drop( args.group, 1 ).transpose()
-        # Pulling indexes list from the current data frame.
-        indexes_list_complete = data_frame_manipulate_transpose.index.tolist()
+    # Pulling indexes list and the values (features x samples) from the current data frame.
+    indexes_list = data_frame_features.index.tolist()
+    values = data_frame_features.values.astype(float)
+    groups = data_frame[args.group].values
 
-	# Computing dataset summaries.
-        mean_value_all[j] = np.mean(data_frame_manipulate_transpose.loc[ indexes_list_complete[j] ]) 
-        variance_value_all[j] = np.var(data_frame_manipulate_transpose.loc[ indexes_list_complete[j] ], ddof = 1)
 
-        for i in range(0, number_of_unique_groups ):
-
-            # Extracting the pieces of the data frame that belong to ith unique group.
-            data_frame_current_group = data_frame.loc[data_frame[args.group].isin( [ group_values_series_unique[i] ]  )]
-
-            # Dropping columns that characterize group. Only feature columns will remain.
-            # We also trnaspose here so it will be easier to operate with.
-            data_frame_current_group  = data_frame_current_group.drop( args.group, 1 ).transpose()
-            # Pulling indexes list from the current data frame.
-            indexes_list = data_frame_current_group.index.tolist()
+    # Running overall Kruscall-Wallis test for all group levels combined.
+    # All the features are ranked once and tested at the same time.
+    H_value_all, p_value_all = kruskalWallisRows(values, groups, group_values_series_unique)
 
-            # Series current for group i and row (feature) j.
-            series_current  = data_frame_current_group.loc[ indexes_list[j] ] 
-            
-            # This piece of code depends on whether it is the first group in the list or not.
-            if i == 0:
-               series_total = [series_current]
-	    else:	
-               series_total.append(series_current)
-
-
-        # Checking if the compared elements are different.   
-        # Combining for checking.	
-        combined_list = data_frame_manipulate_transpose.loc[ indexes_list_complete[j] ].tolist()
-	combined_list_unique = np.unique(combined_list)
-        # Checking if the number of unique elements is exactly 1.
-        if len(combined_list_unique) == 1:
-           # Performing Kruscal-Wallis for all groups for feature j.
-           p_value_all[j] = float("nan")
-           H_value_all[j] = float("nan")
-           if p_value_all[j] < 0.01: flag_value_all_0p01[j] = 1
-           if p_value_all[j] < 0.05: flag_value_all_0p05[j] = 1
-           if p_value_all[j] < 0.10: flag_value_all_0p10[j] = 1
-
-	else:
-           # Performing Kruscal-Wallis for all groups for feature j.
-           kruscal_wallis_args = series_total
-           p_value_all[j] = kruskalwallis( *kruscal_wallis_args )[1]
-           H_value_all[j] = kruskalwallis( *kruscal_wallis_args )[0]
-           if p_value_all[j] < 0.01: flag_value_all_0p01[j] = 1
-           if p_value_all[j] < 0.05: flag_value_all_0p05[j] = 1
-           if p_value_all[j] < 0.10: flag_value_all_0p10[j] = 1
-    
- 
-    # The loop over features has to be finished by now. Converting them into the data frame.    
+    # Converting them into the data frame.    
     # The pariwise results will be added later.
-    summary_df     =  pd.DataFrame(data = mean_value_all, columns = ["GrandMean"], index = indexes_list )    
-    summary_df['SampleVariance'] =  variance_value_all
+    summary_df     =  pd.DataFrame(data = values.mean(axis=1), columns = ["GrandMean"], index = indexes_list )    
+    summary_df['SampleVariance'] =  values.var(axis=1, ddof=1)
     summary_df['H_value_for_all'] =  H_value_all
     summary_df['prob_greater_than_H_for_all'] =  p_value_all
-    flag_df  =  pd.DataFrame(data = flag_value_all_0p01, columns = ["flag_significant_0p01_on_all_groups"], index = indexes_list )    
-    flag_df["flag_significant_0p05_on_all_groups"] = flag_value_all_0p05
-    flag_df["flag_significant_0p10_on_all_groups"] = flag_value_all_0p10
+    flag_df  =  pd.DataFrame(data = (p_value_all < 0.01).astype(int), columns = ["flag_significant_0p01_on_all_groups"], index = indexes_list )    
+    flag_df["flag_significant_0p05_on_all_groups"] = (p_value_all < 0.05).astype(int)
+    flag_df["flag_significant_0p10_on_all_groups"] = (p_value_all < 0.10).astype(int)
 
     # Informing that KW for all group has been performed.
     logger.info(u"Kruscal-Wallis test for all groups together has been performed.")
@@ -220,98 +248,28 @@ def main(args):
     # Computing means for each group
     # This part just produces sumamry statistics for the output table.
     # This has nothing to do with Kruscal-Wallis
-
+    means = dict()
     for i in range(0, number_of_unique_groups ):
-        
-
-        # Extracting the pieces of the data frame that belong to ith group.
-        data_frame_current_group  = data_frame.loc[data_frame[args.group].isin( [group_values_series_unique[i]]  )]
-
-        # Dropping columns that characterize group. Only feature columns will remain.
-        # We also trnaspose here so it will be easier to operate with.
-        data_frame_current_group  = data_frame_current_group.drop( args.group, 1 ).transpose()
-        # Pulling indexes list from the current group.
-        indexes_list = data_frame_current_group.index.tolist()
-
-        # Creating array of means for the current group that will be filled.
-        means_value  = [0] * number_of_features
-    
-        for j in range(0, number_of_features ):
-
-            series_current = data_frame_current_group.loc[ indexes_list[j] ] 
-            means_value[j] = series_current.mean()
-
+        means[group_values_series_unique[i]] = values[:, groups == group_values_series_unique[i]].mean(axis=1)
 
         means_value_column_name_current  = 'mean_treatment_' + group_values_series_unique[i] 
-        summary_df[means_value_column_name_current] = means_value
+        summary_df[means_value_column_name_current] = means[group_values_series_unique[i]]
             
 
 
 
     # Running pairwise Kruscall-Wallis test for all pairs of group levels that are saved in groups_pairwise.
+    # Each pair ranks the samples of its two groups once for all the features.
 
     for i in range(0, number_of_groups_pairwise ):
         
-
-        # Extracting the pieces of the data frame that belong to groups saved in the i-th unique pair.
         groups_subset = groups_pairwise[i] 
-        data_frame_first_group  = data_frame.loc[data_frame[args.group].isin( [groups_subset[0]]  )]
-        data_frame_second_group = data_frame.loc[data_frame[args.group].isin( [groups_subset[1]]  )]
-
-
-        # Dropping columns that characterize group. Only feature columns will remain.
-        # We also trnaspose here so it will be easier to operate with.
-        data_frame_first_group  = data_frame_first_group.drop( args.group, 1 ).transpose()
-        data_frame_second_group = data_frame_second_group.drop( args.group, 1 ).transpose()
-        # Pulling indexes list from the first one (they are the same)
-        indexes_list = data_frame_first_group.index.tolist()
-
-
-        # Creating p_values, neg_log10_p_value, flag_values, difference_value lists filled wiht 0es.
-        p_value           = [0] * number_of_features
-        H_value           = [0] * number_of_features
-        neg_log10_p_value = [0] * number_of_features
-        flag_value_0p01   = [0] * number_of_features
-        flag_value_0p05   = [0] * number_of_features
-        flag_value_0p10   = [0] * number_of_features
-        difference_value  = [0] * number_of_features
-    
-        for j in range(0, number_of_features ):
-     
-            series_first  = data_frame_first_group.loc[ indexes_list[j] ] 
-            series_second = data_frame_second_group.loc[ indexes_list[j] ]
-  
-            # Checking if the compared elements are different.   
-	    # Combining for checking.	
-            first_list  = data_frame_first_group.loc[ indexes_list[j] ].tolist()
-	    second_list = data_frame_second_group.loc[ indexes_list[j] ].tolist()
-            combined_list = first_list + second_list
-	    combined_list_unique = np.unique(combined_list)
-            # Checking if the number of unique elements is exactly 1.
-            if len(combined_list_unique) == 1:
-               p_value[j] = float("nan")
-               H_value[j] = float("nan")
-               # Possible alternative for two groups.
-               # p_value[j] = kruskalwallis(series_first, series_second)[1]
-     	       neg_log10_p_value[j] = - np.log10(p_value[j])
-               difference_value[j] = series_first.mean() - series_second.mean()
-               if p_value[j] < 0.01: flag_value_0p01[j] = 1
-               if p_value[j] < 0.05: flag_value_0p05[j] = 1
-               if p_value[j] < 0.10: flag_value_0p10[j] = 1
-
-            else:
-               kruscal_wallis_args = [series_first, series_second]
-               p_value[j] = kruskalwallis( *kruscal_wallis_args )[1]
-               H_value[j] = kruskalwallis( *kruscal_wallis_args )[0]
-               # Possible alternative for two groups.
-               # p_value[j] = kruskalwallis(series_first, series_second)[1]
-     	       neg_log10_p_value[j] = - np.log10(p_value[j])
-               difference_value[j] = series_first.mean() - series_second.mean()
-               if p_value[j] < 0.01: flag_value_0p01[j] = 1
-               if p_value[j] < 0.05: flag_value_0p05[j] = 1
-               if p_value[j] < 0.10: flag_value_0p10[j] = 1
 
-        
+        H_value, p_value = kruskalWallisRows(values, groups, list(groups_subset))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            neg_log10_p_value = - np.log10(p_value)
+        difference_value = means[groups_subset[0]] - means[groups_subset[1]]
+
         # Adding current p_value and flag_value column to the data frame and assigning the name
         p_value_column_name_current           = 'prob_greater_than_H_for_diff_' + groups_subset[0] + '_' + groups_subset[1]
         H_value_column_name_current           = 'H_value_for_diff_' + groups_subset[0] + '_' + groups_subset[1]
@@ -325,9 +283,9 @@ def main(args):
         flag_value_column_name_current_0p01 = 'flag_significant_0p01_on_' + groups_subset[0] + '_' + groups_subset[1]
         flag_value_column_name_current_0p05 = 'flag_significant_0p05_on_' + groups_subset[0] + '_' + groups_subset[1]
         flag_value_column_name_current_0p10 = 'flag_significant_0p10_on_' + groups_subset[0] + '_' + groups_subset[1]
-        flag_df[flag_value_column_name_current_0p01] = flag_value_0p01
-        flag_df[flag_value_column_name_current_0p05] = flag_value_0p05
-        flag_df[flag_value_column_name_current_0p10] = flag_value_0p10
+        flag_df[flag_value_column_name_current_0p01] = (p_value < 0.01).astype(int)
+        flag_df[flag_value_column_name_current_0p05] = (p_value < 0.05).astype(int)
+        flag_df[flag_value_column_name_current_0p10] = (p_value < 0.10).astype(int)
   
         
    
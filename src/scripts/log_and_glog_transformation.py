@@ -49,6 +49,11 @@ def getOptions():
     parser.add_argument("-la", "--lambda_value",dest="lambda_value", action='store', 
                         required=False,  default=0, help="Lambda parameter"\
                         " which is used only for G-Log transformation.")
+    parser.add_argument("-cs","--chunksize", dest="chunksize", action='store',
+                        type=int, required=False, default=None, help="Read, "\
+                        "transform and write the wide file in chunks of this "\
+                        "many features, for datasets that do not fit in memory "\
+                        "[Optional].")
     # Tool Output
     parser.add_argument("-o","--oname", dest="oname", action='store', 
                         required=True, help="Output file name.")
@@ -56,6 +61,10 @@ def getOptions():
                         required=False, help="Add debugging log output.")
     args = parser.parse_args()
 
+    # Validate chunksize
+    if args.chunksize is not None and args.chunksize < 1:
+        parser.error("chunksize must be a number greater than 0")
+
     # Standatdize paths
     args.oname  = os.path.abspath(args.oname)
     args.input  = os.path.abspath(args.input)
@@ -64,62 +73,70 @@ def getOptions():
     return(args)
 
 
-def main(args):
-      
-    # Imput data
-    dat = wideToDesign(args.input, args.design, args.uniqID, logger=logger)
+def transform(values, transformation, log_base, lambda_value=0):
+    """
+    Log or G-Log transformation of an array of values.
 
+    Generalized log transformation formula is:  log(y + sqrt(y^2 + lambda_value))
+    It reduced to sqrt(2) rescaled version of log when lambda_value = 0
+    i.e. lambda_value == 0 implies log(y + y) = sqrt(2) * log(y)
 
-    # Convert objects to numeric
-    norm = dat.wide.applymap(float)
+    :Arguments:
+        :type values: numpy.array
+        :param values: Values to transform.
 
-     
-    # The following steps depend whether we perform log transformation or g-log transformation.
+        :type transformation: str
+        :param transformation: 'log' or 'glog'.
 
-    # LOG Transformation
-    if args.transformation == 'log':
+        :type log_base: str
+        :param log_base: 'log', 'log2' or 'log10'.
+
+        :type lambda_value: float
+        :param lambda_value: Lambda parameter of the G-Log transformation.
 
-       # According to the tipe of log-base selected perform log transformation
-       if args.log_base == 'log':
-            logger.info(u"Running Log transformation with log e")
-            norm = norm.apply(lambda x: np.log(x))
-       elif args.log_base == 'log2':
-            logger.info(u"Running Log transformation with log 2")
-            norm = norm.apply(lambda x: np.log2(x))
-       elif args.log_base == 'log10':
-            logger.info(u"Running Log transformation with log 10")
-            norm = norm.apply(lambda x: np.log10(x))
-
-    # G-LOG Transformation
-    # Generalized log transformation formula is:  log(y + sqrt(y^2 + lambda_value))
-    # It reduced to sqrt(2) rescaled version of log when lambda_value = 0
-    # i.e. lambda_value == 0 implies log(y + y) = sqrt(2) * log(y)
-    if args.transformation == 'glog':
-
-       # According to the tipe of log-base selected perform log transformation
-       if args.log_base == 'log':
-            logger.info(u"Running G-Log transformation with log e")
-            norm = np.log( norm + np.sqrt( np.square(norm) + float(args.lambda_value) ) )
-       elif args.log_base == 'log2':
-            logger.info(u"Running G-Log transformation with log 2")
-            norm = np.log2( norm + np.sqrt( np.square(norm) + float(args.lambda_value) ) )
-       elif args.log_base == 'log10':
-            logger.info(u"Running G-Log transformation with log 10")
-            norm = np.log10( norm + np.sqrt( np.square(norm) + float(args.lambda_value) ) )
-
-
-
-    # Round results to 8 digits
-    norm = norm.apply(lambda x: x.round(8))
-
-    # Treat inf as NaN
-    norm.replace([np.inf, -np.inf], np.nan, inplace=True)
-
-    # Debugging step
-    # print "norm", norm
-
-    # Save file to CSV
-    norm.to_csv(args.oname, sep="\t")
+    :Returns:
+        :rtype: numpy.array
+        :return: Transformed values rounded to 8 digits, inf are treated as
+                NaN.
+    """
+    logFunction = {"log":np.log, "log2":np.log2, "log10":np.log10}[log_base]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if transformation == "glog":
+            values = values + np.sqrt(np.square(values) + float(lambda_value))
+        values = np.round(logFunction(values), 8)
+    values[np.isinf(values)] = np.nan
+    return values
+
+def main(args):
+      
+    # Imput data
+    dat = wideToDesign(args.input, args.design, args.uniqID, logger=logger,
+                        chunksize=args.chunksize)
+
+    # Transformation of every feature is independent of the others so the
+    # data can be transformed by chunks of features
+    if args.chunksize:
+        chunks = dat.iterChunks()
+    else:
+        chunks = [dat.wide]
+
+    # Telling the user about the transformation
+    base = {"log":"log e", "log2":"log 2", "log10":"log 10"}[args.log_base]
+    if args.transformation == 'log':
+        logger.info(u"Running Log transformation with {0}".format(base))
+    else:
+        logger.info(u"Running G-Log transformation with {0}".format(base))
+
+    # Save file to CSV, the header is written first and every chunk is
+    # appended after it is transformed
+    with open(args.oname, 'w') as OUT:
+        dat.wide.iloc[:0].to_csv(OUT, sep="\t")
+        for chunk in chunks:
+            norm = pd.DataFrame(transform(chunk.values.astype(float),
+                                args.transformation, args.log_base,
+                                args.lambda_value),
+                                index=chunk.index, columns=chunk.columns)
+            norm.to_csv(OUT, sep="\t", header=False)
     logger.info("Finishing Script")
     
 if __name__ == '__main__':
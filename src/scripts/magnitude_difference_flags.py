@@ -22,6 +22,7 @@ from StringIO import StringIO as IO
 # Import add-on libraries
 import matplotlib
 import numpy as np
+import pandas as pd
 matplotlib.use('Agg')
 from lxml import etree
 import matplotlib.pyplot as plt
@@ -87,6 +88,9 @@ def splitDigits(x):
     """ 
     Function to split digits by decimal
 
+    String method to count the digits of a single number, it is kept as the
+    reference of digitCounts (see test_magnitude_difference_flags.py).
+
         :Arguments:
             :type x: int
             :param x: Number to count digits form.
@@ -106,6 +110,97 @@ def splitDigits(x):
         # Before the decimal point then return
         return len(x.split('.')[0])
 
+def powersOfTen():
+    """
+    Function to get the powers of ten as floats that can be compared exactly
+    with any float.
+
+        :Returns:
+            :rtype powers: numpy.array
+            :returns powers: For every power of ten 10**k (k = 0..308) the
+                            smallest float greater or equal to it, followed by
+                            infinity.
+
+    """
+    powers = list()
+    for k in range(309):
+        power = float(10 ** k)
+        # Above 10**22 powers of ten are not exact floats
+        if int(power) < 10 ** k:
+            power = np.nextafter(power, np.inf)
+        powers.append(power)
+    powers.append(np.inf)
+    return np.array(powers)
+
+# A float is greater or equal to 10**k only if it is greater or equal to
+# POWERS_OF_TEN[k]
+POWERS_OF_TEN = powersOfTen()
+
+def digitCounts(values):
+    """
+    Function to count the digits before the decimal point of an array of
+    numbers.
+
+    Counts are the same as the length of the integer part of the number
+    formated with '%f', values are rounded to 6 decimals first (9.9999996
+    has 2 digits), numbers between -1 and 1 have 1 digit ('0'), the minus sign
+    counts as a digit and zeros are not counted (NaN). Missing values have 3
+    digits ('nan'), as well as infinity ('inf', '-inf' has 4).
+
+        :Arguments:
+            :type values: numpy.array
+            :param values: Numbers to count digits from.
+
+        :Returns:
+            :rtype counts: numpy.array
+            :returns counts: count of digits of every number.
+
+    """
+    values = np.asarray(values, dtype=float)
+    magnitude = np.abs(values)
+    finite = np.isfinite(values)
+    magnitude[~finite] = 0
+
+    # Integer part after rounding to 6 decimals. The fractional part is exact
+    # and 0.9999995 is stored slightly above its value, so it rounds up
+    # whenever it is greater or equal to the stored value.
+    integer = np.floor(magnitude)
+    integer += (magnitude - integer) >= 0.9999995
+
+    # Number of digits from floor(log10) corrected on the powers of ten,
+    # a zero integer part has 1 digit
+    integer = np.maximum(integer, 1)
+    exponent = np.floor(np.log10(integer))
+    exponent = np.clip(exponent, 0, 308).astype(int)
+    exponent -= integer < POWERS_OF_TEN[exponent]
+    exponent += integer >= POWERS_OF_TEN[exponent + 1]
+    counts = (exponent + 1 + np.signbit(values)).astype(float)
+
+    # Zeros are not counted, missing values and infinity are written as text
+    counts[~finite] = 3 + (values[~finite] < 0)
+    counts[values == 0] = np.nan
+    return counts
+
+def summarizeCounts(count):
+    """
+    This function adds the min, max and diff among rows to digit counts.
+
+        :Arguments:
+            :type count: pandas.DataFrame.
+            :param count: DataFrame with the counted digits.
+
+        :Returns:
+            :rtype count: pandas.DataFrame
+            :returns count: DataFrama with the counted digits and min, max and 
+                            diff among rows.
+
+    """
+    count = count.copy()
+    count["min"] = count.min(axis=1)
+    count["max"] = count.max(axis=1)
+    count["diff"] = count["max"] - count["min"]
+    return count
+
 def countDigits(wide):
     """
     This function counts digits on a given file.
@@ -120,16 +215,16 @@ def countDigits(wide):
                             diff among rows.
 
     """
-    # Count the number of digits before decimal and get basic distribution info
-    count = wide.applymap(lambda x: splitDigits(x))
+    # Count the number of digits before decimal for all the values at once
+    count = pd.DataFrame(digitCounts(wide.values), index=wide.index,
+                        columns=wide.columns)
 
-    # Calculate min, max number of digits on the row and the difference
-    count["min"] = count.apply(np.min, axis=1)
-    count["max"] = count.apply(np.max, axis=1)
-    count["diff"] = count["max"] - count["min"]
+    # Samples without zeros have integer counts
+    for column in count.columns[count.notnull().all().values]:
+        count[column] = count[column].astype(int)
 
-    # Return counts
-    return count
+    # Calculate min, max number of digits on the row and the difference
+    return summarizeCounts(count)
 
 def plotCDhistogram(count,pdf,group):
     """
@@ -196,17 +291,20 @@ def save2html(data, filename, filePath, html=None):
     #Return html
     return html
 
-def countDigitsByGroup(dat, args, folderDir, pdf, html=None):
+def countDigitsByGroup(dat, count, args, folderDir, pdf, html=None):
     """ 
     If the group option is selected this function is called to split by groups.
 
-    The function calls the countDigits function in a loop that iterates through
-    the groups
+    The digits of all the samples are counted once, the function summarizes
+    the counts of every group in a loop that iterates through the groups
 
         :Arguments:
             :type dat: wideToDesign
             :param dat: input data 
 
+            :type count: pandas.DataFrame.
+            :param count: DataFrame with the counted digits of all samples.
+
             :type args: argparse.ArgumentParser.
             :param args: Command line arguments.
 
@@ -225,17 +323,14 @@ def countDigitsByGroup(dat, args, folderDir, pdf, html=None):
             # Setting count name
             countName = args.counts+"_{0}.tsv".format(name)
 
-            # Filter the wide file into a new dataframe
-            currentFrame = dat.wide[group.index]
-
-            # Counting digits per group
-            count  = countDigits(currentFrame)
+            # Summarizing the counts of the group
+            groupCount = summarizeCounts(count[group.index])
 
             # Plotting CD histograms
-            plotCDhistogram(count,pdf,name)
+            plotCDhistogram(groupCount,pdf,name)
 
             # Save countName, save it to html if exist
-            save2html(html=html, data=count, filename=countName, filePath=countPath)
+            save2html(html=html, data=groupCount, filename=countName, filePath=countPath)
             
 def saveFlags(count):
     """ 
@@ -282,13 +377,14 @@ def main(args):
 
     # Use group separation or not depending on user input
     with PdfPages(os.path.abspath(args.figure)) as pdf:
+        # Count digits for all elements
+        count = countDigits(wide=dat.wide)
+
         if args.group:
             # Count Digits per group
             logger.info(u"Counting digits per group")
-            countDigitsByGroup(dat, args, folderDir, pdf, html=html)
-
-        # Count digits for all elements
-        count = countDigits(wide=dat.wide)
+            countDigitsByGroup(dat, count[dat.wide.columns], args, folderDir,
+                                pdf, html=html)
 
         # Plotting for all elements
         plotCDhistogram(count=count, pdf=pdf, group="all")
@@ -16,6 +16,7 @@
 import os
 import logging
 import argparse
+from multiprocessing import Pool
 
 # Import add-on libraries
 import numpy as np
@@ -23,7 +24,6 @@ import pandas as pd
 import scipy.stats as stats
 from numpy.linalg import svd
 import matplotlib.pyplot as plt
-from sklearn.neighbors import DistanceMetric
 from matplotlib.backends.backend_pdf import PdfPages
 
 # Import local data libraries
@@ -62,8 +62,9 @@ def getOptions():
     # Tool output
     output = parser.add_argument_group(description="Output Files")
     output.add_argument("-f", "--figure", dest="figure", action='store', 
-                        required=True, help="PDF Output of standardized"\
-                        "Euclidean distance plot")
+                        required=False, default=None, help="PDF Output of "\
+                        "penalized Mahalanobis distance plot. If not given "\
+                        "the plots are skipped.")
     output.add_argument("-m","--distanceToMean", dest="toMean", action='store', 
                         required=True, help="TSV Output of Mahalanobis "\
                          "distances from samples to the mean.")
@@ -78,6 +79,12 @@ def getOptions():
     tool.add_argument("-pen", "--penalty", dest="penalty", action="store", 
                         required=False, default=0.5, type=float, help="Value"\
                         " of lambda for the penalty.")
+    tool.add_argument("-f32", "--float32", dest="float32", action="store_true",
+                        required=False, default=False, help="Compute the "\
+                        "distances in single precision to halve memory use.")
+    tool.add_argument("-j","--jobs", dest="jobs", action='store', type=int,
+                        required=False, default=1, help="Number of processes "\
+                        "used to compute the groups in parallel. The default is 1.")
     tool.add_argument("-lg","--log",dest="log",action="store",required=False, 
                         default=True,help="Log file")
     # Plot options
@@ -90,7 +97,8 @@ def getOptions():
     args = parser.parse_args()
 
     # Standardize paths
-    args.figure   = os.path.abspath(args.figure)
+    if args.figure:
+        args.figure = os.path.abspath(args.figure)
     args.toMean   = os.path.abspath(args.toMean)
     args.pairwise = os.path.abspath(args.pairwise)
 
@@ -100,62 +108,86 @@ def getOptions():
 
     return(args)
 
-def calculatePenalizedSigma(data, penalty=0.5):
-    # Getting n and p of data.
-    n,p = data.shape
+def mahalanobisKernel(values, penalty=0.5, dtype=np.float64):
+    """
+    Calculates penalized mahalanobis distances from every sample to the mean
+    and between every pair of samples.
 
-    # Calculate the mean of every row
-    data["mean"] = data.mean(axis=1)
+    The penalized inverse covariance is (p-1)*U*diag(1/(d+lambda))*U', where
+    U and d=s**2 come from the SVD of the centered data and lambda is the
+    given percentile of d, the directions outside U get 1/lambda. Since the
+    centered samples lie on the span of U, whitening them as
+    sqrt(p-1)*diag(s/sqrt(d+lambda))*V' turns the distances into euclidean
+    ones, so only a thin SVD and one samples x samples Gram matrix are needed
+    and the features x features covariance is never formed.
 
-    # Standardize data (_std stands for standardized)
-    data_std = data.apply(lambda x: x-x["mean"],axis=1)
+    :Arguments:
+        :type values: numpy.array
+        :param values: Array with features as rows and samples as columns.
 
-    # Dropping mean column from both data and data_standardized 
-    data.drop("mean", axis=1, inplace=True)
-    data_std.drop("mean", axis=1, inplace=True)
+        :type penalty: float
+        :param penalty: Percentile (from 0 to 1) of d used as lambda.
 
-    # Calculate singular value decomposition
-    U,s,V = svd(data_std)
+        :type dtype: numpy.dtype
+        :param dtype: Precision used for the calculations.
 
-    # Calculate ds based on ss (d = s**2)
-    d = s**2
+    :Returns:
+        :rtype toMean: numpy.array
+        :return toMean: Distance from every sample to the mean.
 
-    # Based on ds calculate the penalty. penalty must be expressed as a 
-    # proportion (from 0 to 1) to use it on the np.percentile it will be 
-    # multiplied by 100
-    penalty = np.percentile(d,q=penalty*100.0)
+        :rtype pairwise: numpy.array
+        :return pairwise: Pairwise distances between samples, the diagonal
+                            is NaN.
+    """
+    # Getting number of samples
+    p = values.shape[1]
 
-    # After the calculation of the penalty extend d vector to size n
-    d = np.append(d,np.zeros(shape=(n-len(d))))
+    # Standardize data (_std stands for standardized)
+    data_std = np.asarray(values, dtype=dtype)
+    data_std = data_std - data_std.mean(axis=1)[:, np.newaxis]
 
-    # Calculate penalty and inverse for d (1/(d+penalty)) 
-    d = [1/(val+penalty) for val in d]
+    # Calculate thin singular value decomposition
+    s, V = svd(data_std, full_matrices=False)[1:]
 
-    # Creating empty matrix of size n x p and the fiiling the diagonal with
-    # penalized s values
-    #S = np.zeros((n,p))
-    #S[:len(s),:len(s)] = np.diag(s)
-    D = np.diag(d)
+    # Calculate ds based on ss (d = s**2) and the penalty. penalty must be
+    # expressed as a proportion (from 0 to 1) to use it on the np.percentile
+    # it will be multiplied by 100
+    d = s**2
+    penalty = np.percentile(d, q=penalty*100.0)
 
-    # Compute the stimate of the penalized sigma
-    penalized_sigma = np.dot(U, np.dot(D, U.T))
+    # Whitened samples (components x samples)
+    whitened = (np.sqrt(p-1) * s / np.sqrt(d+penalty))[:, np.newaxis] * V
 
-    # Multiply everything by p-1
-    penalized_sigma = (p-1)*penalized_sigma
-    
-    # Returning penalized sigma
-    return (penalized_sigma)
+    # Distances to the mean are the norms of the whitened samples
+    norms = (whitened**2).sum(axis=0)
+    toMean = np.sqrt(norms)
 
-def calculateDistances(data, V_VI):
+    # Pairwise distances from the Gram matrix of the whitened samples
+    gram = np.dot(whitened.T, whitened)
+    pairwise = np.sqrt(np.maximum(norms[:, np.newaxis] + norms[np.newaxis, :]
+                                    - 2*gram, 0))
+
+    #Converts to NaN the diagonal
+    pairwise[np.diag_indices(p)] = np.nan
+
+    return (toMean, pairwise)
+
+def calculateDistances(data, penalty=0.5, float32=False):
     """ 
-    Calculates euclidean or mahalanobis distances. Returns an array of 
+    Calculates penalized mahalanobis distances. Returns an array of 
     distances to the Mean and an a matrix of pairwise distances.
 
     :Arguments:
-        :type wide: pandas.DataFrame
-        :param wide: A wide formatted data frame with samples as columns and 
+        :type data: pandas.DataFrame
+        :param data: A wide formatted data frame with samples as columns and 
                      compounds as rows.
 
+        :type penalty: float
+        :param penalty: Value of lambda for the penalty.
+
+        :type float32: bool
+        :param float32: Calculate in single precision.
+
     :Returns:
         :return distanceToMean: pd.DataFrames with distances to the mean.
         :rtype: pd.DataFrames
@@ -164,27 +196,19 @@ def calculateDistances(data, V_VI):
         samples.
         :rtype: pd.DataFrames
     """
-    # Calculating mean
-    mean = pd.DataFrame(data.mean(axis=1))
-    
-    # Getting metric
-    dist = DistanceMetric.get_metric("mahalanobis", VI=V_VI)
-    
-    # Calculate distance from all samples to the mean
-    distanceToMean = dist.pairwise(data.values.T, mean.T)
-    distanceToMean = pd.DataFrame(distanceToMean, columns = ['distance_to_mean'], 
-                                index = data.columns)
+    # Calculate distances
+    toMean, pairwise = mahalanobisKernel(data.values, penalty=penalty,
+                        dtype=np.float32 if float32 else np.float64)
+
+    # Distance from all samples to the mean
+    distanceToMean = pd.DataFrame(toMean.astype(float),
+                                columns=['distance_to_mean'], index=data.columns)
     distanceToMean.name = data.name
 
-    # Calculate pairwise distances among samples
-    distancePairwise = dist.pairwise(data.values.T)
-    distancePairwise = pd.DataFrame(distancePairwise, columns=data.columns, 
+    # Pairwise distances among samples
+    distancePairwise = pd.DataFrame(pairwise.astype(float), columns=data.columns, 
                                 index=data.columns)
     distancePairwise.name = data.name
-    
-    #Converts to NaN the diagonal
-    for index, row in distancePairwise.iterrows():
-        distancePairwise.loc[index, index] = np.nan
 
     return (distanceToMean,distancePairwise)
 
@@ -239,13 +263,70 @@ def calculateCutoffs(data,p):
     cutoff2   = pd.DataFrame([[betaCut2, normCut2, chisqCut2],
                             ['Beta(Exact)', 'Normal', 'Chi-sq']],index=["cut","name"],
                             columns=['Beta(Exact)', 'Normal', 'Chi-sq'])
-    
-    # Create Palette
-    cutPalette.getColors(cutoff1.T,["name"])
 
-    # Returning colors
+    # Returning cutoffs
     return (cutoff1,cutoff2)
 
+def groupDistances(task):
+    """
+    Calculates distances and cutoffs for a group. This is the unit of work
+    given to the workers of the pool.
+
+    :Arguments:
+        :type task: tuple
+        :param task: Name of the group, its wide data, penalty, float32 and
+            percentile of the cutoffs.
+
+    :Returns:
+        :rtype: tuple
+        :return: Name of the group, distances to the mean, pairwise distances
+            and cutoffs for to the mean and pairwise.
+    """
+    name, currentFrame, penalty, float32, p = task
+    currentFrame.name = name
+
+    # Calculate Distances (dis estands for distance)
+    disToMean, disPairwise = calculateDistances(data=currentFrame,
+                            penalty=penalty, float32=float32)
+
+    # Calculate cutoffs 
+    cutoff1, cutoff2 = calculateCutoffs(currentFrame, p)
+
+    return (name, disToMean, disPairwise, cutoff1, cutoff2)
+
+def runGroups(tasks, jobs=1):
+    """
+    Calculates distances and cutoffs of a list of groups, in parallel if more
+    than one job is given. Results are returned in the same order as tasks.
+
+    :Arguments:
+        :type tasks: list
+        :param tasks: List of tasks for groupDistances.
+
+        :type jobs: int
+        :param jobs: Number of processes to use.
+
+    :Returns:
+        :rtype: list
+        :return: List of results from groupDistances.
+    """
+    if jobs > 1 and len(tasks) > 1:
+        pool = Pool(processes=min(jobs, len(tasks)))
+        try:
+            results = pool.map(groupDistances, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [groupDistances(task) for task in tasks]
+
+    # Names are not kept when data frames are sent back from the workers
+    for name, disToMean, disPairwise, cutoff1, cutoff2 in results:
+        disToMean.name = name
+        disPairwise.name = name
+
+    return results
+
 def plotCutoffs(cut_S,ax,p):
     """
     Plot the cutoff lines to each plot
@@ -332,6 +413,39 @@ def plotDistances(df_distance, palette, plotType, disType, cutoff, p, pdf):
     # Drop "color" column to no mess the results
     df_distance.drop("colors", axis=1, inplace=True)
 
+def plotAll(toMean_disCuts, pairwise_disCuts, p, pdf):
+    """
+    Plot every set of distances with its cutoffs.
+
+    :Arguments:
+        :type toMean_disCuts: list
+        :param toMean_disCuts: Pairs of distances to the mean and cutoffs.
+
+        :type pairwise_disCuts: list
+        :param pairwise_disCuts: Pairs of pairwise distances and cutoffs.
+
+        :type p: float
+        :param p: percentile of cutoff
+
+        :type pdf: PdfPages
+        :param pdf: PDF for output plots.
+    """
+    # Create Palette
+    cutPalette.getColors(toMean_disCuts[0][1].T,["name"])
+
+    # Iterating over toMean,pairwise distances in parallel
+    for toMean, pairwise in zip(toMean_disCuts,pairwise_disCuts):
+        # Making plots
+        plotDistances(df_distance=toMean[0], palette=dataPalette, p=p,
+                        plotType="Scatterplot", disType="Mahalanobis",
+                        cutoff=toMean[1], pdf=pdf)
+        plotDistances(df_distance=pairwise[0], palette=dataPalette, p=p,
+                        plotType="Scatterplot", disType="Mahalanobis", 
+                        cutoff=pairwise[1], pdf=pdf)
+        plotDistances(df_distance=pairwise[0], palette=dataPalette, p=p,
+                        plotType="Box-plots", disType="Mahalanobis", 
+                        cutoff=pairwise[1], pdf=pdf)
+
 def main(args):
     """ 
     Main Script 
@@ -364,28 +478,24 @@ def main(args):
         disGroups = [(dat.design.index,"samples")]
 
     # Iterating over subgroups
-    pairwise_disCuts = list()
-    toMean_disCuts   = list()
+    tasks = list()
     for indexes,name in disGroups:
         # If less than 3 elements in the group skip to the next
         if len(indexes) < 3: 
             logger.error("Group {0} has less than 3 elements, it will not be"\
-                        " included in the analysis".format(level))
+                        " included in the analysis".format(name))
             continue
 
         #Subsetting wide
         currentFrame = pd.DataFrame(dat.wide[indexes].copy())
-        currentFrame.name = name
-
-        # Calculate Penalized Sigma
-        penalizedSigma = calculatePenalizedSigma(data=currentFrame, penalty=args.penalty)
-
-        # Calculate Distances (dis estands for distance)
-        disToMean, disPairwise = calculateDistances(data=currentFrame, V_VI=penalizedSigma)
-
-        # Calculate cutoffs 
-        cutoff1, cutoff2 = calculateCutoffs(currentFrame, args.p)
+        tasks.append((name, currentFrame, args.penalty, args.float32, args.p))
 
+    # Calculate distances and cutoffs for all the groups
+    logger.info(u"Calculating distances for {0} groups".format(len(tasks)))
+    pairwise_disCuts = list()
+    toMean_disCuts   = list()
+    for name, disToMean, disPairwise, cutoff1, cutoff2 in runGroups(tasks,
+                                                                args.jobs):
         # Appending results
         pairwise_disCuts.append([disPairwise,cutoff2])
         toMean_disCuts.append([disToMean,cutoff1])
@@ -427,19 +537,11 @@ def main(args):
 
     # Iterating over each pair of (distance,cutoff) for toMean and pairwise to
     # plot  distances.
-    with PdfPages((args.figure)) as pdf:
-        # Iterating over toMean,pairwise distances in parallel
-        for toMean, pairwise in zip(toMean_disCuts,pairwise_disCuts):
-            # Making plots
-            plotDistances(df_distance=toMean[0], palette=dataPalette, p=args.p,
-                            plotType="Scatterplot", disType="Mahalanobis",
-                            cutoff=toMean[1], pdf=pdf)
-            plotDistances(df_distance=pairwise[0], palette=dataPalette, p=args.p,
-                            plotType="Scatterplot", disType="Mahalanobis", 
-                            cutoff=pairwise[1], pdf=pdf)
-            plotDistances(df_distance=pairwise[0], palette=dataPalette, p=args.p,
-                            plotType="Box-plots", disType="Mahalanobis", 
-                            cutoff=pairwise[1], pdf=pdf)
+    if args.figure:
+        with PdfPages((args.figure)) as pdf:
+            plotAll(toMean_disCuts, pairwise_disCuts, args.p, pdf)
+    else:
+        logger.info(u"No figure given, skipping plots")
 
     # Since its a list of dataframes and we are only interested in the last one
     # we are using [-1] to access it and [0] to getit out of the list.
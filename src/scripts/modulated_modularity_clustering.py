@@ -65,6 +65,15 @@ def getOptions(myOpts = None):
     tool.add_argument("-sn",'--sigmaNum',dest="sigmaNum", type=float, 
                         default=451, help="Number of values of sigma to search"\
                         " (Default: 451).")
+    tool.add_argument("-j","--jobs", dest="jobs", action='store', type=int,
+                        required=False, default=1, help="Number of processes "\
+                        "used to search over the values of sigma in parallel. "\
+                        "The default is 1.")
+    tool.add_argument("-pt","--patience", dest="patience", action='store',
+                        type=int, required=False, default=None, help="Stop the "\
+                        "search over sigma after this many consecutive values "\
+                        "without improving the modularity [Optional]. By default "\
+                        "all the values are searched.")
     # Tool Output
     output = parser.add_argument_group(title='Output paths', 
                         description='Output paths for the tools.')
@@ -82,6 +91,12 @@ def getOptions(myOpts = None):
 
     args = parser.parse_args()
 
+    # Validate number of jobs and patience
+    if args.jobs < 1:
+        parser.error('jobs must be a number greater than 0')
+    if args.patience is not None and args.patience < 1:
+        parser.error('patience must be a number greater than 0')
+
     # Standardize paths
     args.out    = os.path.abspath(args.out)
     args.input  = os.path.abspath(args.input)
@@ -241,7 +256,8 @@ def main(args):
     # In practice, we will look for an approximation of this global optimum.
     #exit()
     logger.info("Begin clustering")
-    clustering, sigma, m = get_clustering(C, sigmas)
+    clustering, sigma, m = get_clustering(C, sigmas, jobs=args.jobs,
+                                        patience=args.patience)
 
     # Report a summary of the results of the technical analysis.
     logger.info("After partition refinement:")
@@ -106,92 +106,125 @@ def getOptions():
 
     return(args);
  
-def matchFiles (anno1,anno2,MZCut,RTCut,reverse=False):
+def findPairs (anno1,anno2,MZCut,RTCut):
     """ 
-    Match 2 Files and returns an array with the results.
+    Find all the pairs of features between 2 files that are inside the MZ and
+    RT windows. File 2 is sorted by MZ once and the MZ window of every feature
+    in file 1 is located with a binary search, only the features inside that
+    window are compared by RT.
 
     :Arguments:
-        :type anno1: pd.DataFrame.
-        :param anno1: Dataframe with the annotation file 1.
+        :type anno1: interface.annoFormat.
+        :param anno1: annoFormat object with the annotation file 1.
 
-        :type anno2: pd.DataFrame.
-        :param anno2: Dataframe with the annotation file 2.
+        :type anno2: interface.annoFormat.
+        :param anno2: annoFormat object with the annotation file 2.
 
-        :type MZCut: int
+        :type MZCut: float
         :param MZCut: window size for mz.
 
-        :type RtCut: int
+        :type RtCut: float
         :param RtCut: window size for rt.
 
-        :type reverse: boolean.
-        :param reverse: flag to determinte wich way the match is going to be done.
+    :Returns:
+        :rtype: tuple of numpy.ndarray
+        :return: Positions of the matched features on file 1 and on file 2,
+                 sorted by file 1 and then by file 2.
+
+    """
+    logger.info(u"Matching annotation files 1 and 2")
+
+    # Getting MZ and RT values
+    mz1 = anno1.data[anno1.mz].values.astype(float)
+    rt1 = anno1.data[anno1.rt].values.astype(float)
+    mz2 = anno2.data[anno2.mz].values.astype(float)
+    rt2 = anno2.data[anno2.rt].values.astype(float)
+
+    # Sorting file 2 by MZ
+    order2 = np.argsort(mz2, kind="mergesort")
+    sortedMZ2 = mz2[order2]
+
+    # MZ window (open interval) of every feature on file 1
+    mzMin = mz1 - MZCut
+    mzMax = mz1 + MZCut
+    start = np.searchsorted(sortedMZ2, mzMin, side="right")
+    stop  = np.searchsorted(sortedMZ2, mzMax, side="left")
+    counts = np.maximum(stop - start, 0)
+
+    # Expanding the windows into candidate pairs
+    pos1 = np.repeat(np.arange(len(mz1)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pos2 = order2[np.repeat(start, counts) + offsets]
+
+    # Keeping candidates inside the RT window
+    keep = ((mzMin[pos1] < mz2[pos2]) & (mz2[pos2] < mzMax[pos1]) &
+            (rt1[pos1] - RTCut < rt2[pos2]) & (rt2[pos2] < rt1[pos1] + RTCut))
+    pos1 = pos1[keep]
+    pos2 = pos2[keep]
+
+    # Sorting pairs by file 1 and then by file 2
+    order = np.lexsort((pos2, pos1))
+
+    #Returning results
+    return pos1[order], pos2[order]
+
+def matchFiles (anno1,anno2,MZCut,RTCut):
+    """ 
+    Match 2 Files and returns the matched and unmatched tables. Both directions
+    (1 to 2 and 2 to 1) are derived from the same list of pairs.
+
+    :Arguments:
+        :type anno1: interface.annoFormat.
+        :param anno1: annoFormat object with the annotation file 1.
+
+        :type anno2: interface.annoFormat.
+        :param anno2: annoFormat object with the annotation file 2.
+
+        :type MZCut: float
+        :param MZCut: window size for mz.
+
+        :type RtCut: float
+        :param RtCut: window size for rt.
 
     :Returns:
-        :return: Returns a figure object.
-        :rtype: matplotlib.pyplot.Figure.figure
+        :rtype: tuple of pd.DataFrame
+        :return: Matched combinations, unmatched features of file 1 and 
+                 unmatched features of file 2.
 
     """
-    if reverse:
-        logger.info(u"Matching annotation file  1 to annotation file 2")
-    else:
-        logger.info(u"Matching annotation file  2 to annotation file 1")
-
-    #Creating dataframe for matched 
-    matched_df = pd.DataFrame(columns=["rowID1","MZ1","RT1","rowID2","MZ2","RT2"])
-    unmatched_df = pd.DataFrame(columns=["rowID1","MZ1","RT1","rowID2","MZ2","RT2"])
-
-    #Iterating over annotation 1 and comparing with annotation 2
-    for rowID1,MZRT1 in anno1.data.iterrows():
-
-        #Setting  flag_unmatch
-        flag_unmatch = True
-
-        #Calculating MZ and RT cuts
-        mzMin = MZRT1[anno1.mz] - MZCut
-        mzMax = MZRT1[anno1.mz] + MZCut
-        rtMin = MZRT1[anno1.rt] - RTCut
-        rtMax = MZRT1[anno1.rt] + RTCut
-
-        #Iterating over annotation 2 and comparing with anotation 1
-        for rowID2,MZRT2 in anno2.data.iterrows():
-
-                #Match found between anno1 and anno2
-                if ((mzMin<MZRT2[anno2.mz] and MZRT2[anno2.mz]<mzMax) and 
-                    (rtMin<MZRT2[anno2.rt] and MZRT2[anno2.rt]<rtMax)):
-
-                    #If reverse reverse the output 
-                    if reverse:
-                        matched_s = pd.DataFrame(data=[[rowID2,MZRT2[anno2.mz],
-                            MZRT2[anno2.rt],rowID1,MZRT1[anno1.mz],MZRT1[anno1.rt]]],
-                            columns=["rowID1","MZ1","RT1","rowID2","MZ2","RT2"])
-
-                    #Creting dataframe to apend latter
-                    else:
-                        matched_s = pd.DataFrame(data=[[rowID1,MZRT1[anno1.mz],
-                            MZRT1[anno1.rt],rowID2,MZRT2[anno2.mz],MZRT2[anno2.rt]]],
-                            columns=["rowID1","MZ1","RT1","rowID2","MZ2","RT2"])
-
-                    matched_df = matched_df.append(matched_s)
-                    flag_unmatch = False
-
-        #Exclusively found on anno1
-        if flag_unmatch:
-
-            #if reverse reverse output
-            if reverse:
-                unmatched_s = pd.DataFrame(data=[["","","",rowID1,MZRT1[anno1.mz],
-                    MZRT1[anno1.rt]]], columns=["rowID1","MZ1","RT1",
-                    "rowID2","MZ2","RT2"])
-
-            #Create dataframe to append to unmateched dataframe
-            else:
-                unmatched_s = pd.DataFrame(data=[[rowID1,MZRT1[anno1.mz],
-                    MZRT1[anno1.rt],"","",""]], columns=["rowID1","MZ1","RT1",
-                    "rowID2","MZ2","RT2"])
-            unmatched_df = unmatched_df.append(unmatched_s)
+    # Columns for all the output tables
+    columns = ["rowID1","MZ1","RT1","rowID2","MZ2","RT2"]
+
+    # Finding all the pairs in one pass
+    pos1,pos2 = findPairs(anno1=anno1,anno2=anno2,MZCut=MZCut,RTCut=RTCut)
+
+    # Creating matched dataframe
+    matched_df = pd.DataFrame({"rowID1":anno1.data.index.values[pos1],
+                               "MZ1":anno1.data[anno1.mz].values[pos1],
+                               "RT1":anno1.data[anno1.rt].values[pos1],
+                               "rowID2":anno2.data.index.values[pos2],
+                               "MZ2":anno2.data[anno2.mz].values[pos2],
+                               "RT2":anno2.data[anno2.rt].values[pos2]},
+                               columns=columns)
+
+    # Exclusively found on anno1
+    unmatched1 = ~np.in1d(np.arange(len(anno1.data)), pos1)
+    unmatched1_df = pd.DataFrame({"rowID1":anno1.data.index.values[unmatched1],
+                                  "MZ1":anno1.data[anno1.mz].values[unmatched1],
+                                  "RT1":anno1.data[anno1.rt].values[unmatched1],
+                                  "rowID2":"","MZ2":"","RT2":""},
+                                  columns=columns)
+
+    # Exclusively found on anno2
+    unmatched2 = ~np.in1d(np.arange(len(anno2.data)), pos2)
+    unmatched2_df = pd.DataFrame({"rowID1":"","MZ1":"","RT1":"",
+                                  "rowID2":anno2.data.index.values[unmatched2],
+                                  "MZ2":anno2.data[anno2.mz].values[unmatched2],
+                                  "RT2":anno2.data[anno2.rt].values[unmatched2]},
+                                  columns=columns)
 
     #Returning results
-    return matched_df,unmatched_df
+    return matched_df,unmatched1_df,unmatched2_df
 
 def getSummary (match,umatch1,umatch2):
     """ 
@@ -315,14 +348,9 @@ def main(args):
     anno2 = interface.annoFormat(data=args.anno2, uniqID=args.uniqID2, 
                                 mz=args.mzID2, rt=args.rtID2)
 
-    #Matching files anno1 vs anno2
-    match12_df,umatch12_df = matchFiles(anno1=anno1,anno2=anno2,
+    #Matching files anno1 vs anno2 (both directions at once)
+    match_df,umatch12_df,umatch21_df = matchFiles(anno1=anno1,anno2=anno2,
             MZCut=float(args.mzcut), RTCut=float(args.rtcut))
-    match21_df,umatch21_df = matchFiles(anno1=anno2,anno2=anno1,
-            MZCut=float(args.mzcut), RTCut=float(args.rtcut), reverse = True)
-
-    #concatenate match result
-    match_df  = pd.concat([match12_df,match21_df],axis=0)
 
     #Remove duplicates from match
     match_df.drop_duplicates(inplace=True)
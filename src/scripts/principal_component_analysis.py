@@ -19,7 +19,6 @@ from __future__ import division
 
 # Import built-in libraries
 import os
-import math
 import logging
 import argparse
 from itertools import combinations
@@ -81,6 +80,23 @@ def getOptions(myopts=None):
     output.add_argument("-f","--figure",dest="figure",action="store",
                         required=True, help="Name of output file to store"\
                         "scatter plots for 3 principal components.")
+    # Tool Input
+    tool = parser.add_argument_group(title='Optional input')
+    tool.add_argument("-n","--n_components",dest="n_components",action='store',
+                        type=int, required=False, default=None, help="Number "\
+                        "of principal components to compute, at least 3. All the"\
+                        " components are computed if not given, except for the "\
+                        "randomized and arpack solvers that compute 3.")
+    tool.add_argument("-sv","--solver",dest="solver",action='store',
+                        required=False, default="auto", choices=["auto", "full",
+                        "randomized", "arpack"], help="SVD solver. 'randomized' "\
+                        "and 'arpack' (Lanczos) only compute the leading "\
+                        "components, use them for large datasets [default=auto].")
+    tool.add_argument("-cs","--chunksize",dest="chunksize",action='store',
+                        type=int, required=False, default=None, help="Run an "\
+                        "out-of-core PCA reading the wide file in chunks of this "\
+                        "many features, for datasets that do not fit in memory. "\
+                        "The solver is not used [Optional].")
     # Plot options
     plot = parser.add_argument_group(title='Plot options')
     plot.add_argument("-pal","--palette",dest="palette",action='store',required=False, 
@@ -90,6 +106,14 @@ def getOptions(myopts=None):
                         " on the selected palette")
     args = parser.parse_args()
 
+    # Validate number of components
+    if args.n_components is not None and args.n_components < 3:
+        parser.error('n_components must be a number greater or equal to 3')
+    if args.chunksize is not None and args.chunksize < 1:
+        parser.error('chunksize must be a number greater than 0')
+    if args.n_components is None and args.solver in ["randomized", "arpack"]:
+        args.n_components = 3
+
     # Standardized output paths
     args.figure      = os.path.abspath(args.figure) 
     args.load_out    = os.path.abspath(args.load_out)
@@ -102,7 +126,7 @@ def getOptions(myopts=None):
 
     return(args)
 
-def runPCA(wide):
+def runPCA(wide, nComponents=None, solver="auto"):
     """
     Runs PCA over a wide formated dataset
 
@@ -110,6 +134,12 @@ def runPCA(wide):
         :type wide: pandas.core.frame.DataFrame
         :param wide: DataFrame with the wide file data
 
+        :type nComponents: int
+        :param nComponents: Number of components to compute, all if None.
+
+        :type solver: str
+        :param solver: SVD solver used by sklearn PCA.
+
     :Returns:
         :rtype loadings: numpy.ndarray
         :return loadings: Loads of the PCA
@@ -123,15 +153,9 @@ def runPCA(wide):
                         proportion of the variance explained.
     """
     logger.info(u"Runing PCA on data")
-    
-    # Scalling data
-    wide_s = wide.copy()
-    wide_s["var"] = wide.std(axis=1)
-    wide_s = wide_s.apply(lambda x: x/math.sqrt(x["var"]),axis=1)
-    wide_s = wide_s.drop("var", axis=1)
 
-    #Initialize PCA class with default values
-    pca = PCA()
+    #Initialize PCA class, the seed makes the randomized solver reproducible
+    pca = PCA(n_components=nComponents, svd_solver=solver, random_state=0)
 
     #Get scores of PCA (Fit PCA)
     scores = pca.fit_transform(wide)
@@ -158,6 +182,151 @@ def runPCA(wide):
 
     return df_scores, df_loadings, df_summary
 
+def runPCAChunks(dat, nComponents=None):
+    """
+    Runs an out-of-core PCA over a wide formated dataset read in chunks
+
+    The wide file is read twice. The first pass accumulates the samples x
+    samples Gram matrix of the centered data, its eigenvectors give the
+    scores. The second pass projects every chunk of features on the
+    eigenvectors to get the loadings. Features with missing values are
+    dropped. Signs follow the sklearn convention, the largest absolute value
+    of every score is positive.
+
+    :Arguments:
+        :type dat: interface.wideToDesign
+        :param dat: wideToDesign object created with a chunksize.
+
+        :type nComponents: int
+        :param nComponents: Number of components to compute, if None all the
+                    components with variance (number of samples - 1).
+
+    :Returns:
+        :rtype loadings: numpy.ndarray
+        :return loadings: Loads of the PCA
+
+        :rtype scores: numpy.ndarray
+        :return scores: Scores of the PCA
+
+        :rtype block: pandas.core.frame.DataFrame
+        :return block: Useful information derived by the PCA STD, Proportion of 
+                        the variance explained by this variable and acumulative
+                        proportion of the variance explained.
+    """
+    logger.info(u"Runing out-of-core PCA on data")
+
+    # First pass, Gram matrix of the centered samples
+    nSamples = len(dat.wide.columns)
+    gram = np.zeros((nSamples, nSamples))
+    nFeatures = 0
+    nDropped = 0
+    for chunk in dat.iterChunks():
+        values = chunk.dropna().values.astype(float)
+        nDropped += len(chunk.index) - len(values)
+        nFeatures += len(values)
+        values = values - values.mean(axis=1)[:, np.newaxis]
+        gram += np.dot(values.T, values)
+    if nDropped:
+        logger.warn(u"Missing values were found on wide data [{0}] rows were "\
+                    "dropped.".format(nDropped))
+
+    # Eigenvalues in decreasing order
+    eigenvalues, vectors = np.linalg.eigh(gram)
+    eigenvalues = eigenvalues[::-1]
+    vectors = vectors[:, ::-1]
+    if nComponents is None:
+        nComponents = min(nSamples - 1, nFeatures)
+    elif nComponents > min(nSamples, nFeatures):
+        logger.warn(u"Only [{0}] components can be computed from [{1}] samples "\
+                    "and [{2}] features, the number of components was reduced."\
+                    .format(min(nSamples, nFeatures), nSamples, nFeatures))
+        nComponents = min(nSamples, nFeatures)
+    vectors = vectors[:, :nComponents]
+    singular = np.sqrt(np.maximum(eigenvalues[:nComponents], 0))
+
+    # Components without variance (rank-deficient data) get zero loadings
+    # instead of dividing by a zero singular value
+    tolerance = np.sqrt(max(eigenvalues[0], 0) * nSamples * np.finfo(float).eps)
+    nonZero = singular > tolerance
+    if not nonZero.all():
+        logger.warn(u"[{0}] components have no variance, their loadings are set "\
+                    "to 0.".format((~nonZero).sum()))
+    inverse = np.zeros(nComponents)
+    inverse[nonZero] = 1 / singular[nonZero]
+
+    # Flip signs so the largest absolute value of every score is positive
+    signs = np.sign(vectors[np.abs(vectors).argmax(axis=0), range(nComponents)])
+    vectors = vectors * signs
+
+    # Get scores
+    scores = vectors * singular
+
+    # Second pass, loadings of every chunk of features
+    loadings = list()
+    for chunk in dat.iterChunks():
+        chunk = chunk.dropna()
+        values = chunk.values.astype(float)
+        values = values - values.mean(axis=1)[:, np.newaxis]
+        loadings.append(pd.DataFrame(np.dot(values, vectors * inverse),
+                        index=chunk.index))
+    loadings = pd.concat(loadings).T
+
+    #Get aditional information out of PCA (summary)
+    sd     = scores.std(axis=0)
+    var    = eigenvalues[:nComponents] / eigenvalues.sum()
+    cumVar = var.cumsum()
+
+    # Create summay file
+    summary = np.array([sd,var,cumVar]).T
+
+    # Create headers 
+    header = ["PC{0}".format(x+1) for x in range(summary.shape[0])]
+
+    # Convert loadings, scores and summaries to Pandas DataFrame rename index
+    df_scores   = pd.DataFrame(data=scores, index=dat.wide.columns, columns=header)
+    df_loadings = pd.DataFrame(data=loadings.values, index=header,
+                                columns=loadings.columns)
+    df_summary  = pd.DataFrame(data=summary, index=header, columns=["standard_deviation",
+                "proportion_of_variance_explained","cumulative_proportion_of_variance_explained"])
+
+    return df_scores, df_loadings, df_summary
+
+def checkAccuracy(wide, df_summary, tol=1e-3):
+    """
+    Compares the proportion of variance explained by a truncated PCA against
+    the exact one, obtained from the eigenvalues of the samples x samples
+    Gram matrix of the centered data.
+
+    :Arguments:
+        :type wide: pandas.core.frame.DataFrame
+        :param wide: DataFrame with the wide file data
+
+        :type df_summary: pandas.core.frame.DataFrame
+        :param df_summary: Summary from runPCA.
+
+        :type tol: float
+        :param tol: Largest difference allowed before warning.
+
+    :Returns:
+        :rtype: float
+        :return: Largest absolute difference on the proportion of variance
+                explained.
+    """
+    # Exact variances of the components in decreasing order
+    centered = wide.values - wide.values.mean(axis=0)
+    eigenvalues = np.linalg.eigvalsh(np.dot(centered, centered.T))[::-1]
+    exact = eigenvalues[:len(df_summary.index)] / eigenvalues.sum()
+
+    # Compare with the truncated solver
+    error = np.abs(df_summary["proportion_of_variance_explained"].values - exact).max()
+    if error > tol:
+        logger.warning(u"Proportion of variance explained differs from the "\
+                    "exact solver by {0:.2e}".format(error))
+    else:
+        logger.info(u"Proportion of variance explained matches the exact "\
+                    "solver (max difference {0:.2e})".format(error))
+    return error
+
 def plotScatterplot2D(data, palette, pdf, nloads=3):
     """
     Plots Scatterplots 2D for a number of loadngs for PCA.
@@ -242,19 +411,29 @@ def main(args):
 
     #Loading data trought Interface
     dat = wideToDesign(args.input, args.design, args.uniqID, group=args.group, 
-                        anno=args.levels, logger=logger)
-
-    # Cleaning from missing data
-    dat.dropMissing()
+                        anno=args.levels, logger=logger, chunksize=args.chunksize)
 
     # Get colors for each sample based on the group
     palette.getColors(design=dat.design, groups=levels)
 
-    # Transpossing matrix
-    dat.wide = dat.wide.T
+    if args.chunksize:
+        # Run out-of-core PCA
+        df_scores, df_loadings, df_summary = runPCAChunks(dat,
+                                nComponents=args.n_components)
+    else:
+        # Cleaning from missing data
+        dat.dropMissing()
+
+        # Transpossing matrix
+        dat.wide = dat.wide.T
+
+        # RunPCA
+        df_scores, df_loadings, df_summary = runPCA(dat.wide,
+                                nComponents=args.n_components, solver=args.solver)
 
-    # RunPCA
-    df_scores, df_loadings, df_summary = runPCA(dat.wide)
+        # Check the accuracy of the truncated solvers
+        if args.solver in ["randomized", "arpack"]:
+            checkAccuracy(dat.wide, df_summary)
 
     #Plotting scatter plot 3D
     logger.info(u"Plotting PCA scores")
@@ -34,6 +34,7 @@ from matplotlib.backends.backend_pdf import PdfPages
 # Import local data libraries
 from secimtools.dataManager import logger as sl
 from secimtools.dataManager.flags import Flags
+from secimtools.dataManager.rowStats import roundHalfAway, summarizeRows
 from secimtools.dataManager.interface import wideToDesign
 
 # Import local plotting libraries
@@ -129,33 +130,20 @@ def getOptions(myopts=None):
 
     return(args)
 
-def ifZero(x):
-    if x == 0:
-        value=np.nan
-    else:
-        value=x
-    return value
-
 def runStats(args, wide, dat):
     logger.info("Running RT Flag")
-    # Round retention time to 2 decimals
-    RTround=wide.applymap(lambda x: ifZero(x))
-    RTround=RTround.applymap(lambda x: round(x, 2))
+    # Zeros are missing retention times, round the rest to 2 decimals
+    RTround=wide.values.astype(float)
+    RTround[RTround == 0]=np.nan
+    RTround=pd.DataFrame(roundHalfAway(RTround, 2), index=wide.index,
+                        columns=wide.columns)
 
     # Get percentiles, min, max, mean, median
-    RTstat=pd.DataFrame(index=RTround.index)
-    RTstat['min']   =RTround.apply(np.min, axis=1)
-    RTstat['max']   =RTround.apply(np.max, axis=1)
-    RTstat['p95']   =RTround.apply(np.nanpercentile, q=95, axis=1)
-    RTstat['p90']   =RTround.apply(np.nanpercentile, q=90, axis=1)
-    RTstat['p10']   =RTround.apply(np.nanpercentile, q=10, axis=1)
-    RTstat['p05']   =RTround.apply(np.nanpercentile, q= 5, axis=1)
-    RTstat['std']   =RTround.apply(np.std, axis=1, ddof=1)
-    RTstat['mean']  =RTround.apply(np.mean, axis=1)
-    RTstat['median']=RTround.apply(np.median, axis=1)
-    RTstat['cv']    =RTstat['std'] / RTstat['mean']
+    RTstat=summarizeRows(RTround, percentiles=(95, 90, 10, 5, 50), ddof=1)
     RTstat['p95p05']=RTstat['p95'] - RTstat['p05']
     RTstat['p90p10']=RTstat['p90'] - RTstat['p10']
+    RTstat=RTstat[['min','max','p95','p90','p10','p05','std','mean','median',
+                    'cv','p95p05','p90p10']]
 
     # Return RTstat
     return (RTstat)
@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+################################################################################
+# DATE: 2026/10/18
+#
+# SCRIPT: run_order_drift_correction.py
+#
+# VERSION: 1.0
+#
+# DESCRIPTION: This script corrects the run order drift of every feature using
+#              the quality control (QC) injections. A smoother (LOESS or a
+#              smoothing spline) is fitted on the QC injections of every batch
+#              and the values are corrected by the fitted trend.
+#
+################################################################################
+# Import built-in libraries
+from __future__ import division
+import os
+import logging
+import argparse
+from multiprocessing import Pool
+from argparse import RawDescriptionHelpFormatter
+
+# Import add-on libraries
+import matplotlib
+import numpy as np
+import pandas as pd
+matplotlib.use("Agg")
+from matplotlib.backends.backend_pdf import PdfPages
+
+# Import local libraries
+from secimtools.dataManager import logger as sl
+from secimtools.dataManager.rowStats import summarizeRows
+from secimtools.dataManager.interface import wideToDesign
+
+# Import local plotting libraries
+from secimtools.visualManager import module_distribution as dist
+from secimtools.visualManager.manager_color import colorHandler
+from secimtools.visualManager.manager_figure import figureHandler
+
+def getOptions():
+    """ Function to pull in arguments """
+    description = """ Run order drift correction using QC injections. """
+    parser = argparse.ArgumentParser(description=description,
+                                    formatter_class=RawDescriptionHelpFormatter)
+    # Standard Input
+    standard = parser.add_argument_group(title="Standard input",
+                        description="Standard input for SECIM tools.")
+    standard.add_argument("-i","--input", dest="input", action="store",
+                        required=True, help="Input dataset in wide format.")
+    standard.add_argument("-d","--design", dest="design", action="store",
+                        required=True, help="Design file.")
+    standard.add_argument("-id","--ID", dest="uniqID", action="store", required=True,
+                        help="Name of the column with unique identifiers.")
+    standard.add_argument("-g","--group", dest="group", action="store", required=True,
+                        help="Name of the column on design file that identifies "\
+                        "the QC injections.")
+    standard.add_argument("-qc","--qcLevel", dest="qcLevel", action="store",
+                        required=True, help="Value of the group column for the "\
+                        "QC injections.")
+    standard.add_argument("-o","--order", dest="order", action="store", required=True,
+                        help="Name of the column on design file that contains "\
+                        "run order")
+    standard.add_argument("-b","--batch", dest="batch", action="store",
+                        required=False, default=False, help="Name of the column "\
+                        "on design file that contains the batches, the drift is "\
+                        "corrected separately on every batch [Optional].")
+    # Tool Input
+    tool = parser.add_argument_group(title="Tool input")
+    tool.add_argument("-m","--method", dest="method", action="store",
+                        default="loess", choices=["loess", "spline"],
+                        required=False, help="Smoother fitted on the QC "\
+                        "injections [default=loess].")
+    tool.add_argument("-s","--span", dest="span", action="store", type=float,
+                        default=0.75, required=False, help="Proportion of the QC "\
+                        "injections used on every local regression of the LOESS "\
+                        "[default=0.75].")
+    tool.add_argument("-sm","--smoothing", dest="smoothing", action="store",
+                        type=float, default=1.0, required=False, help="Penalty "\
+                        "of the smoothing spline, larger values give smoother "\
+                        "trends [default=1.0].")
+    tool.add_argument("-sg","--segments", dest="segments", action="store",
+                        type=int, default=10, required=False, help="Number of "\
+                        "segments of the smoothing spline [default=10].")
+    tool.add_argument("-c","--correction", dest="correction", action="store",
+                        default="multiplicative", choices=["multiplicative",
+                        "additive"], required=False, help="Values are divided "\
+                        "by the trend (multiplicative) or the trend is "\
+                        "subtracted (additive, for log transformed data), then "\
+                        "they are rescaled to the median of the QC injections "\
+                        "[default=multiplicative].")
+    tool.add_argument("-j","--jobs", dest="jobs", action="store", type=int,
+                        default=1, required=False, help="Number of processes "\
+                        "used to correct the batches in parallel [default=1].")
+    # Tool Output
+    output = parser.add_argument_group(title="Required Output")
+    output.add_argument("-oc","--corrected", dest="corrected", action="store",
+                        required=True, help="Name of the output wide dataset "\
+                        "with the corrected values.")
+    output.add_argument("-f","--figure", dest="figure", action="store",
+                        required=True, help="Name of PDF to save the "\
+                        "distribution of the CV of the QC injections.")
+    # Plot Options
+    plot = parser.add_argument_group(title='Plot options')
+    plot.add_argument("-pal","--palette",dest="palette",action='store',
+                    required=False, default="tableau", help="Name of the "\
+                    "palette to use.")
+    plot.add_argument("-col","--color",dest="color",action="store",
+                    required=False, default="Tableau_20", help="Name of a valid"\
+                    " color scheme on the selected palette")
+    args = parser.parse_args()
+
+    # Validate smoother parameters
+    if args.span <= 0:
+        parser.error("span must be a number greater than 0")
+    if args.smoothing < 0:
+        parser.error("smoothing must be a positive number")
+    if args.segments < 1:
+        parser.error("segments must be a number greater than 0")
+    if args.jobs < 1:
+        parser.error("jobs must be a number greater than 0")
+
+    # Standardize paths
+    args.input     = os.path.abspath(args.input)
+    args.design    = os.path.abspath(args.design)
+    args.figure    = os.path.abspath(args.figure)
+    args.corrected = os.path.abspath(args.corrected)
+
+    return (args)
+
+def loessSmoother(x, targets, span=0.75):
+    """
+    Smoother matrix of a local linear regression (LOESS) with tricube weights.
+
+    The LOESS fit is linear on the values, so the trend of any number of
+    features measured at x is the product of this matrix and their values.
+
+    :Arguments:
+        :type x: numpy.array
+        :param x: Run order of the QC injections.
+
+        :type targets: numpy.array
+        :param targets: Run order where the trend is evaluated.
+
+        :type span: float
+        :param span: Proportion of the QC injections used on every local
+                    regression.
+
+    :Returns:
+        :rtype smoother: numpy.array
+        :return smoother: Matrix (targets x QC injections) of the fit.
+    """
+    # Size of the neighbourhood of every target, floor of span * n as in
+    # lowess of statsmodels and loess of R
+    nNeighbours = min(len(x), max(2, int(np.floor(span * len(x) + 1e-10))))
+    dx = x[np.newaxis, :] - targets[:, np.newaxis]
+    distance = np.abs(dx)
+    radius = np.sort(distance, axis=1)[:, nNeighbours - 1]
+    if span > 1:
+        radius = radius * span
+    radius = np.maximum(radius, np.finfo(float).tiny)
+
+    # Tricube weights
+    scaled = distance / radius[:, np.newaxis]
+    weights = np.where(scaled < 1, (1 - scaled ** 3) ** 3, 0)
+
+    # Weighted least squares of a line centered on every target
+    s0 = weights.sum(axis=1)[:, np.newaxis]
+    s1 = (weights * dx).sum(axis=1)[:, np.newaxis]
+    s2 = (weights * dx ** 2).sum(axis=1)[:, np.newaxis]
+    det = s0 * s2 - s1 ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        smoother = weights * (s2 - dx * s1) / det
+
+    # Weighted mean if a line can not be fitted
+    degenerate = (det <= 1e-12 * s0 * s2).ravel()
+    smoother[degenerate] = (weights / s0)[degenerate]
+    return smoother
+
+def bsplineBasis(x, lower, upper, segments, degree=3):
+    """
+    Basis of B-splines with equally spaced knots.
+
+    :Arguments:
+        :type x: numpy.array
+        :param x: Points where the basis is evaluated.
+
+        :type lower: float
+        :param lower: Lower limit of the basis.
+
+        :type upper: float
+        :param upper: Upper limit of the basis.
+
+        :type segments: int
+        :param segments: Number of segments between lower and upper.
+
+        :type degree: int
+        :param degree: Degree of the B-splines.
+
+    :Returns:
+        :rtype basis: numpy.array
+        :return basis: Matrix (points x segments + degree) of B-splines.
+    """
+    step = (upper - lower) / segments
+    knots = lower + step * np.arange(-degree, segments + degree + 1)
+
+    # Degree 0, points on the upper limit belong to the last segment
+    x = x[:, np.newaxis]
+    basis = ((x >= knots[:-1]) & (x < knots[1:])).astype(float)
+    last = x.ravel() >= upper
+    basis[last] = 0
+    basis[last, degree + segments - 1] = 1
+
+    # Cox-de Boor recursion
+    for d in range(1, degree + 1):
+        left = (x - knots[:-(d + 1)]) / (knots[d:-1] - knots[:-(d + 1)])
+        right = (knots[d + 1:] - x) / (knots[d + 1:] - knots[1:-d])
+        basis = left * basis[:, :-1] + right * basis[:, 1:]
+    return basis
+
+def splineSmoother(x, targets, smoothing=1.0, segments=10):
+    """
+    Smoother matrix of a penalized cubic smoothing spline (P-spline).
+
+    Cubic B-splines with equally spaced knots over the run order of the batch
+    are fitted to the QC injections with a penalty on the second differences
+    of their coefficients. The fit is linear on the values, so the trend of
+    any number of features is the product of this matrix and their values.
+
+    :Arguments:
+        :type x: numpy.array
+        :param x: Run order of the QC injections.
+
+        :type targets: numpy.array
+        :param targets: Run order where the trend is evaluated.
+
+        :type smoothing: float
+        :param smoothing: Penalty of the second differences.
+
+        :type segments: int
+        :param segments: Number of segments between the first and last
+                        injection.
+
+    :Returns:
+        :rtype smoother: numpy.array
+        :return smoother: Matrix (targets x QC injections) of the fit.
+    """
+    lower = min(x.min(), targets.min())
+    upper = max(x.max(), targets.max())
+    basisQC = bsplineBasis(x, lower, upper, segments)
+    basisTargets = bsplineBasis(targets, lower, upper, segments)
+
+    # Penalty on the second differences of the coefficients
+    differences = np.diff(np.eye(basisQC.shape[1]), n=2, axis=0)
+    penalty = smoothing * np.dot(differences.T, differences)
+
+    # Coefficients are a linear function of the values of the QC injections
+    coefficients = np.linalg.solve(np.dot(basisQC.T, basisQC) + penalty,
+                                   basisQC.T)
+    return np.dot(basisTargets, coefficients)
+
+def correctBatch(task):
+    """
+    Correct the drift of all the features of a batch.
+
+    Features without missing QC values share a single smoother matrix, features
+    with missing QC values are grouped by the QC injections they have so every
+    group also shares a smoother matrix.
+
+    :Arguments:
+        :type task: tuple
+        :param task: Run order of the QC injections, run order of all the
+                    injections, values of the QC injections (features x QC),
+                    values of all the injections (features x injections),
+                    median of the QC injections of every feature, method,
+                    method parameters (span, smoothing, segments) and
+                    correction.
+
+    :Returns:
+        :rtype corrected: numpy.array
+        :return corrected: Corrected values (features x injections).
+    """
+    xQC, xAll, valuesQC, values, medianQC, method, params, correction = task
+    span, smoothing, segments = params
+
+    # Group features by the QC injections they have
+    observed = ~np.isnan(valuesQC)
+    patterns = dict()
+    for row, pattern in enumerate(observed):
+        patterns.setdefault(pattern.tobytes(), list()).append(row)
+
+    # Fit the trend of every group of features at once
+    trend = np.full(values.shape, np.nan)
+    for rows in patterns.values():
+        keep = observed[rows[0]]
+        if keep.sum() < 3:
+            continue
+        if method == "loess":
+            smoother = loessSmoother(xQC[keep], xAll, span=span)
+        else:
+            smoother = splineSmoother(xQC[keep], xAll, smoothing=smoothing,
+                                      segments=segments)
+        trend[rows] = np.dot(valuesQC[rows][:, keep], smoother.T)
+
+    # Remove the trend and rescale to the median of the QC injections
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if correction == "multiplicative":
+            trend[trend <= 0] = np.nan
+            corrected = values / trend * medianQC[:, np.newaxis]
+        else:
+            corrected = values - trend + medianQC[:, np.newaxis]
+    return corrected
+
+def runBatches(tasks, jobs=1):
+    """
+    Correct a list of batches, in parallel if more than one job is given.
+    Results are returned in the same order as tasks.
+
+    :Arguments:
+        :type tasks: list
+        :param tasks: List of tasks for correctBatch.
+
+        :type jobs: int
+        :param jobs: Number of processes to use.
+
+    :Returns:
+        :rtype: list
+        :return: Corrected values of every batch.
+    """
+    if jobs > 1 and len(tasks) > 1:
+        pool = Pool(processes=min(jobs, len(tasks)))
+        try:
+            results = pool.map(correctBatch, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [correctBatch(task) for task in tasks]
+    return results
+
+def plotQCDistributions(before, after, pdf):
+    """
+    Plot the distribution of the CV of the QC injections before and after the
+    correction.
+
+    :Arguments:
+        :type before: pandas.Series
+        :param before: CV of the QC injections of every feature before the
+                        correction.
+
+        :type after: pandas.Series
+        :param after: CV of the QC injections of every feature after the
+                        correction.
+
+        :type pdf: PdfPages
+        :param pdf: pdf object to store the figure.
+    """
+    # Open new figureHandler instance
+    fh = figureHandler(proj="2d", figsize=(14,8))
+
+    # Plot density plots
+    dist.plotDensityDF(data=before.dropna(), ax=fh.ax[0],
+                        colors=palette.mpl_colors[0], lb="Before correction")
+    dist.plotDensityDF(data=after.dropna(), ax=fh.ax[0],
+                        colors=palette.mpl_colors[1], lb="After correction")
+
+    # Plot legend
+    fh.makeLegendLabel(ax=fh.ax[0])
+
+    # Give format to the axis
+    fh.formatAxis(xTitle="Coefficient of Variation", yTitle="Density",
+        ylim="ignore", figTitle="Coefficient of Variation of the QC injections")
+
+    # Shrink figure
+    fh.shrink()
+
+    # Add figure to PDF
+    fh.addToPdf(pdfPages=pdf)
+
+def main(args):
+    #Parsing data with interface
+    logger.info("Loading data with the Interface")
+    if args.batch:
+        anno = [args.batch]
+    else:
+        anno = False
+    dat = wideToDesign(args.input, args.design, args.uniqID, args.group,
+                        runOrder=args.order, anno=anno, logger=logger)
+
+    # Find QC injections
+    design = dat.design
+    isQC = (design[dat.group] == args.qcLevel).values
+    if not isQC.any():
+        logger.error(u"There are no QC injections, please make sure that "\
+                    "'{0}' is a value of '{1}'.".format(args.qcLevel, dat.group))
+        raise ValueError
+
+    # Values and QC median of every feature
+    wide = dat.wide[design.index].astype(float)
+    valuesQC = wide.values[:, isQC]
+    with np.errstate(invalid="ignore"):
+        medianQC = np.nanmedian(valuesQC, axis=1)
+
+    # Split injections by batch
+    if args.batch:
+        batches = design.groupby(args.batch)
+    else:
+        batches = [("all", design)]
+
+    # Create a task for every batch
+    params = (args.span, args.smoothing, args.segments)
+    tasks = list()
+    names = list()
+    for name, batch in batches:
+        batchQC = (batch[dat.group] == args.qcLevel).values
+        if batchQC.sum() < 3:
+            logger.error(u"Batch '{0}' has less than 3 QC injections, the drift "\
+                        "can not be corrected.".format(name))
+            raise ValueError
+        xAll = batch[dat.runOrder].values.astype(float)
+        values = wide[batch.index].values
+        tasks.append((xAll[batchQC], xAll, values[:, batchQC], values,
+                      medianQC, args.method, params, args.correction))
+        names.append(batch.index)
+    logger.info(u"Correcting {0} batches with {1}".format(len(tasks), args.method))
+
+    # Correct batches
+    corrected = [pd.DataFrame(values, index=wide.index, columns=samples)
+                 for values, samples in zip(runBatches(tasks, args.jobs), names)]
+    corrected = pd.concat(corrected, axis=1)[dat.wide.columns]
+
+    # Report features that could not be corrected
+    nMissing = corrected.isnull().all(axis=1).sum()
+    if nMissing:
+        logger.warn(u"[{0}] features could not be corrected (less than 3 QC "\
+                    "injections with values or trend not positive).".format(nMissing))
+
+    # Plot CV of the QC injections
+    logger.info("Plotting Results")
+    qcSamples = design.index[isQC]
+    with PdfPages(args.figure) as pdf:
+        plotQCDistributions(before=summarizeRows(wide[qcSamples])["cv"],
+                            after=summarizeRows(corrected[qcSamples])["cv"],
+                            pdf=pdf)
+
+    # Write corrected values
+    corrected.to_csv(args.corrected, sep="\t")
+    logger.info("Script Complete!")
+
+if __name__ == "__main__":
+    # Command line options
+    args = getOptions()
+
+    # Setting up logger
+    logger = logging.getLogger()
+    sl.setLogger(logger)
+
+    # Print logger info
+    logger.info(u"""Importing data with following parameters:
+            \tWide: {0}
+            \tDesign: {1}
+            \tUnique ID: {2}
+            \tGroup: {3}
+            \tQC level: {4}
+            \tRun Order: {5}
+            \tBatch: {6}
+            \tMethod: {7}
+            """ .format(args.input, args.design, args.uniqID, args.group,
+                args.qcLevel, args.order, args.batch, args.method))
+
+    # Set color palette
+    palette = colorHandler(pal=args.palette, col=args.color)
+    logger.info(u"Using {0} color scheme from {1} palette".format(args.color,
+                args.palette))
+
+    # Runnign code
+    main(args)
@@ -25,10 +25,10 @@ import matplotlib
 import numpy as np
 import pandas as pd
 matplotlib.use("Agg")
+import scipy.stats as stats
 import matplotlib.pyplot as plt
 import statsmodels.formula.api as smf
 from matplotlib.backends.backend_pdf import PdfPages
-from statsmodels.sandbox.regression.predstd import wls_prediction_std
 
 # Import local libraries
 from secimtools.dataManager import logger as sl
@@ -71,6 +71,15 @@ def getOptions():
                         required=True, help="Name of table for scatter plots")
     output.add_argument("-fl","--flags", dest="flags", action="store", 
                         required=True, help="Name of table flags")
+    # Tool Options
+    tool = parser.add_argument_group(title="Tool options")
+    tool.add_argument("-e","--engine", dest="engine", action="store",
+                        default="analytic", choices=["analytic", "statsmodels"],
+                        required=False, help="Engine used for the regressions. "\
+                        "'analytic' fits all the features at once in closed "\
+                        "form, 'statsmodels' fits a statsmodels OLS model for "\
+                        "every feature and is kept as a fallback "\
+                        "[default=analytic].")
     # Dev Options
     dev = parser.add_argument_group(title="Development Settings")
     dev.add_argument("-dg","--debug", dest="debug", action="store_true", 
@@ -98,19 +107,136 @@ def getOptions():
 
     return (args)
 
-def runRegression(data):
+def fitRunOrder(x, values):
+    """
+    Fit a simple linear regression (value ~ run) for many features sharing the
+    same run order, in closed form.
+
+    Features without missing values share the centered run order so all of
+    them are fitted with a few matrix products. Features with missing values
+    are fitted with masked sums, each one using only its observed values.
+
+    :Arguments:
+        :type x: numpy.array
+        :param x: Run order (n).
+
+        :type values: numpy.array
+        :param values: Values of the features (n x features), can have
+                        missing values.
+
+    :Returns:
+        :rtype: tuple of numpy.array
+        :return: slope, intercept, p-value of the slope and R^2 of every
+                feature. Constant features get a p-value of 1 and R^2 of 0.
+    """
+    mask = ~np.isnan(values)
+    complete = mask.all(axis=0)
+    slope = np.empty(values.shape[1])
+    intercept = np.empty(values.shape[1])
+    ssr = np.empty(values.shape[1])
+    sst = np.empty(values.shape[1])
+    sxx = np.empty(values.shape[1])
+    nobs = mask.sum(axis=0).astype(float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Features without missing values share the same run order
+        if complete.any():
+            y = values[:, complete]
+            xc = x - x.mean()
+            yc = y - y.mean(axis=0)
+            sxx[complete] = np.dot(xc, xc)
+            slope[complete] = np.dot(xc, yc) / sxx[complete]
+            intercept[complete] = y.mean(axis=0) - slope[complete] * x.mean()
+            resid = yc - np.outer(xc, slope[complete])
+            ssr[complete] = (resid ** 2).sum(axis=0)
+            sst[complete] = (yc ** 2).sum(axis=0)
+
+        # Features with missing values only use their observed values
+        if (~complete).any():
+            w = mask[:, ~complete]
+            y = np.where(w, values[:, ~complete], 0)
+            n = nobs[~complete]
+            xbar = np.dot(x, w) / n
+            ybar = y.sum(axis=0) / n
+            xc = np.where(w, x[:, np.newaxis] - xbar, 0)
+            yc = np.where(w, y - ybar, 0)
+            sxx[~complete] = (xc ** 2).sum(axis=0)
+            slope[~complete] = (xc * yc).sum(axis=0) / sxx[~complete]
+            intercept[~complete] = ybar - slope[~complete] * xbar
+            resid = yc - xc * slope[~complete]
+            ssr[~complete] = (resid ** 2).sum(axis=0)
+            sst[~complete] = (yc ** 2).sum(axis=0)
+
+        # Two parameters, n - 2 degrees of freedom
+        dfResid = nobs - 2
+        bse = np.sqrt(ssr / dfResid / sxx)
+        pval = 2 * stats.t.sf(np.abs(slope / bse), dfResid)
+        rsq = 1 - ssr / sst
+
+    # Constant features have no trend on the run order, they are found on the
+    # observed values as the rounding of the mean can leave a tiny sst
+    constant = (np.where(mask, values, -np.inf).max(axis=0) ==
+                np.where(mask, values, np.inf).min(axis=0))
+    pval[constant] = 1
+    rsq[constant] = 0
+    pval[dfResid <= 0] = np.nan
+
+    return slope, intercept, pval, rsq
+
+def runRegression(data, engine="analytic"):
     """ 
-    Run each column through regression and then concatenate the outputed series
-    to a single dataframe.
+    Run a regression of every column on the run order and concatenate the
+    results to a single dataframe.
+
+    The default engine fits all the columns at once in closed form (see
+    fitRunOrder). The 'statsmodels' engine calls runRegressionStatsmodels
+    instead, both give the same results (constant columns get a p-value of
+    1 and R^2 of 0 on both engines).
 
     :Arguments:
         :type data: pandas.dataFrame
         :param data: A Pandas dataFrame with a transpose version of the original
                     data and runOrder as index.
 
+        :type engine: string
+        :param engine: 'analytic' or 'statsmodels'.
+
     :Returns:
         :rtype res_df: pandas.dataFrame
-        :return res_df: Results of the regression.
+        :return res_df: Results of the regression (slope, intercept, pval and
+                        rsq of every column).
+    """
+    if engine == "statsmodels":
+        return runRegressionStatsmodels(data)
+
+    # Fit all the columns
+    slope, intercept, pval, rsq = fitRunOrder(data.index.values.astype(float),
+                                              data.values.astype(float))
+    res_df = pd.DataFrame({"slope":slope, "intercept":intercept, "pval":pval,
+                           "rsq":rsq}, index=data.columns,
+                           columns=["slope", "intercept", "pval", "rsq"])
+
+    # Drop rows that are missing regression results
+    res_df.dropna(inplace=True)
+
+    # Returning results of regressions
+    return (res_df)
+
+def runRegressionStatsmodels(data):
+    """ 
+    Run each column through a statsmodels regression and then concatenate the
+    outputed series to a single dataframe.
+
+    :Arguments:
+        :type data: pandas.dataFrame
+        :param data: A Pandas dataFrame with a transpose version of the original
+                    data and runOrder as index.
+
+    :Returns:
+        :rtype res_df: pandas.dataFrame
+        :return res_df: Results of the regression (slope, intercept, pval and
+                        rsq of every column). Constant columns get a p-value
+                        of 1 and R^2 of 0, as in fitRunOrder.
     """
 
     res = list()
@@ -123,26 +249,23 @@ def runRegression(data):
         # Fit model
         model   = smf.ols(formula="val ~ run", data=clean, missing="drop")
         results = model.fit()
-        slope   = results.params["run"]
-        pval    = results.pvalues["run"]
-        rsq     = results.rsquared
-        fitted  = results.fittedvalues
 
         #Returning
         out =  pd.Series(name=column.name,
-                data={"name":column.name,
-                "x":clean["run"], 
-                "y":clean["val"], 
-                "res":results, 
-                "slope":slope, 
-                "pval":pval,
-                "rsq":rsq,
-                "fitted":fitted})
+                data={"slope":results.params["run"], 
+                "intercept":results.params["Intercept"], 
+                "pval":results.pvalues["run"],
+                "rsq":results.rsquared})
+
+        # Constant columns have no trend on the run order
+        if len(clean) > 2 and clean["val"].max() == clean["val"].min():
+            out["pval"] = 1
+            out["rsq"] = 0
         res.append(out)
 
     # Concatenating results
     res_df = pd.concat(res,axis=1)
-    res_df = res_df.T
+    res_df = res_df.T[["slope", "intercept", "pval", "rsq"]].astype(float)
 
     # Drop rows that are missing regression results
     res_df.dropna(inplace=True)
@@ -150,45 +273,81 @@ def runRegression(data):
     # Returning results of regressions
     return (res_df)
 
-def plotSignificantROR(data, pdf, palette):
+def predictionBands(x, y, slope, intercept, alpha=0.05):
+    """
+    Fitted values and prediction bands of a simple linear regression.
+
+    :Arguments:
+        :type x: numpy.array
+        :param x: Run order.
+
+        :type y: numpy.array
+        :param y: Values of the feature.
+
+        :type slope: float
+        :param slope: Slope of the regression.
+
+        :type intercept: float
+        :param intercept: Intercept of the regression.
+
+        :type alpha: float
+        :param alpha: The bands have 1 - alpha coverage.
+
+    :Returns:
+        :rtype: tuple of numpy.array
+        :return: fitted values, lower and upper prediction bands.
+    """
+    fitted = intercept + slope * x
+    dfResid = len(x) - 2
+    scale = ((y - fitted) ** 2).sum() / dfResid
+    xc = x - x.mean()
+    prstd = np.sqrt(scale * (1 + 1.0 / len(x) + xc ** 2 / np.dot(xc, xc)))
+    tppf = stats.t.isf(alpha / 2., dfResid)
+    return fitted, fitted - tppf * prstd, fitted + tppf * prstd
+
+def plotSignificantROR(data, ror_df, pdf, palette):
     """
     Plot a scatter plot of x vs y. 
 
     :Arguments:
 
-        :type row:
-        :param row:
+        :type data: pandas.dataFrame
+        :param data: A Pandas dataFrame with a transpose version of the original
+                    data and runOrder as index.
+
+        :type ror_df: pandas.dataFrame
+        :param ror_df: Results of the regressions.
 
         :type pdf: PdfPages
         :param pdf: pdf object to store scatterplots
 
-        :type des: pandas DataFrame
-        :param des: design file
-
-        :type groupName: string
-        :param groupName: name of group
+        :type palette: colorHandler
+        :param palette: Colors of the samples
     """
-    # Iterates over all rows in the dataframe
+    # Iterates over all the significant features
     # Make scatter plot if p-pvalue is less than 0.05
-    for index,row in data.iterrows():
-        if row["pval"] > 0.05: continue
-        #plotSignificantROR(row,pdf,dat.design,args.group)
+    for name, row in ror_df[ror_df["pval"] <= 0.05].iterrows():
+        # Get values of the feature
+        column = data[name].dropna()
+        x = pd.Series(column.index.values.astype(float))
+        y = pd.Series(column.values)
 
-        # Get 95% CI
-        prstd, lower, upper = wls_prediction_std(row["res"])
+        # Get fitted values and 95% CI
+        fitted, lower, upper = predictionBands(x.values, y.values, row["slope"],
+                                                row["intercept"])
 
         # Sort CIs for Plotting
-        toPlot = pd.DataFrame({"x": row["x"], "lower": lower, "upper": upper})
+        toPlot = pd.DataFrame({"x": x, "lower": lower, "upper": upper})
         toPlot.sort_values(by="x", inplace=True)
 
         # Create plot
         fh = figureHandler(proj="2d", figsize=(14,8))
         
         #Plot scatterplot
-        scatter.scatter2D(ax=fh.ax[0],x=row["x"],  y=row["y"],colorList=palette.list_colors)
+        scatter.scatter2D(ax=fh.ax[0],x=x,  y=y,colorList=palette.list_colors)
 
         # Plot cutoffs
-        lines.drawCutoff(ax=fh.ax[0],x=row["x"],   y=row["fitted"],  c="c")
+        lines.drawCutoff(ax=fh.ax[0],x=x,          y=fitted,         c="c")
         lines.drawCutoff(ax=fh.ax[0],x=toPlot["x"],y=toPlot["lower"],c="r")
         lines.drawCutoff(ax=fh.ax[0],x=toPlot["x"],y=toPlot["upper"],c="r")
 
@@ -196,7 +355,7 @@ def plotSignificantROR(data, pdf, palette):
         ymin, ymax = fh.ax[0].get_ylim()
         fh.formatAxis(xTitle="Run Order", yTitle="Value", ylim=(ymin,ymax*1.2),
         figTitle=u"{} Scatter plot (fitted regression line and prediction bands"\
-        " included)".format(row["name"]))
+        " included)".format(name))
 
         # Shrink figure
         fh.shrink()
@@ -240,7 +399,7 @@ def main(args):
 
     # Run regressions
     logger.info("Running Regressions")
-    ror_df = runRegression(trans)
+    ror_df = runRegression(trans, engine=args.engine)
 
     # Creating flags flags for pvals 0.05 and 0.1
     ror_flags = Flags(index=ror_df.index)    
@@ -253,7 +412,7 @@ def main(args):
     # Open a multiple page PDF for plots
     logger.info("Plotting Results")
     with PdfPages(args.figure) as pdf:
-        plotSignificantROR(ror_df, pdf, palette)
+        plotSignificantROR(trans, ror_df, pdf, palette)
         
         # If not pages
         if pdf.get_pagecount() == 0:
@@ -14,8 +14,11 @@
 ################################################################################
 # Import built-in libraries
 import os
+import shutil
 import logging
 import argparse
+import tempfile
+from multiprocessing import Pool
 
 # Import add-on libraries
 import matplotlib
@@ -25,7 +28,6 @@ from numpy import alltrue
 import pandas as pd
 import scipy.stats as stats
 import matplotlib.pyplot as plt
-from sklearn.neighbors import DistanceMetric
 from matplotlib.backends.backend_pdf import PdfPages
 
 # Import local data libraries
@@ -56,7 +58,12 @@ def getOptions():
     pairwise SEDs by group.
 
     The output includes 3 plots for each group and 3 plots in the end for all
-    the samples altogether.
+    the samples altogether. Distances for the groups can be computed in
+    parallel and plots are made once all the distances are computed, if no
+    figure is given the plots are skipped.
+
+    For large numbers of samples the pairwise SEDs can be computed in blocks
+    of samples and stored in memory-mapped files on disk.
     """
 
     parser = argparse.ArgumentParser(description=description, formatter_class=
@@ -79,19 +86,37 @@ def getOptions():
     # Tool Output
     output = parser.add_argument_group(description="Output Files")
     output.add_argument("-f", "--figure", dest="figure", action='store', 
-                        required=True, help="PDF Output of standardized "\
-                        "Euclidean distance plot")
+                        required=False, default=None, help="PDF Output of "\
+                        "standardized Euclidean distance plot. If not given "\
+                        "the plots are skipped.")
     output.add_argument("-m","--SEDtoMean", dest="toMean", action='store', 
                         required=True, help="TSV Output of standardized "
                         "Euclidean distances from samples to the mean.")
     output.add_argument("-pw","--SEDpairwise", dest="pairwise", action='store', 
                         required=True, help="TSV Output of sample-pairwise "
                         "standardized Euclidean distances.")
+    output.add_argument("-su","--SEDsummary", dest="summary", action='store', 
+                        required=False, default=None, help="TSV Output of "
+                        "per sample summaries of the pairwise standardized "
+                        "Euclidean distances and the number of distances "
+                        "above each cutoff [Optional].")
     # Tool Input
     tool = parser.add_argument_group(description="Tool Input")
     tool.add_argument("-p","--per", dest="p", action='store', required=False, 
                         default=0.95, type=float, help="The threshold "
                         "for standard distributions. The default is 0.95.")
+    tool.add_argument("-j","--jobs", dest="jobs", action='store', type=int,
+                        required=False, default=1, help="Number of processes "
+                        "used to compute the groups in parallel. The default is 1.")
+    tool.add_argument("-bs","--block_size", dest="block", action='store',
+                        type=int, required=False, default=None, help="Number "
+                        "of samples per block of pairwise distances. If given "
+                        "the pairwise distances are stored on disk in "
+                        "memory-mapped files [Optional].")
+    tool.add_argument("-mm","--memmap_dir", dest="memmapDir", action='store',
+                        required=False, default=None, help="Directory for the "
+                        "memory-mapped files, the default is the system "
+                        "temporary directory [Optional].")
     # Plot Options
     plot = parser.add_argument_group(title='Plot options')
     plot.add_argument("-pal","--palette",dest="palette",action='store',required=False, 
@@ -104,7 +129,10 @@ def getOptions():
     # Standardize paths
     args.input    = os.path.abspath(args.input)
     args.design   = os.path.abspath(args.design)
-    args.figure   = os.path.abspath(args.figure)
+    if args.figure:
+        args.figure = os.path.abspath(args.figure)
+    if args.summary:
+        args.summary = os.path.abspath(args.summary)
     args.toMean   = os.path.abspath(args.toMean)
     args.pairwise = os.path.abspath(args.pairwise)
 
@@ -114,6 +142,10 @@ def getOptions():
 
     return(args)
 
+# Maximum number of rows of the pairwise SED used on the pairwise plots when
+# the matrix is stored on disk
+PLOT_ROWS = 500
+
 def plotCutoffs(cut_S,ax,p):
     """
     Plot the cutoff lines to each plot
@@ -133,7 +165,8 @@ def plotCutoffs(cut_S,ax,p):
             lb="{0} {1}% Threshold: {2}".format(cut_S.name,round(p*100,3),
             round(float(cut_S.values[0]),1)),ls="--",lw=2)
 
-def makePlots (SEDData, design, pdf, groupName, cutoff, p, plotType, ugColors, levels):
+def makePlots (SEDData, design, pdf, groupName, cutoff, p, plotType, ugColors, levels,
+                block=None):
     """
     Manage all the plots for this script
 
@@ -160,6 +193,11 @@ def makePlots (SEDData, design, pdf, groupName, cutoff, p, plotType, ugColors, l
         :param plotType: Type of plot, the possible types are scatterplot to mean
             scatterplot pairwise and boxplot pairwise.
 
+        :type block: int
+        :param block: Block size used for the pairwise SED. If given the matrix
+            is stored on disk and the pairwise plots only use up to PLOT_ROWS
+            evenly spaced rows of it, so it is never loaded into memory.
+
     """
 
     #Geting number of features in dataframe
@@ -172,7 +210,18 @@ def makePlots (SEDData, design, pdf, groupName, cutoff, p, plotType, ugColors, l
     figure = figureHandler(proj='2d', figsize=(figWidth, 8))
 
     # Keeping the order on the colors
-    SEDData["colors"]=design["colors"]
+    colors = design["colors"].reindex(SEDData.index)
+
+    # Rows of the pairwise SED used on the pairwise plots, the matrix is
+    # symmetric so every row holds the distances of one sample
+    if block and nFeatures > PLOT_ROWS:
+        rows = np.unique(np.linspace(0, nFeatures-1, PLOT_ROWS).astype(int))
+        sampled = SEDData.iloc[rows]
+        if plotType == "scatterPairwise":
+            logger.info("Using {0} of {1} samples on the pairwise plots {2}".
+                        format(len(rows), nFeatures, groupName))
+    else:
+        sampled = SEDData
 
     # Choose type of plot
     # Plot scatterplot to mean
@@ -184,7 +233,7 @@ def makePlots (SEDData, design, pdf, groupName, cutoff, p, plotType, ugColors, l
                         yTitle="Standardized Euclidean Distance")
 
         #Plot scatterplot quickplot
-        scatter.scatter2D(ax=figure.ax[0],colorList=SEDData["colors"],
+        scatter.scatter2D(ax=figure.ax[0],colorList=colors,
                         x=range(len(SEDData.index)), y=SEDData["SED_to_Mean"])
 
 
@@ -197,9 +246,9 @@ def makePlots (SEDData, design, pdf, groupName, cutoff, p, plotType, ugColors, l
                         yTitle="Standardized Euclidean Distance")
 
         # Plot scatterplot
-        for index in SEDData.index.values:
-            scatter.scatter2D(ax=figure.ax[0],colorList=design["colors"][index],
-                            x=range(len(SEDData.index)), y=SEDData[index])
+        for index in sampled.index.values:
+            scatter.scatter2D(ax=figure.ax[0],colorList=colors[index],
+                            x=range(len(SEDData.index)), y=sampled.loc[index].values)
 
     #Plot boxplot pairwise
     elif(plotType=="boxplotPairwise"):
@@ -209,7 +258,7 @@ def makePlots (SEDData, design, pdf, groupName, cutoff, p, plotType, ugColors, l
                         xticks=SEDData.index.values,xTitle="Index",
                         yTitle="Standardized Euclidean Distance")
         # Plot Box plot
-        box.boxDF(ax=figure.ax[0], colors=SEDData["colors"].values, dat=SEDData)
+        box.boxDF(ax=figure.ax[0], colors=colors.values, dat=sampled)
 
     #Add a cutoof line
     cutoff.apply(lambda x: plotCutoffs(x,ax=figure.ax[0],p=p),axis=0)
@@ -221,192 +270,351 @@ def makePlots (SEDData, design, pdf, groupName, cutoff, p, plotType, ugColors, l
     # Add figure to PDF and close the figure afterwards
     figure.addToPdf(pdf)
 
-def prepareSED(data_df, design, pdf, groupName, p, ugColors, levels):
+def groupSED(task):
     """
-    Core for processing all the data.
+    Calculate the SEDs and cutoffs for a group. This is the unit of work
+    given to the workers of the pool.
 
     :Arguments:
-        :type data_df: pandas.Series.
-        :param data_df: contains a cutoff value, name and color.
+        :type task: tuple
+        :param task: Level of the group, its wide data, the percentile of
+            the cutoff, the block size and the memory-mapped file for the
+            pairwise SED (None to keep it in memory).
 
-        :type design: matplotlib.axes._subplots.AxesSubplot.
-        :param design: Gets an ax project.
+    :Returns:
+        :rtype: tuple
+        :return: Level of the group, SED to the mean, pairwise SED, per
+            sample summaries and cutoffs for to the mean and pairwise. If a
+            memory-mapped file is used the file name is returned instead of
+            the pairwise SED.
+    """
+    level, data_df, p, block, mmapFile = task
 
-        :type pdf: PDF object.
-        :param pdf: PDF for output plots.
+    #Calculate cutOffs
+    cutoff1,cutoff2 = getCutOffs(data_df, p)
 
-        :type groupName: string.
-        :param groupName: Name of the group (figure title).
+    #Calculate SED
+    SEDtoMean, SEDpairwise, SEDsummary = getSED(data_df, cutoff=cutoff2,
+                                            block=block, mmapFile=mmapFile)
 
-        :type p: float.
-        :param p: percentile of cutoff.
+    # Send back the file name so the matrix is not copied between processes
+    if mmapFile:
+        SEDpairwise = mmapFile
 
-    :Returns:
-        :rtype pdf: PDF object.
-        :return pdf: PDF for output plots.
+    return level, SEDtoMean, SEDpairwise, SEDsummary, cutoff1, cutoff2
 
-        :rtype SEDtoMean: pd.DataFrames
-        :return SEDtoMean: SEd for Mean
-        
-        :rtype SEDpairwise: pd.DataFrames
-        :return SEDpairwise: SED for pairwise data
+def runGroups(tasks, jobs=1):
     """
-    #Calculate SED without groups
-    SEDtoMean, SEDpairwise = getSED(data_df)
+    Calculate the SEDs and cutoffs of a list of groups, in parallel if more
+    than one job is given. Results are returned in the same order as tasks.
 
-    #Calculate cutOffs
-    cutoff1,cutoff2 = getCutOffs(data_df, p)
+    :Arguments:
+        :type tasks: list
+        :param tasks: List of tasks for groupSED.
 
-    # Call function to do a scatter plot on SEDs from samples to the Mean
-    makePlots(SEDtoMean, design, pdf, groupName, cutoff1, p, "scatterToMean",
-                ugColors, levels)
+        :type jobs: int
+        :param jobs: Number of processes to use.
 
-    #Call function to do a scatter plot on SEDs for pairwise samples
-    makePlots(SEDpairwise, design, pdf, groupName, cutoff2, p, "scatterPairwise",
-                ugColors, levels)
+    :Returns:
+        :rtype: list
+        :return: List of results from groupSED.
+    """
+    if jobs > 1 and len(tasks) > 1:
+        pool = Pool(processes=min(jobs, len(tasks)))
+        try:
+            results = pool.map(groupSED, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [groupSED(task) for task in tasks]
 
-    # Call function to do a boxplot on SEDs for pairwise samples
-    makePlots(SEDpairwise, design, pdf, groupName, cutoff2, p, "boxplotPairwise",
-                ugColors, levels)
+    # Open the pairwise SED stored on disk
+    for i, (level, SEDtoMean, SEDpairwise, SEDsummary, cutoff1, cutoff2) in \
+            enumerate(results):
+        if isinstance(SEDpairwise, str):
+            SEDpairwise = pd.DataFrame(np.load(SEDpairwise, mmap_mode='r'),
+                            index=SEDtoMean.index, columns=SEDtoMean.index)
+            results[i] = (level, SEDtoMean, SEDpairwise, SEDsummary, cutoff1,
+                            cutoff2)
 
-    #Returning data
-    return pdf, SEDtoMean, SEDpairwise
+    return results
 
-def calculateSED(dat, levels, combName, pdf, p):
+def calculateSED(dat, levels, combName, p, jobs=1, block=None, mmapDir=None):
     """
-    Manage all the plots for this script
+    Calculate the SEDs for every group and for all the data
 
     :Arguments:
         :type dat: wideToDesign
         :param dat: Contains data parsed by interface
 
-        :type args: argparse.data
-        :param args: All input data
-
         :type levels: string
         :param levels: Name of the column on desing file (after get colors)
                          with the name of the column containing the combinations.
 
         :type combName: dictionary 
         :param combName: dictionary with colors and different groups
+
+        :type p: float.
+        :param p: percentile of cutoff.
+
+        :type jobs: int
+        :param jobs: Number of processes to use.
+
+        :type block: int
+        :param block: Number of samples per block of pairwise SED.
+
+        :type mmapDir: string
+        :param mmapDir: Directory for the memory-mapped pairwise SED, None to
+            keep them in memory.
+
+    :Returns:
+        :rtype SEDtoMean: pd.DataFrames
+        :return SEDtoMean: SED for Mean
+        
+        :rtype SEDpairwise: pd.DataFrames
+        :return SEDpairwise: SED for pairwise data
+
+        :rtype SEDsummary: pd.DataFrames
+        :return SEDsummary: Per sample summaries of pairwise SED
+
+        :rtype plots: list
+        :return plots: SED to the mean, pairwise SED, design, group name and
+            cutoffs for every set of plots.
     """
-    
+    plots = list()
 
     if len(levels.keys()) > 1:
-        #Creates dataframes for later use for SED results
-        SEDtoMean=pd.DataFrame(columns=['SED_to_Mean', 'group'])
-        SEDpairwise=pd.DataFrame(columns=["group"])
-
-        #Calculates pairwise and to mean distances by group(or levels)
+        #Pairwise and to mean distances by group(or levels)
+        tasks = list()
+        designs = list()
         for level, group in dat.design.groupby(combName):
-            #Subsetting wide
-            currentFrame = dat.wide[group.index]
-
             # Sending error if less than 3 groups
             if len(group.index) < 3:
                 logger.error("Group {0} has less than 3 elements".\
                     format(level))
                 exit()
 
-            #Getting SED per group
-            logger.info("Getting SED for {0}".format(level))
-            pdf, SEDtoMean_G, SEDpairwise_G = prepareSED(currentFrame, group, 
-                                                pdf, "in group "+str(level), p,
-                                                levels, combName)
-
-            #Add 'group' column to the current group
-            SEDtoMean_G['group'] = [level]*len(currentFrame.columns)
-            SEDpairwise_G['group'] = [level]*len(currentFrame.columns)
-
-            #Merges dataframes onto an All dataframe 
-            SEDtoMean = pd.DataFrame.merge(SEDtoMean,
-                                            SEDtoMean_G, 
-                                            on=['SED_to_Mean', 'group'], 
-                                            left_index=True, 
-                                            right_index=True, 
-                                            how='outer', 
-                                            sort=False)
-            SEDpairwise = pd.DataFrame.merge(SEDpairwise, 
-                                            SEDpairwise_G, 
-                                            on=["group"], 
-                                            left_index=True, 
-                                            right_index=True,
-                                            how='outer', 
-                                            sort=False)
+            #Subsetting wide
+            if mmapDir:
+                mmapFile = os.path.join(mmapDir,
+                                "SED_pairwise_{0}.npy".format(len(tasks)))
+            else:
+                mmapFile = None
+            tasks.append((level, dat.wide[group.index], p, block, mmapFile))
+            designs.append(group)
+
+        #Getting SED per group
+        logger.info("Getting SED for {0} groups".format(len(tasks)))
+        results = runGroups(tasks, jobs)
+
+        for group, (level, SEDtoMean_G, SEDpairwise_G, SEDsummary_G, cutoff1,
+                cutoff2) in zip(designs, results):
+            plots.append((SEDtoMean_G, SEDpairwise_G, group,
+                            "in group "+str(level), cutoff1, cutoff2))
+
+        #Stack groups onto an All dataframe, pairwise SED between groups is
+        #left missing
+        SEDtoMean = pd.concat([result[1] for result in results])
+        SEDsummary = pd.concat([result[3] for result in results])
+        if mmapDir:
+            SEDpairwise = stackOnDisk([result[2] for result in results],
+                            os.path.join(mmapDir, "SED_pairwise_all.npy"))
+        else:
+            SEDpairwise = pd.concat([result[2] for result in results])
+            SEDpairwise = SEDpairwise.reindex(columns=SEDpairwise.index)
 
         #Get means of all different groupss
         logger.info("Getting SED for all data")
         cutoffAllMean,cutoffAllPairwise = getCutOffs(dat.wide,p)
+        plots.append((SEDtoMean, SEDpairwise, dat.design, "", cutoffAllMean,
+                        cutoffAllPairwise))
 
-        #Sort df by group
-        SEDtoMean = SEDtoMean.sort_values(by='group')
-        SEDpairwise = SEDpairwise.sort_values(by='group')
+    else:
+        logger.info("Getting SED for all data")
+        if mmapDir:
+            mmapFile = os.path.join(mmapDir, "SED_pairwise_all.npy")
+        else:
+            mmapFile = None
+        level, SEDtoMean, SEDpairwise, SEDsummary, cutoff1, cutoff2 = \
+                runGroups([("", dat.wide, p, block, mmapFile)])[0]
+        plots.append((SEDtoMean, SEDpairwise, dat.design, "", cutoff1, cutoff2))
 
-        # Plot a scatter plot on SEDs from samples to the Mean
-        makePlots (SEDtoMean, dat.design, pdf, "", cutoffAllMean, p, 
-                    "scatterToMean", levels, combName)
+    return SEDtoMean,SEDpairwise,SEDsummary,plots
 
-        # Plot a scatter plot on SEDs for pairwise samples
-        makePlots (SEDpairwise, dat.design, pdf, "", cutoffAllPairwise, p, 
-                    "scatterPairwise", levels, combName)
+def stackOnDisk(pairwiseList, mmapFile):
+    """
+    Stack the pairwise SED of several groups into a single memory-mapped
+    matrix, pairwise SED between groups is left missing.
 
-        # Plot a boxplot on SEDs for pairwise samples
-        makePlots (SEDpairwise, dat.design, pdf, "", cutoffAllPairwise, p, 
-                    "boxplotPairwise", levels, combName)
+    :Arguments:
+        :type pairwiseList: list
+        :param pairwiseList: Pairwise SED of every group.
 
-        #If group drop "group" column
-        SEDtoMean.drop('group', axis=1, inplace=True)
-        SEDpairwise.drop('group', axis=1, inplace=True)
+        :type mmapFile: string
+        :param mmapFile: Name of the memory-mapped file.
 
-    else:
-        logger.info("Getting SED for all data")
-        pdf,SEDtoMean,SEDpairwise = prepareSED(dat.wide, dat.design, pdf,'', p,
-                                        levels, combName)
+    :Returns:
+        :rtype SEDpairwise: pd.DataFrames
+        :return SEDpairwise: SED for pairwise data
+    """
+    index = pd.Index(np.concatenate([pairwise.index.values
+                                    for pairwise in pairwiseList]))
+    stacked = np.lib.format.open_memmap(mmapFile, mode='w+', dtype=float,
+                                    shape=(len(index), len(index)))
+
+    # Copy every group block, one row at a time for the missing values
+    start = 0
+    for pairwise in pairwiseList:
+        stop = start + len(pairwise.index)
+        for row in range(start, stop):
+            stacked[row, :] = np.nan
+            stacked[row, start:stop] = pairwise.values[row-start]
+        start = stop
+    stacked.flush()
+
+    return pd.DataFrame(stacked, index=index, columns=index)
+
+def plotSED(plots, pdf, p, ugColors, combName, block=None):
+    """
+    Make the plots for every set of SEDs
+
+    :Arguments:
+        :type plots: list
+        :param plots: Sets of plots from calculateSED.
+
+        :type pdf: PDF object.
+        :param pdf: PDF for output plots.
+
+        :type p: float.
+        :param p: percentile of cutoff.
 
-    return SEDtoMean,SEDpairwise
+        :type ugColors: dictionary 
+        :param ugColors: dictionary with colors and different groups
 
-def getSED(wide):
+        :type combName: string
+        :param combName: Name of the column on desing file (after get colors)
+                         with the name of the column containing the combinations.
+
+        :type block: int
+        :param block: Block size used for the pairwise SED, see makePlots.
+    """
+    #Create Palette
+    cutPalette.getColors(plots[0][4].T,["name"])
+
+    for SEDtoMean, SEDpairwise, design, groupName, cutoff1, cutoff2 in plots:
+        # Call function to do a scatter plot on SEDs from samples to the Mean
+        makePlots(SEDtoMean, design, pdf, groupName, cutoff1, p,
+                    "scatterToMean", ugColors, combName)
+
+        #Call function to do a scatter plot on SEDs for pairwise samples
+        makePlots(SEDpairwise, design, pdf, groupName, cutoff2, p,
+                    "scatterPairwise", ugColors, combName, block=block)
+
+        # Call function to do a boxplot on SEDs for pairwise samples
+        makePlots(SEDpairwise, design, pdf, groupName, cutoff2, p,
+                    "boxplotPairwise", ugColors, combName, block=block)
+
+def getSED(wide, cutoff=None, block=None, mmapFile=None):
     """ 
     Calculate the Standardized Euclidean Distance and return an array of 
     distances to the Mean and a matrix of pairwise distances.
 
+    The pairwise distances are computed for blocks of samples at a time from
+    the standardized data, so only one block of the matrix is built at once.
+    If a file is given the matrix is stored on disk in a memory-mapped file,
+    making the number of samples bounded by disk instead of memory. Per sample
+    summaries are computed as every block is done.
+
     :Arguments:
         :type wide: pandas.DataFrame
         :param wide: A wide formatted data frame with samples as columns and 
                      compounds as rows.
 
+        :type cutoff: pandas.DataFrame
+        :param cutoff: Cutoffs for pairwise SED, the number of distances of
+                    each sample above them are counted.
+
+        :type block: int
+        :param block: Number of samples per block, all samples if not given.
+
+        :type mmapFile: string
+        :param mmapFile: Name of the .npy file to store the pairwise SED.
+
     :Returns:
-        :return: Return 4 pd.DataFrames with SED values and cutoffs.
+        :return: Return 3 pd.DataFrames with SED to the mean, pairwise SED
+                and per sample summaries of the pairwise SED.
         :rtype: pd.DataFrames
     """
-    #Calculate means
-    mean = pd.DataFrame(wide.mean(axis=1))
-
     #Calculate variance
     variance = wide.var(axis=1,ddof=1)
 
     #Flag if variance == 0
     variance[variance==0]=1
 
-    #Get SED distances!
-    dist = DistanceMetric.get_metric('seuclidean', V=variance)
+    #Center and standardize every feature (samples as rows)
+    values = wide.values.astype(float)
+    values = (values - values.mean(axis=1)[:, np.newaxis]) / \
+                np.sqrt(variance.values)[:, np.newaxis]
+    values = values.T
+    norms = (values**2).sum(axis=1)
 
     #Calculate the SED from all samples to the mean
-    SEDtoMean = dist.pairwise(wide.values.T, mean.T)
-    SEDtoMean = pd.DataFrame(SEDtoMean, columns = ['SED_to_Mean'], 
+    SEDtoMean = pd.DataFrame(np.sqrt(norms), columns = ['SED_to_Mean'], 
                                index = wide.columns)
 
-    #Calculate the pairwise standardized Euclidean Distance of all samples
-    SEDpairwise = dist.pairwise(wide.values.T)
-    SEDpairwise = pd.DataFrame(SEDpairwise, columns=wide.columns, 
+    #Pairwise matrix, on disk if a file is given
+    nSamples = len(wide.columns)
+    if mmapFile:
+        pairwise = np.lib.format.open_memmap(mmapFile, mode='w+', dtype=float,
+                                    shape=(nSamples, nSamples))
+    else:
+        pairwise = np.empty((nSamples, nSamples))
+    if not block:
+        block = nSamples
+
+    #Per sample summaries
+    SEDsummary = pd.DataFrame(index=wide.columns)
+    meanSED = np.empty(nSamples)
+    maxSED = np.empty(nSamples)
+    if cutoff is not None:
+        cuts = cutoff.loc["cut"].values.astype(float)
+    else:
+        cuts = np.array([])
+    above = np.zeros((nSamples, len(cuts)), dtype=int)
+
+    #Calculate the pairwise standardized Euclidean Distance by blocks
+    for start in range(0, nSamples, block):
+        stop = min(start + block, nSamples)
+        current = norms[start:stop, np.newaxis] + norms[np.newaxis, :] - \
+                    2 * np.dot(values[start:stop], values.T)
+        current = np.sqrt(np.maximum(current, 0))
+
+        #Converts to NaN the diagonal
+        current[np.arange(stop - start), np.arange(start, stop)] = np.nan
+        pairwise[start:stop] = current
+
+        #Summaries of the samples in the block
+        meanSED[start:stop] = np.nanmean(current, axis=1)
+        maxSED[start:stop] = np.nanmax(current, axis=1)
+        with np.errstate(invalid='ignore'):
+            for i, cut in enumerate(cuts):
+                above[start:stop, i] = (current > cut).sum(axis=1)
+
+    if mmapFile:
+        pairwise.flush()
+
+    SEDpairwise = pd.DataFrame(pairwise, columns=wide.columns, 
                                index=wide.columns)
 
-    #Converts to NaN the diagonal
-    for index, row in SEDpairwise.iterrows():
-        SEDpairwise.loc[index, index] = np.nan
+    SEDsummary["SED_pairwise_mean"] = meanSED
+    SEDsummary["SED_pairwise_max"] = maxSED
+    if cutoff is not None:
+        for i, name in enumerate(cutoff.columns):
+            SEDsummary["SED_above_{0}".format(name)] = above[:, i]
 
     #Returning data
-    return SEDtoMean,SEDpairwise
+    return SEDtoMean,SEDpairwise,SEDsummary
 
 def getCutOffs(wide,p):
     """ 
@@ -459,11 +667,8 @@ def getCutOffs(wide,p):
     cutoff2   = pd.DataFrame([[betaCut2, normCut2, chisqCut2],
                             ['Beta(Exact)', 'Normal', 'Chi-sq']],index=["cut","name"],
                             columns=['Beta(Exact)', 'Normal', 'Chi-sq'])
-    
-    #Create Palette
-    cutPalette.getColors(cutoff1.T,["name"])
 
-    #Returning colors
+    #Returning cutoffs
     return cutoff1,cutoff2
 
 def main(args):
@@ -496,19 +701,40 @@ def main(args):
     dataPalette.getColors(design=dat.design, groups=levels)
     dat.design=dataPalette.design
 
-    #Open pdfPages Calculate SED
-    with PdfPages(os.path.abspath(args.figure)) as pdf:
-        SEDtoMean,SEDpairwise=calculateSED(dat, dataPalette.ugColors, dataPalette.combName, pdf, args.p)
-
-
-    #Outputing files for tsv files
-    SEDtoMean.to_csv(os.path.abspath(args.toMean), index_label="sampleID",
-                    columns=["SED_to_Mean"],sep='\t')
-    SEDpairwise.drop(["colors"],axis=1,inplace=True)
-    if args.group:
-        SEDpairwise.drop(["colors_x","colors_y"],axis=1,inplace=True)
-    SEDpairwise.to_csv(os.path.abspath(args.pairwise),index_label="sampleID",
-                    sep='\t')
+    #Directory for the memory-mapped pairwise SED
+    if args.block:
+        mmapDir = tempfile.mkdtemp(dir=args.memmapDir)
+        logger.info("Storing pairwise SED in {0}".format(mmapDir))
+    else:
+        mmapDir = None
+
+    try:
+        #Calculate SED
+        SEDtoMean,SEDpairwise,SEDsummary,plots=calculateSED(dat,
+                                    dataPalette.ugColors, dataPalette.combName,
+                                    args.p, jobs=args.jobs, block=args.block,
+                                    mmapDir=mmapDir)
+
+        #Open pdfPages and plot SED
+        if args.figure:
+            with PdfPages(args.figure) as pdf:
+                plotSED(plots, pdf, args.p, dataPalette.ugColors,
+                        dataPalette.combName, block=args.block)
+        else:
+            logger.info("No figure given, skipping plots")
+
+        #Outputing files for tsv files
+        SEDtoMean.to_csv(os.path.abspath(args.toMean), index_label="sampleID",
+                        columns=["SED_to_Mean"],sep='\t')
+        SEDpairwise.to_csv(os.path.abspath(args.pairwise),index_label="sampleID",
+                        sep='\t')
+        if args.summary:
+            SEDsummary.to_csv(args.summary, index_label="sampleID", sep='\t')
+
+    finally:
+        #Removing memory-mapped files, also if something failed
+        if mmapDir:
+            shutil.rmtree(mmapDir, ignore_errors=True)
 
     #Ending script
     logger.info("Script complete.")
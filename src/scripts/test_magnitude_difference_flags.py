@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+################################################################################
+# SCRIPT: test_magnitude_difference_flags.py
+#
+# DESCRIPTION: Golden test of the digit counting of magnitude_difference_flags.
+#              The array method (digitCounts) must give the same counts as
+#              the string method (splitDigits) on the values where they are
+#              most likely to differ: powers of ten and their neighbouring
+#              floats, rounding boundaries of '%f', signed zeros, missing
+#              values and infinity.
+#
+#              Run it from the scripts folder:
+#                   python test_magnitude_difference_flags.py
+#
+################################################################################
+# Import built-in libraries
+import sys
+
+# Import add-on libraries
+import numpy as np
+import pandas as pd
+
+# Import script to test
+import magnitude_difference_flags as mdf
+
+def goldenValues():
+    """
+    Values to compare the digit counts on.
+
+        :Returns:
+            :rtype values: numpy.array
+            :returns values: Values to test.
+
+    """
+    values = [0.0, -0.0, np.nan, np.inf, -np.inf, 1e-9, -1e-9, 0.5, -0.5,
+              0.9999995, 0.99999949999, -0.9999996, 9.9999995, 9.99999949,
+              999999.9999995, 123.4567895, 2.0**53, 2.0**53+2, 1e15-1, 1e15,
+              999999999999999.9, 1e16-1, 9.999999999999999e22, 1e22, 1e23,
+              -1e300, 1e308, np.finfo(float).max, np.finfo(float).tiny]
+
+    # Every power of ten and its neighbouring floats
+    for k in range(-8, 309):
+        power = 10.0 ** k
+        values += [power, np.nextafter(power, 0), np.nextafter(power, np.inf),
+                   -power, -np.nextafter(power, 0), power - 5e-7,
+                   power - 4e-7, power * 0.99999999]
+
+    # Random magnitudes
+    random = np.random.RandomState(0)
+    values += list(random.randn(100000) * 10.0 ** random.randint(-10, 30, 100000))
+
+    # Values around the rounding to 6 decimals of '%f'
+    values += list(np.round(random.rand(20000) * 1e6) / 1e6 +
+                   random.randint(0, 1000, 20000) - 1e-7 * random.rand(20000))
+    return np.array(values)
+
+def testDigitCounts():
+    """ Counts of digitCounts are the same as the ones of splitDigits """
+    values = goldenValues()
+    reference = np.array([mdf.splitDigits(x) for x in values], dtype=float)
+    counts = mdf.digitCounts(values)
+    same = (reference == counts) | (np.isnan(reference) & np.isnan(counts))
+    assert same.all(), "Different counts for {0}".format(values[~same][:10])
+
+def testCountDigits():
+    """ Count tables are the same as counting the digits with splitDigits """
+    random = np.random.RandomState(1)
+    values = random.randn(300, 12) * 10.0 ** random.randint(-3, 8, (300, 12))
+    values[random.rand(300, 12) < 0.1] = 0
+    wide = pd.DataFrame(values, index=["f{0}".format(i) for i in range(300)],
+                        columns=["s{0}".format(i) for i in range(12)])
+
+    # Tables must be equal, including the dtypes
+    count = mdf.countDigits(wide)
+    reference = mdf.summarizeCounts(wide.applymap(mdf.splitDigits))
+    assert count.equals(reference)
+    assert (count.dtypes == reference.dtypes).all()
+
+if __name__ == '__main__':
+    testDigitCounts()
+    testCountDigits()
+    sys.stdout.write("Digit counts are identical to the string method.\n")
@@ -36,9 +36,8 @@ from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
 from sklearn import datasets
 from sklearn.model_selection import GridSearchCV, cross_val_score
 from sklearn.preprocessing import StandardScaler
-# Importing Paired t-test module
-from scipy.stats import ttest_rel
-from scipy.stats import ttest_ind
+# Importing t distribution for the batched t-tests
+from scipy.stats import t as tdist
 
 # Import local plottin libraries
 from secimtools.visualManager import module_box as box
@@ -104,6 +103,127 @@ def getOptions(myopts=None):
     return(args)
 
 
+def groupSummaries(values, groups, levels):
+    """
+    Computes means, sample variances and number of samples of every group
+    for all the features at once.
+
+    :Arguments:
+        :type values: numpy.ndarray
+        :param values: Matrix of features (rows) by samples (columns).
+
+        :type groups: numpy.ndarray
+        :param groups: Group of each of the samples (columns) in values.
+
+        :type levels: list
+        :param levels: Group levels in the order they should be reported.
+
+    :Returns:
+        :rtype means: numpy.ndarray
+        :return means: Features by levels matrix of group means.
+
+        :rtype variances: numpy.ndarray
+        :return variances: Features by levels matrix of group variances (ddof=1).
+
+        :rtype counts: numpy.ndarray
+        :return counts: Number of samples on each level.
+    """
+    # Creating arrays to hold the summaries
+    means     = np.empty((values.shape[0], len(levels)))
+    variances = np.empty((values.shape[0], len(levels)))
+    counts    = np.empty(len(levels))
+
+    # Each group is sliced only once and summarized for all features.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for k, level in enumerate(levels):
+            block = values[:, groups == level]
+            counts[k] = block.shape[1]
+            means[:, k] = block.mean(axis=1)
+            variances[:, k] = block.var(axis=1, ddof=1)
+
+    return means, variances, counts
+
+
+def pairwiseTtest(means, variances, counts, pairs):
+    """
+    Runs the unpaired (two-sample, equal variances) t-test for every feature
+    and every pair of groups from the precomputed group summaries. Gives the
+    same results as scipy.stats.ttest_ind on each feature.
+
+    :Arguments:
+        :type means: numpy.ndarray
+        :param means: Features by levels matrix of group means.
+
+        :type variances: numpy.ndarray
+        :param variances: Features by levels matrix of group variances (ddof=1).
+
+        :type counts: numpy.ndarray
+        :param counts: Number of samples on each level.
+
+        :type pairs: list
+        :param pairs: List of (first, second) level positions to compare.
+
+    :Returns:
+        :rtype t_value: numpy.ndarray
+        :return t_value: Features by pairs matrix of t-values.
+
+        :rtype p_value: numpy.ndarray
+        :return p_value: Features by pairs matrix of two-sided p-values.
+
+        :rtype difference_value: numpy.ndarray
+        :return difference_value: Features by pairs matrix of mean differences.
+    """
+    # Positions of the first and second group of every pair
+    first  = np.array([pair[0] for pair in pairs], dtype=int)
+    second = np.array([pair[1] for pair in pairs], dtype=int)
+
+    # Degrees of freedom and pooled variance for every pair
+    n1 = counts[first]
+    n2 = counts[second]
+    df = n1 + n2 - 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pooled = ((n1 - 1) * variances[:, first] + (n2 - 1) * variances[:, second]) / df
+        difference_value = means[:, first] - means[:, second]
+        t_value = difference_value / np.sqrt(pooled * (1.0 / n1 + 1.0 / n2))
+    p_value = 2 * tdist.sf(np.abs(t_value), df)
+
+    return t_value, p_value, difference_value
+
+
+def pairedTtest(first, second):
+    """
+    Runs the paired t-test for every feature at once. Gives the same results
+    as scipy.stats.ttest_rel on each feature.
+
+    :Arguments:
+        :type first: numpy.ndarray
+        :param first: Features by samples matrix of the first group.
+
+        :type second: numpy.ndarray
+        :param second: Features by samples matrix of the second group. Columns
+                        must be aligned by pair with the columns of first.
+
+    :Returns:
+        :rtype t_value: numpy.ndarray
+        :return t_value: t-value of each feature.
+
+        :rtype p_value: numpy.ndarray
+        :return p_value: Two-sided p-value of each feature.
+
+        :rtype difference_value: numpy.ndarray
+        :return difference_value: Difference of the group means of each feature.
+    """
+    # Differences between the pairs
+    differences = first - second
+    n  = differences.shape[1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        difference_value = differences.mean(axis=1)
+        t_value = difference_value / np.sqrt(differences.var(axis=1, ddof=1) / n)
+    p_value = 2 * tdist.sf(np.abs(t_value), n - 1)
+
+    return t_value, p_value, difference_value
+
+
 def main(args):
 
     # Loading data trought Interface
@@ -135,133 +255,47 @@ def main(args):
 
        # Extracting data from the interface.
        data_frame = dat.transpose()
-       # Extracting number of features. This will depend on whether the user has provided ordering variable or not.
-       # This variable is useless for unpared test. it just adds extra column to the data frame.	
+
+       # Dropping columns that characterize group. Only feature columns will remain.
+       # We also trnaspose here so it will be easier to operate with.
+       # We should either drop 1 or 2 columns depending whether we fed the second one.
        if args.order == False:
-          number_of_features = data_frame.shape[1] - 1
+          data_frame_features = data_frame.drop( args.group, 1 ).transpose()
        else:
-          number_of_features = data_frame.shape[1] - 2
-       # Saving treatment group name from the arguments.
+          data_frame_features = data_frame.drop( [args.group, args.order], 1 ).transpose()
 
+       # Pulling indexes list and the values (features x samples) from the current data frame.
+       indexes_list_complete = data_frame_features.index.tolist()
+       values = data_frame_features.values.astype(float)
+       groups = data_frame[args.group].values
 
 
        # Computing overall summaries (mean and variance).
        # This part just produces sumamry statistics for the output table.
        # This has nothing to do with unpaired t-test. This is just summary for the table.
-       mean_value_all = [0] * number_of_features
-       variance_value_all = [0] * number_of_features
-
-       for j in range(0, number_of_features ):
-  
-
-           # Creating duplicate for manipulation.
-           data_frame_manipulate = data_frame
-
-           # Dropping columns that characterize group. Only feature columns will remain.
-           # We also trnaspose here so it will be easier to operate with.
-           # We should either drop 1 or 2 columns depending whether we fed the second one.
-           if args.order == False:
-              data_frame_manipulate_transpose  = data_frame_manipulate.drop(  args.group, 1 ).transpose()
-           else:
-              data_frame_manipulate_transpose  = data_frame_manipulate.drop(  [args.group, args.order], 1 ).transpose()
-           # Pulling indexes list from the current data frame.
-           indexes_list_complete = data_frame_manipulate_transpose.index.tolist()
-
-           # Computing dataset summaries.
-           mean_value_all[j] = np.mean(data_frame_manipulate_transpose.loc[ indexes_list_complete[j] ]) 
-           variance_value_all[j] = np.var(data_frame_manipulate_transpose.loc[ indexes_list_complete[j] ], ddof = 1)
+       summary_df     =  pd.DataFrame(data = values.mean(axis=1), columns = ["GrandMean"], index = indexes_list_complete )    
+       summary_df['SampleVariance'] =  values.var(axis=1, ddof=1)
 
 
-
-       # Creating the table and putting the results there.
-       summary_df     =  pd.DataFrame(data = mean_value_all, columns = ["GrandMean"], index = indexes_list_complete )    
-       summary_df['SampleVariance'] =  variance_value_all
-
-
-       # Computing means for each group and outputting them.
-       # This part just produces summary statistics for the output table.
-       # This has nothing to do with unpaired t-test. This is just summary for the table.
+       # Computing means, variances and counts for each group only once.
+       # Means are also outputted as summary statistics for the output table.
+       means, variances, counts = groupSummaries(values, groups, group_values_series_unique)
 
        for i in range(0, number_of_unique_groups ):
-        
-
-           # Extracting the pieces of the data frame that belong to the ith group.
-           data_frame_current_group  = data_frame.loc[data_frame[args.group].isin( [group_values_series_unique[i]]  )]
-
-           # Dropping columns that characterize group. Only feature columns will remain.
-           # We also trnaspose here so it will be easier to operate with.
-           # We should either drop 1 or 2 columns depending whether we fed the second one.
-           if args.order == False:
-              data_frame_current_group  = data_frame_current_group.drop(  args.group, 1 ).transpose()
-           else:
-              data_frame_current_group  = data_frame_current_group.drop(  [args.group, args.order], 1 ).transpose()
-
-           # Pulling indexes list from the current group.
-           indexes_list = data_frame_current_group.index.tolist()
-
-           # Creating array of means for the current group that will be filled.
-           means_value  = [0] * number_of_features
-    
-           for j in range(0, number_of_features ):
-  
-               series_current = data_frame_current_group.loc[ indexes_list[j] ] 
-               means_value[j] = series_current.mean()
-
-
-           # Adding current mean_value column to the data frame and assigning the name.
            means_value_column_name_current  = 'mean_treatment_' + group_values_series_unique[i] 
-           summary_df[means_value_column_name_current] = means_value
-           
-           
+           summary_df[means_value_column_name_current] = means[:, i]
 
 
        # Running pairwise unpaired (two-sample) t-test for all pairs of group levels that are saved in groups_pairwise.
+       # All the features and all the pairs are tested at once from the group summaries.
+       pairs_positions = list(combinations(range(number_of_unique_groups), 2))
+       t_value, p_value, difference_value = pairwiseTtest(means, variances, counts, pairs_positions)
+       with np.errstate(divide="ignore"):
+           neg_log10_p_value = - np.log10(p_value)
+
        for i in range(0, number_of_groups_pairwise ):
         
-           # Extracting the pieces of the data frame that belong to groups saved in the i-th unique pair.
            groups_subset = groups_pairwise[i] 
-           data_frame_first_group  = data_frame.loc[data_frame[args.group].isin( [groups_subset[0]]  )]
-           data_frame_second_group = data_frame.loc[data_frame[args.group].isin( [groups_subset[1]]  )]
-
-           # Dropping columns that characterize group. Only feature columns will remain.
-           # We also trnaspose here so it will be easier to operate with.
-           # We should either drop 1 or 2 columns depending whether we fed the second one.
-           if args.order == False:
-              data_frame_first_group  = data_frame_first_group.drop(  args.group, 1 ).transpose()
-              data_frame_second_group = data_frame_second_group.drop( args.group, 1 ).transpose()
-           else:
-              data_frame_first_group  = data_frame_first_group.drop(  [args.group, args.order], 1 ).transpose()
-              data_frame_second_group = data_frame_second_group.drop( [args.group, args.order], 1 ).transpose()
-
-           # Pulling indexes list from the first one (they are the same)
-           indexes_list = data_frame_first_group.index.tolist()
-
-           # Creating p_values, neg_log10_p_value, flag_values, difference_value lists filled wiht 0es.
-           p_value           = [0] * number_of_features
-           t_value           = [0] * number_of_features
-           neg_log10_p_value = [0] * number_of_features
-           flag_value_0p01   = [0] * number_of_features
-           flag_value_0p05   = [0] * number_of_features
-           flag_value_0p10   = [0] * number_of_features
-           difference_value  = [0] * number_of_features
-
-
-           for j in range(0, number_of_features ):
-       
-               series_first  = data_frame_first_group.loc[ indexes_list[j] ] 
-               series_second = data_frame_second_group.loc[ indexes_list[j] ]
-
-               ttest_ind_args = [series_first, series_second]
-               p_value[j] = ttest_ind( *ttest_ind_args )[1]
-               t_value[j] = ttest_ind( *ttest_ind_args )[0]
-               # Possible alternative for two groups.
-               # p_value[j] = ttest_ind_args(series_first, series_second)[1]
-	       neg_log10_p_value[j] = - np.log10(p_value[j])
-               difference_value[j] = series_first.mean() - series_second.mean()
-               if p_value[j] < 0.01: flag_value_0p01[j] = 1
-               if p_value[j] < 0.05: flag_value_0p05[j] = 1
-               if p_value[j] < 0.10: flag_value_0p10[j] = 1
-
 
            # Creating column names for the data frame.
            p_value_column_name_current           = 'prob_greater_than_t_for_diff_' + groups_subset[0] + '_' + groups_subset[1]
@@ -275,17 +309,17 @@ def main(args):
            # Adding current p_value and flag_value column to the data frame and assigning the name.
            # If the data frame has not been created yet we create it on the fly. i.e. if i == 0 create it.
            if i == 0:
-              flag_df     =  pd.DataFrame(data = flag_value_0p01, columns = [flag_value_column_name_current_0p01], index = indexes_list )    
+              flag_df     =  pd.DataFrame(data = (p_value[:, i] < 0.01).astype(int), columns = [flag_value_column_name_current_0p01], index = indexes_list_complete )    
            else:
-              flag_df[flag_value_column_name_current_0p01] = flag_value_0p01
+              flag_df[flag_value_column_name_current_0p01] = (p_value[:, i] < 0.01).astype(int)
 
            # At this point data frame exists so only columns are added to the existing data frame.
-           summary_df[p_value_column_name_current]           = p_value
-           summary_df[t_value_column_name_current]           = t_value
-           summary_df[neg_log10_p_value_column_name_current] = neg_log10_p_value
-           summary_df[difference_value_column_name_current]  = difference_value
-           flag_df[flag_value_column_name_current_0p05] = flag_value_0p05
-           flag_df[flag_value_column_name_current_0p10] = flag_value_0p10
+           summary_df[p_value_column_name_current]           = p_value[:, i]
+           summary_df[t_value_column_name_current]           = t_value[:, i]
+           summary_df[neg_log10_p_value_column_name_current] = neg_log10_p_value[:, i]
+           summary_df[difference_value_column_name_current]  = difference_value[:, i]
+           flag_df[flag_value_column_name_current_0p05] = (p_value[:, i] < 0.05).astype(int)
+           flag_df[flag_value_column_name_current_0p10] = (p_value[:, i] < 0.10).astype(int)
   
 
 
@@ -322,9 +356,6 @@ def main(args):
 
        # This piece of code will be executed only if the args.order has been provided and the check is passed. 
 
-       # Defining the number of features. It should be the dimension of the data frame minus 2 columns that stand for arg.group and args.order
-       number_of_features = data_frame.shape[1] - 2
-
        # At this point is is confirmed that there are only 2 group and that pairing variable args.order has been provided.
        # Now we need to check that pairing is correct i.e. that each pairID corresponds to only two samples from different groups.
 
@@ -384,118 +415,51 @@ def main(args):
           exit()	
    
 
+       # Dropping columns that characterize group and pairing. Only feature columns will remain.
+       # We also trnaspose here so it will be easier to operate with.
+       data_frame_features = data_frame.drop( [args.group,args.order], 1 ).transpose()
+
+       # Pulling indexes list and the values (features x samples) from the current data frame.
+       indexes_list_complete = data_frame_features.index.tolist()
+       values = data_frame_features.values.astype(float)
+       groups = data_frame[args.group].values
+
 
        # Computing overall summaries (mean and variance).
        # This part just produces sumamry statistics for the output table.
        # This has nothing to do with paired t-test. This is just summary for the table.
-       mean_value_all = [0] * number_of_features
-       variance_value_all = [0] * number_of_features
-
-       for j in range(0, number_of_features ):
-
-           # Creating duplicate for manipulation.
-           data_frame_manipulate = data_frame
-
-           # Dropping columns that characterize group. Only feature columns will remain.
-           # We also trnaspose here so it will be easier to operate with.
-           data_frame_manipulate_transpose  = data_frame_manipulate.drop( [args.group,args.order], 1 ).transpose()
-           # Pulling indexes list from the current data frame.
-           indexes_list_complete = data_frame_manipulate_transpose.index.tolist()
-
-           # Computing dataset summaries.
-           mean_value_all[j] = np.mean(data_frame_manipulate_transpose.loc[ indexes_list_complete[j] ]) 
-           variance_value_all[j] = np.var(data_frame_manipulate_transpose.loc[ indexes_list_complete[j] ], ddof = 1)
-
-
-
-       # Creating the table and putting the results there.
-       summary_df     =  pd.DataFrame(data = mean_value_all, columns = ["GrandMean"], index = indexes_list_complete )    
-       summary_df['SampleVariance'] =  variance_value_all
+       summary_df     =  pd.DataFrame(data = values.mean(axis=1), columns = ["GrandMean"], index = indexes_list_complete )    
+       summary_df['SampleVariance'] =  values.var(axis=1, ddof=1)
 
 
        # Computing means for each group and outputting them.
        # This part just produces summary statistics for the output table.
        # This has nothing to do with paired t-test. This is just summary for the table.
+       means, variances, counts = groupSummaries(values, groups, group_values_series_unique)
 
        for i in range(0, number_of_unique_groups ):
-        
-
-           # Extracting the pieces of the data frame that belong to the ith group.
-           data_frame_current_group  = data_frame.loc[data_frame[args.group].isin( [group_values_series_unique[i]]  )]
-
-           # Dropping columns that characterize group. Only feature columns will remain.
-           data_frame_current_group  = data_frame_current_group.drop(  [args.group, args.order], 1 ).transpose()
-
-           # Pulling indexes list from the current group.
-           indexes_list = data_frame_current_group.index.tolist()
-
-           # Creating array of means for the current group that will be filled.
-           means_value  = [0] * number_of_features
-    
-           for j in range(0, number_of_features ):
-  
-               series_current = data_frame_current_group.loc[ indexes_list[j] ] 
-               means_value[j] = series_current.mean()
-
-
-           # Adding current mean_value column to the data frame and assigning the name.
            means_value_column_name_current  = 'mean_treatment_' + group_values_series_unique[i] 
-           summary_df[means_value_column_name_current] = means_value
+           summary_df[means_value_column_name_current] = means[:, i]
 
 
 
 
        # Performing paired t-test for the two groups and saving the results.
 
-       # Creating p_values and flag_values emply list of length number_of_features.
-       # This will be used for thw two groups in paired t-test.
-       p_value = [0] * number_of_features
-       t_value = [0] * number_of_features
-       flag_value_0p01   = [0] * number_of_features
-       flag_value_0p05   = [0] * number_of_features
-       flag_value_0p10   = [0] * number_of_features
-       neg_log10_p_value = [0] * number_of_features
-       difference_value  = [0] * number_of_features
-
-       # Performing paired t-test for each pair of features.
-       for j in range(0, number_of_features ):
-
-  
-           # Extracting the pieces of the data frame that belong to 1st group.
-           data_frame_first_group  = data_frame.loc[data_frame[args.group].isin( [group_values_series_unique[0]]  )]
-           data_frame_second_group = data_frame.loc[data_frame[args.group].isin( [group_values_series_unique[1]]  )]
-
-        
-           # Sorting data frame by args.group index 
-           # This will ensure datasets are aligned by pair when fed to the t-test.
-           data_frame_first_group  = data_frame_first_group.sort(args.order)
-           data_frame_second_group = data_frame_second_group.sort(args.order)
-
-
-           # Sorting data frame by args.group index 
-           data_frame_first_group  = data_frame_first_group.drop(  [args.group,args.order], 1 ).transpose()
-           data_frame_second_group = data_frame_second_group.drop( [args.group,args.order], 1 ).transpose()
-         
-           # Pulling list of indexes. This is the same list for the first and for the second.
-           indexes_list = data_frame_first_group.index.tolist()
-
-           # Pullinng the samples out
-           series_first  = data_frame_first_group.loc[ indexes_list[j] ] 
-           series_second = data_frame_second_group.loc[ indexes_list[j] ]
-
-
-           # Running t-test for the two given samples
-           paired_ttest_args = [series_first, series_second]
-           p_value[j] = ttest_rel( *paired_ttest_args )[1]
-           t_value[j] = ttest_rel( *paired_ttest_args )[0]
-           neg_log10_p_value[j] = - np.log10(p_value[j])
-           difference_value[j] = series_first.mean() - series_second.mean()
-           if p_value[j] < 0.01: flag_value_0p01[j] = 1
-           if p_value[j] < 0.05: flag_value_0p05[j] = 1
-           if p_value[j] < 0.10: flag_value_0p10[j] = 1
+       # Extracting the pieces of the data frame that belong to each group.
+       # Sorting data frame by args.order will ensure datasets are aligned by pair when fed to the t-test.
+       data_frame_first_group  = data_frame.loc[data_frame[args.group].isin( [group_values_series_unique[0]]  )].sort_values(args.order)
+       data_frame_second_group = data_frame.loc[data_frame[args.group].isin( [group_values_series_unique[1]]  )].sort_values(args.order)
 
+       # Dropping grouping columns so only features (as rows) remain.
+       data_frame_first_group  = data_frame_first_group.drop(  [args.group,args.order], 1 ).transpose()
+       data_frame_second_group = data_frame_second_group.drop( [args.group,args.order], 1 ).transpose()
 
-       # The loop over features has to be finished by now. Converting them into the data frame.    
+       # Performing paired t-test for all the features at once.
+       t_value, p_value, difference_value = pairedTtest(data_frame_first_group.values.astype(float),
+                                                        data_frame_second_group.values.astype(float))
+       with np.errstate(divide="ignore"):
+           neg_log10_p_value = - np.log10(p_value)
 
 
        # Creating column names for the data frame.
@@ -513,9 +477,9 @@ def main(args):
        summary_df[neg_log10_p_value_column_name_current] = neg_log10_p_value
        summary_df[difference_value_column_name_current] = difference_value
 
-       flag_df  =  pd.DataFrame(data = flag_value_0p01, columns = [flag_value_column_name_current_0p01], index = indexes_list )    
-       flag_df[flag_value_column_name_current_0p05] = flag_value_0p05
-       flag_df[flag_value_column_name_current_0p10] = flag_value_0p10
+       flag_df  =  pd.DataFrame(data = (p_value < 0.01).astype(int), columns = [flag_value_column_name_current_0p01], index = indexes_list_complete )    
+       flag_df[flag_value_column_name_current_0p05] = (p_value < 0.05).astype(int)
+       flag_df[flag_value_column_name_current_0p10] = (p_value < 0.10).astype(int)
 
 
 
@@ -0,0 +1,86 @@
+# Import add-on packages
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+from patsy import dmatrix
+
+def fitBatchOLS(rhs, data, features):
+    """
+    Fits the same OLS model to many features at once. Since all the features
+    share the design matrix it is built only once and every feature is solved
+    simultaneously as a multi-response least squares problem.
+
+    :Arguments:
+        :type rhs: str
+        :param rhs: right part of the model, everything after the '~'
+                    ie. C(categorical1)+C(categorical2)+numerical
+
+        :type data: pd.DataFrame
+        :param data: Trans data (samples as rows), it has to contain the
+                     features and the factors on the model.
+
+        :type features: list
+        :param features: Names of the features (columns of data) to fit.
+
+    :Returns:
+        :rtype fit: dict
+        :return fit: Results for all the features named after the statsmodels
+                     attributes they replace. params, bse, tvalues and pvalues
+                     are terms x features DataFrames. fvalue, f_pvalue, ssr, ess,
+                     mse_resid and rsquared are Series by feature. resid and
+                     fittedvalues are samples x features DataFrames. df_model
+                     and df_resid are shared by all the features.
+    """
+    # Design matrix is built only once (rows with missing factors are dropped)
+    X = dmatrix(rhs, data, return_type="dataframe")
+    Y = data.loc[X.index, features].astype(float)
+
+    # Solving all features at once
+    pinvX  = np.linalg.pinv(X.values)
+    params = np.dot(pinvX, Y.values)
+    fitted = np.dot(X.values, params)
+    resid  = Y.values - fitted
+
+    # Degrees of freedom
+    rank = np.linalg.matrix_rank(X.values)
+    hasConstant = "Intercept" in X.columns
+    df_model = rank - 1 if hasConstant else rank
+    df_resid = X.shape[0] - rank
+
+    # Sum of squares
+    ssr = (resid ** 2).sum(axis=0)
+    if hasConstant:
+        tss = ((Y.values - Y.values.mean(axis=0)) ** 2).sum(axis=0)
+    else:
+        tss = (Y.values ** 2).sum(axis=0)
+    ess = tss - ssr
+
+    # Model statistics
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mse_resid = ssr / df_resid
+        fvalue    = (ess / df_model) / mse_resid
+        rsquared  = 1 - ssr / tss
+        bse       = np.sqrt(np.outer(np.diag(np.dot(pinvX, pinvX.T)), mse_resid))
+        tvalues   = params / bse
+    f_pvalue = stats.f.sf(fvalue, df_model, df_resid)
+    pvalues  = 2 * stats.t.sf(np.abs(tvalues), df_resid)
+
+    # Putting all the results together
+    terms = X.columns
+    fit = {"params":       pd.DataFrame(params, index=terms, columns=features),
+           "bse":          pd.DataFrame(bse, index=terms, columns=features),
+           "tvalues":      pd.DataFrame(tvalues, index=terms, columns=features),
+           "pvalues":      pd.DataFrame(pvalues, index=terms, columns=features),
+           "fvalue":       pd.Series(fvalue, index=features),
+           "f_pvalue":     pd.Series(f_pvalue, index=features),
+           "ssr":          pd.Series(ssr, index=features),
+           "ess":          pd.Series(ess, index=features),
+           "mse_resid":    pd.Series(mse_resid, index=features),
+           "rsquared":     pd.Series(rsquared, index=features),
+           "df_model":     df_model,
+           "df_resid":     df_resid,
+           "resid":        pd.DataFrame(resid, index=X.index, columns=features),
+           "fittedvalues": pd.DataFrame(fitted, index=X.index, columns=features)}
+
+    # Returning results
+    return fit
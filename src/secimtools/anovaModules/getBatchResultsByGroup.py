@@ -0,0 +1,80 @@
+# Import built-in modules
+import re
+
+# Import Add-on modules
+import pandas as pd
+import numpy as np
+
+# Import ANOVA Modules
+from secimtools.anovaModules.gimmeTheMissin import gimmeTheMissin
+
+def getBatchResultsByGroup(fit, levels, numerical):
+    """
+    Batched version of getModelResultsByGroup. It generates the results by
+    group for all the features of a fitBatchOLS result. The results that it
+    generates includes:
+     -  Coeficients
+     -  Std. error
+     -  T values
+     -  Probability for the t-values
+
+    :Arguments:
+        :type fit: dict
+        :param fit: Output of fitBatchOLS.
+
+        :type levels: list
+        :param levels: groups inside a factor.
+
+        :type numerical: list
+        :param numerical: Numerical factor(s) if any.
+
+    :Returns:
+        :rtype df: pd.DataFrame
+        :return df: Contrasts as rows and (statistic, feature) as columns.
+    """
+    # Extracting the parameters we are interested in from the fit
+    coef = -(fit["params"])
+    stde = fit["bse"]
+    t    = -(fit["tvalues"])
+    pt   = fit["pvalues"]
+    log  = -np.log10(fit["pvalues"])
+
+    # Concat all dataframes, statistic names go on the first column level
+    df = pd.concat([coef,stde,t,pt,log], axis=1, keys=["diff_of",
+                    "stdError_for_Diff","t-Value_for_Diff",
+                    "prob_greater_than_t_for_diff","-log10_p-value_"])
+
+    # Removing intercepts
+    df.drop("Intercept",inplace=True,axis="index")
+
+    # Removing numerical factors
+    for numeric in numerical:
+        if numeric in df.index.tolist():
+            df.drop(numeric,inplace=True,axis="index")
+
+    # New Index Names
+    newIndexNames = {origIndx:re.sub(".+\[T\.|\]","",origIndx)for origIndx in df.index.tolist()}
+
+    # Rename df indexes with new Indexes names
+    df.rename(newIndexNames,inplace=True)
+
+    #Getting the baseline
+    baseLines = gimmeTheMissin(df.index.tolist(),levels)
+
+    # Creating pretty names for indexes
+    oldIndex = dict()
+    for origIndx,base in zip(df.index.tolist(),baseLines):
+        if base == origIndx:
+            df.drop(origIndx,inplace=True)
+        else:
+            oldIndex[origIndx] = "{0}-{1}".format(base,origIndx)
+
+    # Creating
+    df.replace(-0,np.nan, inplace=True)
+    df.replace(0,np.nan, inplace=True)
+
+    #Rename indexs
+    df.rename(index=oldIndex, inplace=True)
+
+    #Returns
+    return df
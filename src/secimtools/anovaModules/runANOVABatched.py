@@ -0,0 +1,139 @@
+# Import build-in librearies
+import copy
+
+# import add-on packages
+import numpy as np
+import pandas as pd
+
+# Importing anova packages
+from secimtools.anovaModules.fitBatchOLS import fitBatchOLS
+from secimtools.anovaModules.changeDFOrder import changeDFOrder
+from secimtools.anovaModules.startANOVAResults import startANOVAResults
+from secimtools.anovaModules.removeAnovaDupResults import removeAnovaDupResults
+from secimtools.anovaModules.getBatchResultsByGroup import getBatchResultsByGroup
+
+
+def runANOVABatched(dat, formula, lvlComb, categorical, levels, numerical):
+    """
+    Batched core for processing all the ANOVA data. Instead of fitting one
+    model per feature, the design matrix is built once per contrast ordering
+    and all the features are solved at the same time. Takes the same arguments
+    and returns the same tables as runANOVA.
+
+    :Arguments:
+        :type dat: wideToDesign object.
+        :param dat: wide, design, group, anno, trans.
+
+        :type formula: dictionary
+        :param formula: Contains the formulas in a row:formula fashion.
+
+        :type lvlComb: list.
+        :param lvlComb: list with all the levels in the factors.
+
+        :type categorical: list.
+        :param categorical: Contains the names of the categorical factors.
+
+        :type levels: list.
+        :param levels: Name of the .
+
+        :type numerical: list.
+        :param numerical: Contains the names of the numerical factors.
+
+    :Returns:
+        :rtype results: pd.DataFrames
+        :return results: dataframe in wide format with the results of the model
+
+        :rtype residDat: pd.DataFrames
+        :return residDat: Contains the residuals of the model
+
+        :rtype fitDat: pd.DataFrames
+        :return fitDat: dataframe with all the fitted data
+    """
+
+    # Getting grandMean, variance and mean per groups
+    results = startANOVAResults(wide=dat.wide,design=dat.design,groups=categorical)
+
+    # All the features share the right part of the formula
+    features = list(formula.keys())
+    rhs = formula[features[0]].split("~",1)[1]
+
+    # Creating list for fullRes and IndexToDrop
+    comb_results = list()
+    indexToDrop  = list()
+
+    # Reverse list
+    combs=copy.copy(lvlComb)
+    combs.reverse()
+
+    # Take one element of the group and pop it
+    while len(combs)>0:
+        # Take las element of the list
+        elem =  combs.pop()
+
+        # Create tempDF to change Order
+        tempDF = changeDFOrder(data=dat.trans, combN=elem, factors=categorical)
+
+        # Running ANOVA on all the features at once
+        anova = fitBatchOLS(rhs=rhs, data=tempDF, features=features)
+
+        # Saving a dataframe for anova results
+        group_results = getBatchResultsByGroup(anova,levels,numerical)
+
+        # Dropping duplicates
+        group_results = removeAnovaDupResults(indexToDrop,df=group_results)
+
+        # Appending results to list
+        comb_results.append(group_results)
+
+        # Appending current indexes to indextoDrop list
+        indexToDrop= indexToDrop+group_results.index.tolist()
+
+    # Creating one df with all the results
+    comb_results = pd.concat(comb_results)
+
+    # Reformating data to "{statistic}_{combination}" columns
+    full_results = list()
+    for name in comb_results.columns.get_level_values(0).unique():
+        for combination in comb_results.index:
+            column = comb_results[name].loc[combination]
+            column.name = "{0}_{1}".format(name,combination)
+            full_results.append(column)
+
+    # Calculating flags for significant pvals
+    significant = list()
+    lpvals = np.abs(comb_results["-log10_p-value_"])
+    for name,pval in [("flag_significant_0.05_on",0.05),
+                      ("flag_significant_0.01_on",0.01),
+                      ("flag_significant_0.1_on",0.1)]:
+        for combination in comb_results.index:
+            column = pd.Series(np.where(lpvals.loc[combination] > -np.log10(pval),
+                        str(1),str(0)), index=features)
+            column.name = "{0}_{1}".format(name,combination)
+            significant.append(column)
+
+    # Getting general results for anova
+    model_results = pd.DataFrame(index=features)
+    model_results["f-Value"]            = anova["fvalue"]
+    model_results["p-Value_of_f-Value"] = anova["f_pvalue"]
+    model_results["ErrorSS"]            = anova["ssr"]
+    model_results["ModelSS"]            = anova["ess"]
+    model_results["TotalSS"]            = anova["ssr"] + anova["ess"]
+    model_results["MSE"]                = anova["mse_resid"]
+    model_results["NDF"]                = int(anova["df_model"])
+    model_results["DDF"]                = int(anova["df_resid"])
+    model_results["R2"]                 = anova["rsquared"]
+
+    # Concatenating results into a dataframe
+    full_results = pd.concat(full_results + [model_results[col] for col in \
+                    model_results.columns], axis=1)
+    significant  = pd.concat(significant, axis=1)
+
+    # Pearson residuals and fitted values
+    residDat = anova["resid"] / np.sqrt(anova["mse_resid"])
+    fitDat   = anova["fittedvalues"]
+
+    # Concatenate full_results with results
+    results = pd.concat([results,full_results], axis=1)
+
+    # Return results
+    return results, significant, residDat, fitDat
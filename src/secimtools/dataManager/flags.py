@@ -5,6 +5,7 @@ import re
 import sys
 
 # Add-on packages
+import numpy as np
 import pandas as pd
 
 class Flags:
@@ -201,5 +202,84 @@ class Flags:
             raise SystemExit
 
 
+def pairIncidence(sampleIDs, combos):
+    """
+    Build the incidence matrix between pairwise comparisons and samples.
+
+    :Arguments:
+        :param sampleIDs: List of sample IDs.
+        :type sampleIDs: list
+
+        :param combos: List of pairs of sample IDs.
+        :type combos: list
+
+    :Returns:
+        :return: Array with one row per pair and one column per sample, a
+            cell is 1 if the sample is part of the pair and 0 otherwise.
+        :rtype: numpy.array
+
+    """
+    position = dict((sampleID, i) for i, sampleID in enumerate(sampleIDs))
+    incidence = np.zeros((len(combos), len(sampleIDs)))
+    for i, combo in enumerate(combos):
+        for sampleID in combo:
+            if sampleID in position:
+                incidence[i, position[sampleID]] = 1
+    return incidence
+
+def summarizePairFlags(flags, sampleIDs, combos, template, incidence=None):
+    """
+    Calculate the proportion of times samples and features are flagged on a
+    set of pairwise comparisons.
+
+    For each sample, the flags of all the comparisons including that sample are
+    added up and divided by the number of non missing flags. For each feature,
+    the same is done across all the comparisons. Both are obtained from the
+    column sums of the flags and the pair by sample incidence matrix.
+
+    :Arguments:
+        :param flags: DataFrame of flags with one column per pairwise comparison.
+        :type flags: pandas.DataFrame
+
+        :param sampleIDs: List of sample IDs.
+        :type sampleIDs: list
+
+        :param combos: List of pairs of sample IDs.
+        :type combos: list
+
+        :param template: Format string giving the name of the flag column of a
+            pair, for example 'flag_{0}_{1}'.
+        :type template: string
+
+        :param incidence: Incidence matrix from pairIncidence. OPTIONAL, it is
+            built if not given.
+        :type incidence: numpy.array
+
+    :Returns:
+        :return: Proportion of flags for every sample and for every feature.
+        :rtype: tuple of pandas.Series
+
+    """
+    if incidence is None:
+        incidence = pairIncidence(sampleIDs, combos)
+
+    # Flags and non missing flags as features x pairs arrays
+    columns = [template.format(c[0], c[1]) for c in combos]
+    values = flags[columns].values.astype(float)
+    present = ~np.isnan(values)
+    values[~present] = 0
+
+    # Number of samples in every pair
+    pairSize = incidence.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        propSample = np.dot(values.sum(axis=0), incidence) / \
+                     np.dot(present.sum(axis=0), incidence)
+        propFeature = np.dot(values, pairSize) / np.dot(present, pairSize)
+
+    return (pd.Series(propSample, index=sampleIDs),
+            pd.Series(propFeature, index=flags.index))
+
+
 if __name__ == '__main__':
     pass
@@ -10,7 +10,7 @@ import pandas as pd
 
 class wideToDesign:
     """ Class to handle generic data in a wide format with an associated design file. """
-    def __init__(self, wide, design, uniqID, group=False, runOrder=False, anno=False, clean_string=True, infer_sampleID=True, keepSample=True, logger=None):
+    def __init__(self, wide, design, uniqID, group=False, runOrder=False, anno=False, clean_string=True, infer_sampleID=True, keepSample=True, logger=None, chunksize=None):
         """ Import and set-up data.
 
         Import data both wide formated data and a design file. Set-up basic
@@ -48,6 +48,10 @@ class wideToDesign:
             anno (list): A list of additional annotations that can be used to group
                 items.
 
+            chunksize (int): If given only the header of 'wide' is loaded and
+                the data can be read in chunks of this many rows with
+                iterChunks.
+
         :Returns:
             **Attribute**
 
@@ -84,16 +88,13 @@ class wideToDesign:
         # Import wide formatted data file
         try:
             self.uniqID = uniqID
-            self.wide = pd.read_table(wide)
-            if clean_string:
-                self.wide[self.uniqID] = self.wide[self.uniqID].apply(lambda x: self._cleanStr(str(x)))
-                self.wide.rename(columns= lambda x:self._cleanStr(x),inplace=True)
-
-            # Make sure index is a string and not numeric
-            self.wide[self.uniqID] = self.wide[self.uniqID].astype(str)
-
-            # Set index to uniqID column
-            self.wide.set_index(self.uniqID, inplace=True)
+            self.wideFile = wide
+            self.chunksize = chunksize
+            self.clean_string = clean_string
+            if chunksize:
+                self.wide = self._formatWide(pd.read_table(wide, nrows=1).iloc[:0])
+            else:
+                self.wide = self._formatWide(pd.read_table(wide))
                 
         except:
             if self.logger:
@@ -211,6 +212,57 @@ class wideToDesign:
         if keepSample:
             self.keep_sample(self.sampleIDs)
 
+    def _formatWide(self, wide):
+        """ Clean strings and set the index of a wide formatted table.
+
+        :Arguments:
+            wide (pd.DataFrame): A wide formatted table as read from the file.
+
+        :Returns:
+            wide (pd.DataFrame): The table indexed by uniqID.
+
+        """
+        if self.clean_string:
+            wide[self.uniqID] = wide[self.uniqID].apply(lambda x: self._cleanStr(str(x)))
+            wide.rename(columns= lambda x:self._cleanStr(x),inplace=True)
+
+        # Make sure index is a string and not numeric
+        wide[self.uniqID] = wide[self.uniqID].astype(str)
+
+        # Set index to uniqID column
+        wide.set_index(self.uniqID, inplace=True)
+        return wide
+
+    def iterChunks(self):
+        """ Read the wide formatted data in chunks of rows.
+
+        Only available if a chunksize was given. Every chunk is formatted as
+        self.wide and keeps the same samples, so samples removed from
+        self.wide (i.e. keep_sample, removeSingle) are also removed from the
+        chunks.
+
+        :Returns:
+            (generator): pd.DataFrame with up to chunksize rows of the wide
+                formatted table.
+
+        """
+        # Without a chunksize pd.read_table returns the whole table instead of
+        # an iterator of chunks
+        if not self.chunksize:
+            if self.logger:
+                self.logger.error("Reading the data in chunks needs a chunksize, please give a chunksize to wideToDesign.")
+            else:
+                print ("Reading the data in chunks needs a chunksize, please give a chunksize to wideToDesign.")
+            raise ValueError("iterChunks needs a chunksize")
+        return self._iterChunks()
+
+    def _iterChunks(self):
+        """ Generator of the chunks of iterChunks. """
+        for chunk in pd.read_table(self.wideFile, chunksize=self.chunksize):
+            chunk = self._formatWide(chunk)
+            chunk.replace(r'\D',np.nan,regex=True,inplace=True)
+            yield chunk[self.wide.columns]
+
     def _cleanStr(self, x):
         """ Clean strings so they behave.
 
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# Built-in packages
+import os
+import cPickle as pk
+
+# Add-on packages
+import numpy as np
+import pandas as pd
+
+
+class libraryIndex:
+    """ Class to hold a compound library sorted by m/z for fast identification. """
+    def __init__(self, library, source=None):
+        """ Build the index from a library.
+
+        The library is sorted by m/z only once, every search on the index is a
+        binary search for the m/z window followed by a check of the RT window
+        on the features inside it. The index does not depend on the window
+        sizes so it can be saved and reused for any number of target files.
+
+        :Arguments:
+            library (annoFormat): A library loaded with annoFormat, using
+                anno=True to keep the annotation columns.
+
+            source (dict): Description of the library file and columns the
+                index is built from (see librarySource). It is saved with the
+                index so load can tell if the index is stale.
+
+        :Returns:
+            **Attribute**
+
+            self.uniqID (str): Name of the unique identifier column in the
+                library.
+
+            self.anno (list): Names of the annotation columns in the library.
+
+            self.mz (np.array): Library m/z values sorted in ascending order.
+
+            self.rt (np.array): Library RT values in the same order as self.mz.
+
+            self.position (np.array): Position of every indexed compound on
+                the original library file.
+
+            self.data (pd.DataFrame): Library IDs and annotations in the same
+                order as self.mz.
+
+            self.source (dict): Library file and columns of the index.
+
+        """
+        # Saving library information
+        self.source = source
+        self.uniqID = library.uniqID
+        if library.anno is None:
+            self.anno = list()
+        else:
+            self.anno = library.anno
+
+        # Sorting library by m/z, keeping original order on ties
+        mz = library.data[library.mz].values.astype(float)
+        self.position = np.argsort(mz, kind="mergesort")
+        self.mz = mz[self.position]
+        self.rt = library.data[library.rt].values.astype(float)[self.position]
+        self.data = library.data[self.anno].iloc[self.position]
+
+    @staticmethod
+    def librarySource(fname, uniqID, mz, rt):
+        """ Describe a library file and the columns used to build an index.
+
+        :Arguments:
+            :param str fname: File name of the library.
+
+            :param str uniqID: Name of the unique identifier column.
+
+            :param str mz: Name of the m/z column.
+
+            :param str rt: Name of the RT column.
+
+        :Returns:
+            :rtype: dict
+            :return: Absolute path, size and modification time of the library
+                file and the names of the columns.
+
+        """
+        fname = os.path.abspath(fname)
+        return {"path": fname, "size": os.path.getsize(fname),
+                "mtime": os.path.getmtime(fname), "uniqID": uniqID, "mz": mz,
+                "rt": rt}
+
+    def save(self, fname):
+        """ Save the index to disk so it can be reused on later runs. The
+        source of the index (library file and columns) is saved with it.
+
+        :Arguments:
+            :param str fname: File name of the index.
+
+        """
+        with open(fname, 'wb') as FH:
+            pk.dump(self, FH, pk.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(fname, source=None):
+        """ Load an index previously saved with save.
+
+        :Arguments:
+            :param str fname: File name of the index.
+
+            :param dict source: If given, source the index must have been
+                built from (see librarySource).
+
+        :Returns:
+            :rtype: libraryIndex
+            :return: The saved index, or None if it was built from a different
+                library file, a modified one or with different columns.
+
+        """
+        with open(fname, 'rb') as FH:
+            index = pk.load(FH)
+        if source is not None and getattr(index, "source", None) != source:
+            return None
+        return index
+
+    def query(self, mz, rt, MZCut, RTCut):
+        """ Find all the library compounds inside the m/z and RT windows of a
+        batch of features.
+
+        Windows are open intervals, (mz - MZCut, mz + MZCut) and
+        (rt - RTCut, rt + RTCut).
+
+        :Arguments:
+            :param np.array mz: m/z values of the features.
+
+            :param np.array rt: RT values of the features.
+
+            :param float MZCut: Window size for m/z.
+
+            :param float RTCut: Window size for RT.
+
+        :Returns:
+            :rtype: tuple of np.array
+            :return: Position of the feature and position of the compound on
+                the index for every match.
+
+        """
+        # m/z window of every feature
+        mzMin = mz - MZCut
+        mzMax = mz + MZCut
+        start = np.searchsorted(self.mz, mzMin, side="right")
+        stop = np.searchsorted(self.mz, mzMax, side="left")
+        counts = np.maximum(stop - start, 0)
+
+        # Expanding the windows into candidate pairs
+        feature = np.repeat(np.arange(len(mz)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        compound = np.repeat(start, counts) + offsets
+
+        # Keeping candidates inside both windows
+        keep = ((mzMin[feature] < self.mz[compound]) &
+                (self.mz[compound] < mzMax[feature]) &
+                (rt[feature] - RTCut < self.rt[compound]) &
+                (self.rt[compound] < rt[feature] + RTCut))
+
+        return feature[keep], compound[keep]
+
+    def identify(self, target, MZCut, RTCut):
+        """ Identify the features of a target file.
+
+        When more than one compound matches a feature, the one found last on
+        the original library file is reported.
+
+        :Arguments:
+            :param annoFormat target: Target features loaded with annoFormat.
+
+            :param float MZCut: Window size for m/z.
+
+            :param float RTCut: Window size for RT.
+
+        :Returns:
+            :rtype: pd.DataFrame
+            :return: Target features with the compound name and its
+                annotations. Features not identified are left blank.
+
+        """
+        # Finding all the matches in bulk
+        feature, compound = self.query(
+            mz=target.data[target.mz].values.astype(float),
+            rt=target.data[target.rt].values.astype(float),
+            MZCut=MZCut, RTCut=RTCut)
+
+        # Keeping the last compound of the original library for every feature
+        best = np.full(len(target.data), -1, dtype=int)
+        np.maximum.at(best, feature, self.position[compound])
+        found = best > -1
+
+        # Index of the selected compounds on the sorted library
+        rank = np.empty(len(self.position), dtype=int)
+        rank[self.position] = np.arange(len(self.position))
+        selected = rank[best[found]]
+
+        # Building identified table
+        identified_df = target.data.astype(object)
+        for column, values in [("compound", self.data.index.values)] + \
+                [(column, self.data[column].values) for column in self.anno]:
+            identified = np.empty(len(target.data), dtype=object)
+            identified[:] = np.nan
+            identified[found] = values[selected]
+            identified_df[column] = identified
+
+        return identified_df
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+# Add-on packages
+import numpy as np
+import pandas as pd
+
+
+def roundHalfAway(values, decimals=0):
+    """ Round an array the same way as the built-in round of python 2, halves
+    of the exact decimal value are rounded away from zero (e.g. 1.2345 is
+    stored as 1.23449999... so it is rounded to 1.234). Missing values are
+    kept.
+
+    Values are rounded on arrays by scaling them, only the values that are
+    within rounding error of a half after scaling are rounded one by one
+    with the built-in round.
+
+    :Arguments:
+        :param np.array values: Values to round.
+
+        :param int decimals: Number of decimals to keep, a single number or
+            one for every value.
+
+    :Returns:
+        :rtype: np.array
+        :return: Rounded values.
+
+    """
+    values = np.asarray(values, dtype=float)
+    decimals = np.broadcast_to(np.asarray(decimals, dtype=int), values.shape)
+    scale = 10.0 ** np.abs(decimals)
+
+    # Round on the absolute values scaled to the decimals to keep
+    with np.errstate(invalid="ignore", over="ignore"):
+        scaled = np.where(decimals >= 0, np.abs(values) * scale,
+                          np.abs(values) / scale)
+        rounded = np.floor(scaled + 0.5)
+        result = np.copysign(np.where(decimals >= 0, rounded / scale,
+                                      rounded * scale), values)
+
+        # Values without digits to round are kept
+        whole = scaled >= 2 ** 52
+        result[whole] = values[whole]
+
+        # Values close to a half after scaling are rounded on their exact
+        # decimal value
+        near = ~whole & (np.abs(scaled - np.floor(scaled) - 0.5) <=
+                         1e-9 + scaled * 1e-15)
+    for index in zip(*np.nonzero(near)):
+        result[index] = round(values[index], int(decimals[index]))
+    return result
+
+
+def percentileName(q):
+    """ Name of the column holding a percentile on the summary of summarizeRows.
+
+    :Arguments:
+        :param float q: Percentile between 0 and 100.
+
+    :Returns:
+        :rtype: str
+        :return: 'median' for the 50th percentile, otherwise 'p' followed by the
+            percentile with two digits (e.g. 'p05', 'p95').
+
+    """
+    if q == 50:
+        return "median"
+    return "p{0:02d}".format(int(q))
+
+
+def summarizeRows(wide, percentiles=(), ddof=1):
+    """ Summary statistics of every row of a wide dataset.
+
+    All the statistics are computed on arrays for all the rows at once and
+    ignore missing values, like the pandas methods. If percentiles are
+    requested every row is sorted only once and the percentiles are
+    interpolated linearly between the closest ranks, like np.nanpercentile.
+
+    :Arguments:
+        :param pd.DataFrame wide: Wide dataset, statistics are computed for
+            every row.
+
+        :param tuple percentiles: Percentiles between 0 and 100 to compute.
+            The 50th percentile is computed as the median.
+
+        :param int ddof: Delta degrees of freedom of the standard deviation.
+
+    :Returns:
+        :rtype: pd.DataFrame
+        :return: Table with the same index as wide and the columns count, min,
+            max, mean, std, cv and one column for every percentile (see
+            percentileName).
+
+    """
+    values = np.asarray(wide, dtype=float)
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=1)
+
+    # Mean and standard deviation (two-pass)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(valid, values, 0).sum(axis=1) / count
+        deviation = np.where(valid, values - mean[:, np.newaxis], 0)
+        std = np.sqrt((deviation ** 2).sum(axis=1) / (count - ddof))
+    std[count - ddof <= 0] = np.nan
+
+    summary = pd.DataFrame(index=getattr(wide, "index", None))
+    summary["count"] = count
+
+    if len(percentiles):
+        # Missing values are sorted to the end of every row
+        ranked = np.sort(values, axis=1)
+        rows = np.arange(len(ranked))
+        last = np.maximum(count - 1, 0)
+        summary["min"] = ranked[:, 0]
+        summary["max"] = ranked[rows, last]
+        for q in percentiles:
+            if q == 50:
+                low = last // 2
+                high = count // 2
+                stat = (ranked[rows, low] + ranked[rows, high]) / 2.0
+            else:
+                position = q / 100.0 * last
+                low = np.floor(position).astype(int)
+                high = np.ceil(position).astype(int)
+                above = position - low
+                stat = ranked[rows, low] * (1 - above) + ranked[rows, high] * above
+            summary[percentileName(q)] = stat
+    else:
+        summary["min"] = np.fmin.reduce(values, axis=1)
+        summary["max"] = np.fmax.reduce(values, axis=1)
+
+    summary["mean"] = mean
+    summary["std"] = std
+    with np.errstate(invalid="ignore", divide="ignore"):
+        summary["cv"] = std / mean
+    return summary
+
+
+def summarizeGroups(wide, labels, ddof=1):
+    """ Mean, standard deviation and coefficient of variation of every row
+    within every group of columns.
+
+    Columns are sorted by group once and every statistic is a segment
+    reduction (np.add.reduceat) over the groups, so all the groups are
+    summarized together. Missing values are ignored, like summarizeRows.
+
+    :Arguments:
+        :param pd.DataFrame wide: Wide dataset, statistics are computed for
+            every row.
+
+        :param np.array labels: Group of every column of wide.
+
+        :param int ddof: Delta degrees of freedom of the standard deviation.
+
+    :Returns:
+        :rtype: tuple of pd.DataFrame
+        :return: Mean, standard deviation and CV with the same index as wide
+            and one column for every group, sorted by group name.
+
+    """
+    values = np.asarray(wide, dtype=float)
+    names, codes = np.unique(np.asarray(labels), return_inverse=True)
+
+    # Sort columns by group, keeping their order inside every group
+    order = np.argsort(codes, kind="mergesort")
+    values = values[:, order]
+    sizes = np.bincount(codes, minlength=len(names))
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    valid = ~np.isnan(values)
+    count = np.add.reduceat(valid.astype(int), starts, axis=1)
+
+    # Mean and standard deviation (two-pass)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.add.reduceat(np.where(valid, values, 0), starts, axis=1) / count
+        deviation = np.where(valid, values - np.repeat(mean, sizes, axis=1), 0)
+        std = np.sqrt(np.add.reduceat(deviation ** 2, starts, axis=1) /
+                      (count - ddof))
+        cv = std / mean
+    std[count - ddof <= 0] = np.nan
+    cv[count - ddof <= 0] = np.nan
+
+    index = getattr(wide, "index", None)
+    return tuple(pd.DataFrame(stat, index=index, columns=names)
+                 for stat in (mean, std, cv))
+
+
+if __name__ == '__main__':
+    pass
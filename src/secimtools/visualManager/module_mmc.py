@@ -5,9 +5,12 @@ This is related to the MMC paper.
 from __future__ import print_function, division, absolute_import
 
 from functools import partial
+from multiprocessing import Pool
 
 import numpy as np
 import scipy.linalg
+from scipy.sparse.linalg import LinearOperator, eigsh, lobpcg
+from scipy.sparse.linalg import ArpackNoConvergence
 from numpy.testing import assert_equal, assert_allclose
 
 
@@ -23,26 +26,40 @@ In this module, the cost function is assumed to take a specific form:
 the negative of the sum of within-cluster signed edge values.
 
 """
-__all__ = ['faster_refinement']
+__all__ = ['faster_refinement', 'refine_bipartition']
 
 
-def _faster_single_refinement(M, alpha, beta):
+def refine_bipartition(A, v, d, threshold, alpha, beta, batch=1, budget=None):
     """
+    Kernighan-Lin style refinement of a bipartition of a modularity matrix.
+
+    The modularity matrix B = A - v v' / d is never formed. For every vertex
+    the sums of its edge values to each set are kept, so the gain of moving
+    any vertex is known and is updated in O(p) after each move using a
+    single column of A. A full pass over p vertices costs O(p^2).
 
     Parameters
     ----------
-    M : 2d array of edge values
-        Larger positive values are evidence of shared cluster membership.
-        In particular, the value of the bipartition is the sum of the edge
-        values within the first cluster plus the sum of the edge values
-        within the second cluster.
-        The cost of the bipartition is the negative of its value.
+    A : 2d array of affinities
+        Symmetric matrix of affinities.
+    v : 1d array
+        Row sums of the affinity matrix.
+    d : float
+        Sum of entries of the affinity matrix.
+    threshold : float
+        Cost differences smaller than this value are considered negligible.
     alpha : set
         First set in the initial bipartition.
-        This is a set of indices of M.
+        This is a set of indices of A.
     beta : set
         Second set in the initial bipartition.
-        This is a set of indices of M.
+        This is a set of indices of A.
+    batch : int
+        Number of best vertices moved after each scan of the gains.
+        Gains are updated after every single move and a vertex is only
+        moved if its move still improves the cost.
+    budget : int
+        Maximum number of moves, None for no limit.
 
     Returns
     -------
@@ -51,60 +68,80 @@ def _faster_single_refinement(M, alpha, beta):
     final_cost : float
         Cost of the maximal bipartition.
     a : set
-        First set of the refined bipartition.
+        First set of the maximal bipartition.
     b : set
-        Second set of the refined bipartition.
+        Second set of the maximal bipartition.
 
     """
-    # Precompute functions of the blocks of M corresponding to the bipartition.
-    ia = np.array(list(alpha), dtype=int)
-    ib = np.array(list(beta), dtype=int)
-    A = M[np.ix_(ia, ia)]
-    B = M[np.ix_(ib, ib)]
-    AB = M[np.ix_(ia, ib)]
-    vaa = A.sum(axis=0)
-    vbb = B.sum(axis=0)
-    vab = AB.sum(axis=0) + np.diag(B)
-    vba = AB.sum(axis=1) + np.diag(A)
-    a_move_improvements = vba - vaa
-    b_move_improvements = vab - vbb
-    initial_cost = -(vaa.sum() + vbb.sum())
-
-    # Check each move from the first set to the second set,
-    # and from the second set to the first set.
-    best_improvement = 0
-    best_pair = alpha, beta
-    for i, a in enumerate(ia):
-        improvement = a_move_improvements[i]
-        if improvement > best_improvement:
-            best_improvement = improvement
-            best_pair = alpha - {a}, beta | {a}
-    for i, b in enumerate(ib):
-        improvement = b_move_improvements[i]
-        if improvement > best_improvement:
-            best_improvement = improvement
-            best_pair = alpha | {b}, beta - {b}
-
-    # Return the best improvement and the corresponding bipartition.
+    # Affinities of the vertices in the bipartition.
+    selection = np.array(sorted(alpha | beta), dtype=int)
+    As = A[np.ix_(selection, selection)]
+    vs = v[selection]
+    in_a = np.in1d(selection, list(alpha))
+    diag = np.diag(As) - vs * vs / d
+
+    # Sums of the edge values from every vertex to each set.
+    s_a = As[:, in_a].sum(axis=1) - vs * vs[in_a].sum() / d
+    s_b = As[:, ~in_a].sum(axis=1) - vs * vs[~in_a].sum() / d
+    initial_cost = -(s_a[in_a].sum() + s_b[~in_a].sum())
+
+    # Move vertices while the cost improves.
     # The 2x factor is related to the fact that the matrix is symmetric.
-    best_cost = initial_cost - 2*best_improvement
-    return initial_cost, best_cost, best_pair[0], best_pair[1]
+    moves = 0
+    while budget is None or moves < budget:
+        gain = np.where(in_a, s_b - s_a, s_a - s_b) + diag
+        if batch == 1:
+            order = [gain.argmax()]
+        else:
+            order = np.argsort(-gain, kind='mergesort')[:batch]
+        moved = False
+        for x in order:
+            if in_a[x]:
+                g = s_b[x] - s_a[x] + diag[x]
+            else:
+                g = s_a[x] - s_b[x] + diag[x]
+            if g <= 0 or 2*g < threshold:
+                break
+            column = As[:, x] - vs * vs[x] / d
+            if in_a[x]:
+                s_a -= column
+                s_b += column
+            else:
+                s_a += column
+                s_b -= column
+            in_a[x] = not in_a[x]
+            moves += 1
+            moved = True
+            if budget is not None and moves >= budget:
+                break
+        if not moved:
+            break
+    final_cost = -(s_a[in_a].sum() + s_b[~in_a].sum())
+    return initial_cost, final_cost, set(selection[in_a]), set(selection[~in_a])
 
 
-def faster_refinement(M, threshold, alpha, beta):
+def faster_refinement(M, threshold, alpha, beta, batch=1, budget=None):
     """
-    Repeatedly apply single refinment steps until no improvement is found.
+    Repeatedly move the best vertex until no improvement is found.
 
     Parameters
     ----------
     M : 2d array of edge values
         Larger positive values are evidence of shared cluster membership.
+        In particular, the value of the bipartition is the sum of the edge
+        values within the first cluster plus the sum of the edge values
+        within the second cluster.
+        The cost of the bipartition is the negative of its value.
     threshold : float
         Cost differences smaller than this value are considered negligible.
     alpha : set
         First set in the initial bipartition.
     beta : set
         Second set in the initial bipartition.
+    batch : int
+        Number of best vertices moved after each scan of the gains.
+    budget : int
+        Maximum number of moves, None for no limit.
 
     Returns
     -------
@@ -118,18 +155,9 @@ def faster_refinement(M, threshold, alpha, beta):
         Second set of the maximal bipartition.
 
     """
-    initial_cost = None
-    cost = None
-    a, b = alpha, beta
-    while True:
-        icost, fcost, na, nb = _faster_single_refinement(M, a, b)
-        if initial_cost is None:
-            initial_cost = icost
-            cost = icost
-        if icost - fcost < threshold:
-            break
-        cost, a, b = fcost, na, nb
-    return initial_cost, cost, a, b
+    # M is a modularity matrix with no rank one correction.
+    return refine_bipartition(M, np.zeros(M.shape[0]), 1, threshold,
+            alpha, beta, batch=batch, budget=budget)
 
 
 
@@ -137,10 +165,45 @@ def ClusteringError(Exception):
     pass
 
 
-def max_eigenpair(M):
-    # M is a symmetric matrix.
+# Clusters up to this size are solved with a dense eigensolver.
+DENSE_EIGEN_SIZE = 256
+
+# Number of Lanczos vectors and relative tolerance of the iterative solver.
+LANCZOS_NCV = 40
+LANCZOS_TOL = 1e-8
+
+
+def start_vector(warm, selection):
+    # Starting vector of the iterative eigensolver for a cluster.
+    # warm is the eigenvector of the parent cluster, its restriction to the
+    # cluster is used after removing the constant component, which is in the
+    # null space of the operator. A fixed pseudo-random vector is used at the
+    # first level or if the restriction is constant.
+    m = selection.size
+    if warm is not None:
+        v0 = warm[selection] - warm[selection].mean()
+        if np.linalg.norm(v0) > 1e-8:
+            return v0
+    v0 = np.random.RandomState(0).rand(m)
+    return v0 - v0.mean()
+
+
+def max_eigenpair(M, v0=None):
+    # M is a symmetric matrix or a LinearOperator.
+    # v0 is the starting vector for the iterative eigensolver.
     m = M.shape[0]
-    W, V = scipy.linalg.eigh(M, eigvals=(m-1, m-1))
+    if m <= DENSE_EIGEN_SIZE:
+        if isinstance(M, LinearOperator):
+            M = M.matmat(np.eye(m))
+        W, V = scipy.linalg.eigh(M, eigvals=(m-1, m-1))
+        return W[0], V[:, 0]
+    try:
+        # Lanczos iterations, only products with M are needed.
+        W, V = eigsh(M, k=1, which='LA', v0=v0, ncv=min(m - 1, LANCZOS_NCV),
+                tol=LANCZOS_TOL)
+    except ArpackNoConvergence:
+        # Fall back to LOBPCG from the same starting vector.
+        W, V = lobpcg(M, v0.reshape(m, 1), tol=1e-8, maxiter=m, largest=True)
     return W[0], V[:, 0]
 
 
@@ -153,6 +216,28 @@ def expansion(v):
     return S
 
 
+def cluster_operator(A, v, d, selection):
+    # Implicit modularity matrix of a cluster with its row sums subtracted
+    # from the diagonal, B_ss - diag(B_ss 1) where B = A - v v' / d.
+    # Only the affinities inside the cluster are used, B is never formed.
+    # Also returns the row sums of B_ss.
+    As = A[np.ix_(selection, selection)]
+    vs = v[selection]
+    r = As.sum(axis=1) - vs * vs.sum() / d
+
+    def apply(x):
+        return As.dot(x) - np.multiply.outer(vs, vs.dot(x)) / d - (r * x.T).T
+
+    m = selection.size
+    M = LinearOperator((m, m), matvec=apply, matmat=apply, dtype=As.dtype)
+    return M, r
+
+
+def cluster_sum(A, v, d, selection):
+    # Sum of the entries of B_ss, the modularity matrix of a cluster.
+    return A[np.ix_(selection, selection)].sum() - v[selection].sum()**2 / d
+
+
 def modularity_matrix(A):
     # Also returns the sum of entries of A.
     v = A.sum(axis=1)
@@ -169,6 +254,14 @@ def modularity(B, d, v):
     return np.trace(S.T.dot(B).dot(S)) / d
 
 
+def affinity_modularity(A, v, d, clustering):
+    # Same as modularity, computed from the affinity matrix A and its row
+    # sums v so the modularity matrix is never formed.
+    S = expansion(clustering)
+    w = S.T.dot(v)
+    return (np.trace(S.T.dot(A).dot(S)) - w.dot(w) / d) / d
+
+
 def modulated_affinity_matrix(R, s):
     # s is a tuning parameter that indirectly controls the number of clusters
     # Note that although the matrix that is returned by this function
@@ -180,25 +273,29 @@ def modulated_affinity_matrix(R, s):
     return A
 
 
-def recursive_clustering(B, d, i, clustering, use_refinement):
-    # B is the immutable modulated modularity matrix.
+def recursive_clustering(A, v, d, i, clustering, use_refinement, warm=None,
+        batch=1, budget=None):
+    # A is the immutable modulated affinity matrix.
+    # v is the vector of row sums of A.
     # d is the sum of entries of the affinity matrix.
     # i is an integer indicating the cluster of interest.
     # clustering is the mutable vector of cluster assignments.
     # use_refinement is a flag for iterative refinement after the spectral step.
+    # warm is the eigenvector of the parent cluster, used as starting point.
+    # batch and budget control the moves of the refinement.
+    # The modularity matrix B = A - v v' / d is only applied implicitly.
     p = clustering.shape[0]
     k = clustering.max() + 1
     mask = clustering == i
     selection = np.arange(p, dtype=int)[mask]
-    M = B[np.ix_(mask, mask)]
-    nosplit_cost = -M.sum()
-    M = M - np.diag(M.sum(axis=1))
-    w, v = max_eigenpair(M)
+    M, r = cluster_operator(A, v, d, selection)
+    nosplit_cost = -r.sum()
+    w, u = max_eigenpair(M, start_vector(warm, selection))
     optimality_threshold = 1e-4
     eigen_eps = 1e-8
     if w < eigen_eps:
         return clustering
-    m0 = (v < 0)
+    m0 = (u < 0)
     m1 = np.logical_not(m0)
     if not np.any(m0) or not np.any(m1):
         return clustering
@@ -208,11 +305,10 @@ def recursive_clustering(B, d, i, clustering, use_refinement):
 
     a, b = set(sel0), set(sel1)
     if use_refinement:
-        ci, cf, a, b = faster_refinement(B, optimality_threshold, a, b)
+        ci, cf, a, b = refine_bipartition(A, v, d, optimality_threshold, a, b,
+                batch=batch, budget=budget)
     else:
-        B0 = B[np.ix_(sel0, sel0)]
-        B1 = B[np.ix_(sel1, sel1)]
-        cf = -(B0.sum() + B1.sum())
+        cf = -(cluster_sum(A, v, d, sel0) + cluster_sum(A, v, d, sel1))
     new_clustering = clustering.copy()
     new_clustering[list(a)] = i
     new_clustering[list(b)] = k
@@ -226,47 +322,95 @@ def recursive_clustering(B, d, i, clustering, use_refinement):
             raise ClusteringError
         if not nk:
             raise ClusteringError
+        # Eigenvector of this cluster, to warm start the next levels.
+        warm = np.zeros(p)
+        warm[selection] = u
         if ni > 1:
             clustering = recursive_clustering(
-                    B, d, i, clustering, use_refinement)
+                    A, v, d, i, clustering, use_refinement, warm, batch, budget)
         if nk > 1:
             clustering = recursive_clustering(
-                    B, d, k, clustering, use_refinement)
+                    A, v, d, k, clustering, use_refinement, warm, batch, budget)
     else:
         # Revert the split.
         clustering[sel1] = i
     return clustering
 
 
-def get_clustering(C, sigmas):
+def sigma_clustering(C, sigma):
+    # Clustering without refinement for a single value of sigma.
+    p = C.shape[0]
+    A = modulated_affinity_matrix(C, sigma)
+    # A is symmetric.
+    v = A.sum(axis=1)
+    d = v.sum()
+    clustering = np.zeros(p, dtype=int)
+    # Do not use refinement while search over the values of sigma.
+    clustering = recursive_clustering(A, v, d, 0, clustering, False)
+    m = affinity_modularity(A, v, d, clustering)
+    return clustering, m
+
+
+# Correlation matrix shared read-only by the workers of the sigma sweep.
+_sweep_C = None
+
+
+def _init_sweep(C):
+    # Each worker receives the correlation matrix once, not once per sigma.
+    global _sweep_C
+    _sweep_C = C
+
+
+def _sweep_worker(sigma):
+    return sigma_clustering(_sweep_C, sigma)
+
+
+def get_clustering(C, sigmas, jobs=1, patience=None, batch=1, budget=None):
+    # jobs is the number of processes used to search over the values of sigma.
+    # patience, if given, stops the search after that many consecutive values
+    # of sigma without an improvement of the modularity.
+    # Values of sigma are always examined in order, so the best clustering
+    # does not depend on the number of jobs.
+    # batch and budget control the moves of the final refinement, see
+    # refine_bipartition.
     p = C.shape[0]
     best_clustering = None
     best_sigma = None
     best_m = None
-    for i, sigma in enumerate(sigmas):
-        A = modulated_affinity_matrix(C, sigma)
-        # A is symmetric.
-        d = A.sum()
-        B = modularity_matrix(A)
-        # B is symmetric with row and column sums equal to zero.
-        clustering = np.zeros(p, dtype=int)
-        # Do not use refinement while search over the values of sigma.
-        clustering = recursive_clustering(B, d, 0, clustering, False)
-        m = modularity(B, d, clustering)
-        if best_m is None or m > best_m:
-            best_clustering = clustering
-            best_sigma = sigma
-            best_m = m
-        k = clustering.max() + 1
+    pool = None
+    if jobs > 1 and len(sigmas) > 1:
+        pool = Pool(processes=min(jobs, len(sigmas)),
+                initializer=_init_sweep, initargs=(C,))
+        results = pool.imap(_sweep_worker, sigmas)
+    else:
+        results = (sigma_clustering(C, sigma) for sigma in sigmas)
+    try:
+        stale = 0
+        for i, (clustering, m) in enumerate(results):
+            sigma = sigmas[i]
+            if best_m is None or m > best_m:
+                best_clustering = clustering
+                best_sigma = sigma
+                best_m = m
+                stale = 0
+            else:
+                stale += 1
+                if patience is not None and stale >= patience:
+                    break
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
     # Re-compute the clustering with refinement,
     # using the optimal sigma found without refinement.
     A = modulated_affinity_matrix(C, best_sigma)
-    d = A.sum()
-    B = modularity_matrix(A)
+    v = A.sum(axis=1)
+    d = v.sum()
     clustering = np.zeros(p, dtype=int)
-    best_clustering = recursive_clustering(B, d, 0, clustering, True)
-    best_m = modularity(B, d, best_clustering)
+    best_clustering = recursive_clustering(A, v, d, 0, clustering, True,
+            batch=batch, budget=budget)
+    best_m = affinity_modularity(A, v, d, best_clustering)
 
     # Return the clustering information.
     return best_clustering, best_sigma, best_m
@@ -69,6 +69,7 @@ setup(name='secimtools',
     'scripts/random_forest.py',
     'scripts/remove_selected_features_samples.py',
     'scripts/retention_time_flags.py',
+    'scripts/run_order_drift_correction.py',
     'scripts/run_order_regression.py',
     'scripts/scatter_plot_2D.py',
     'scripts/scatter_plot_3D.py',